@@ -0,0 +1,205 @@
+from __future__ import print_function
+import os
+import json
+import resource
+import multiprocessing
+from six.moves import queue
+import tensorflow as tf
+from timeit import default_timer as timer
+import problems
+import meta_optimizers
+import optimizers
+import config
+
+# Steps/sec benchmark of the meta optimizers (and Adam as the baseline) on the standard problems. Every case runs in
+# its own process, so graph build time, warm up time and peak RSS are those of the case alone. Results are stored as
+# JSON and compared against a stored baseline, slower or larger cases than the baseline are flagged.
+
+cifar_path = '../../../cifar/'
+
+
+def l2l2_args():
+    args = config.common()
+    args.update(config.l2l2())
+    return args
+
+
+def template_args(config_fn):
+    def args_fn():
+        args = config_fn()
+        args['network_template'] = True
+        return args
+    return args_fn
+
+
+optimizer_cases = {
+    'MlpNormHistory': (meta_optimizers.MlpNormHistory, config.mlp_norm_history),
+    'GRUNormHistory': (meta_optimizers.GRUNormHistory, config.mlp_norm_history_rnn),
+    'MlpNormHistory_template': (meta_optimizers.MlpNormHistory, template_args(config.mlp_norm_history)),
+    'AUGOptims': (meta_optimizers.AUGOptims, config.aug_optim),
+    'AUGOptims_template': (meta_optimizers.AUGOptims, template_args(config.aug_optim)),
+    'AUGOptimsRNN': (meta_optimizers.AUGOptimsRNN, config.aug_optim_rnn),
+    'AUGOptimsGRUAll': (meta_optimizers.AUGOptimsGRUAll, config.aug_optim_gru),
+    'L2L2': (meta_optimizers.L2L2, l2l2_args),
+    'Adam': (optimizers.Adam, config.adam)
+}
+
+# build(mode='inference') of these optimizers, only the update ops
+inference_cases = {
+    'MlpNormHistory_inference': 'MlpNormHistory',
+    'AUGOptims_inference': 'AUGOptims',
+    'AUGOptimsRNN_inference': 'AUGOptimsRNN'
+}
+
+problem_cases = {
+    'Rosenbrock': problems.problem_factory('Rosenbrock', {'prefix': 'bench', 'minval': -10, 'maxval': 10}),
+    'ElementwiseSquare_1e3': problems.problem_factory('ElementwiseSquare', {'prefix': 'bench', 'dims': 1000,
+                                                                            'minval': -10.0, 'maxval': 10.0}),
+    'ElementwiseSquare_1e6': problems.problem_factory('ElementwiseSquare', {'prefix': 'bench', 'dims': 1000000,
+                                                                            'minval': -10.0, 'maxval': 10.0}),
+    'Mnist_mlp': problems.problem_factory('Mnist', {'prefix': 'bench', 'minval': -100.0, 'maxval': 100.0,
+                                                    'conv': False, 'full': False}),
+    'Mnist_conv': problems.problem_factory('Mnist', {'prefix': 'bench', 'minval': -100.0, 'maxval': 100.0,
+                                                     'conv': True, 'full': False}),
+    'cifar10_small': problems.problem_factory('cifar10', {'prefix': 'bench', 'minval': -100.0, 'maxval': 100.0,
+                                                          'conv': True, 'full': False, 'path': cifar_path})
+}
+
+
+def case_name(optimizer_name, problem_name):
+    return optimizer_name + '/' + problem_name
+
+
+def run_case(optimizer_name, problem_name, warm_up_steps, steps):
+    inference = optimizer_name in inference_cases
+    optimizer_class, config_fn = optimizer_cases[inference_cases[optimizer_name] if inference else optimizer_name]
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.set_random_seed(0)
+        start = timer()
+        problem = problem_cases[problem_name]()
+        optim = optimizer_class(problem, config_fn()) if optimizer_class is optimizers.Adam else \
+            optimizer_class([problem], [], args=config_fn())
+        if inference:
+            optim.build(mode='inference')
+        else:
+            optim.build()
+        build_time = timer() - start
+        if optimizer_class is optimizers.Adam:
+            step = lambda: session.run(optim.ops_updates)
+        else:
+            step = lambda: optim.run({'train': True})
+        with tf.Session() as session:
+            start = timer()
+            session.run(tf.global_variables_initializer())
+            optim.set_session(session)
+            optim.run_init()
+            graph.finalize()
+            for warm_up_step in range(warm_up_steps):
+                step()
+            warm_up_time = timer() - start
+            start = timer()
+            for curr_step in range(steps):
+                step()
+            steps_time = timer() - start
+    return {'build_time': build_time, 'warm_up_time': warm_up_time, 'steps_per_sec': steps / steps_time,
+            'graph_def_bytes': graph.as_graph_def().ByteSize(),
+            # kilobytes on linux
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0}
+
+
+def case_process(optimizer_name, problem_name, warm_up_steps, steps, results_queue):
+    try:
+        results_queue.put(run_case(optimizer_name, problem_name, warm_up_steps, steps))
+    except Exception as error:
+        results_queue.put({'error': repr(error)})
+
+
+def case_result(process, results_queue, poll_interval=5.0, timeout=None):
+    # the result of a case process, or {'error': ...} if it died without one (OOM kill, segfault) or ran longer than
+    # timeout seconds
+    start = timer()
+    while True:
+        try:
+            return results_queue.get(timeout=poll_interval)
+        except queue.Empty:
+            pass
+        if not process.is_alive():
+            # the result may have been put right before the process exited
+            try:
+                return results_queue.get(timeout=poll_interval)
+            except queue.Empty:
+                return {'error': 'case process exited with code ' + str(process.exitcode)}
+        if timeout is not None and timer() - start > timeout:
+            process.terminate()
+            return {'error': 'case timed out after ' + str(timeout) + 's'}
+
+
+def benchmark(optimizer_names=None, problem_names=None, warm_up_steps=20, steps=200, timeout=None):
+    optimizer_names = sorted(optimizer_cases) + sorted(inference_cases) if optimizer_names is None else optimizer_names
+    problem_names = sorted(problem_cases) if problem_names is None else problem_names
+    results = {}
+    for optimizer_name in optimizer_names:
+        for problem_name in problem_names:
+            results_queue = multiprocessing.Queue()
+            process = multiprocessing.Process(target=case_process, args=(optimizer_name, problem_name,
+                                                                         warm_up_steps, steps, results_queue))
+            process.start()
+            result = case_result(process, results_queue, timeout=timeout)
+            process.join()
+            results[case_name(optimizer_name, problem_name)] = result
+            print(case_name(optimizer_name, problem_name), result)
+    return results
+
+
+def compare(results, baseline, tolerance=0.1):
+    # flags cases that got slower (steps/sec, build time) or larger (peak RSS) than the baseline by more than tolerance
+    for name, result in results.items():
+        if 'error' in result or name not in baseline or 'error' in baseline[name]:
+            continue
+        base = baseline[name]
+        result['regressions'] = [key for key, worse in
+                                 [('steps_per_sec', result['steps_per_sec'] < base['steps_per_sec'] * (1 - tolerance)),
+                                  ('build_time', result['build_time'] > base['build_time'] * (1 + tolerance)),
+                                  ('peak_rss_mb', result['peak_rss_mb'] > base['peak_rss_mb'] * (1 + tolerance))]
+                                 if worse]
+        result['speedup'] = result['steps_per_sec'] / base['steps_per_sec']
+    return results
+
+
+def print_results(results):
+    print('CASE'.ljust(40) + 'BUILD S'.rjust(10) + 'WARM UP S'.rjust(10) + 'STEPS/S'.rjust(10) +
+          'RSS MB'.rjust(10) + '  REGRESSIONS')
+    for name in sorted(results):
+        result = results[name]
+        if 'error' in result:
+            print(name.ljust(40) + '  ERROR ' + result['error'])
+            continue
+        print(name.ljust(40) + '{:10.2f}{:10.2f}{:10.1f}{:10.0f}'.format(
+            result['build_time'], result['warm_up_time'], result['steps_per_sec'], result['peak_rss_mb']) +
+              '  ' + ', '.join(result['regressions'] if 'regressions' in result else []))
+
+
+if __name__ == '__main__':
+    results_path = os.path.join('benchmarks', 'results.json')
+    baseline_path = os.path.join('benchmarks', 'baseline.json')
+    save_as_baseline = False
+    #########################
+    optimizer_names = None
+    problem_names = None
+    warm_up_steps = 20
+    steps = 200
+    #########################
+
+    results = benchmark(optimizer_names, problem_names, warm_up_steps, steps)
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as baseline_file:
+            results = compare(results, json.load(baseline_file))
+    print_results(results)
+    if not os.path.exists('benchmarks'):
+        os.makedirs('benchmarks')
+    for path in [results_path] + ([baseline_path] if save_as_baseline else []):
+        with open(path, 'w') as results_file:
+            json.dump(results, results_file, indent=2, sort_keys=True)
+    if any(['regressions' in result and result['regressions'] for result in results.values()]):
+        print('REGRESSIONS FOUND')
@@ -0,0 +1,58 @@
+from __future__ import print_function
+import tensorflow as tf
+from tensorflow.python.framework import graph_util
+from tensorflow.python.util import nest
+import numpy as np
+import problems
+import meta_optimizers
+import config
+
+# Compares first order meta training (config first_order) against the full second order meta gradients on Mnist.
+# ops per step counts the graph nodes a training step (loss + meta step + updates) actually executes, the final loss
+# is the mean log10 loss of the last eval_average steps of a fresh problem optimized by the meta trained optimizer.
+meta_steps = 2000
+warm_up_steps = 20
+eval_steps = 1000
+eval_average = 100
+
+
+def fetch_names(fetches):
+    return list(set([fetch.name.split(':')[0] for fetch in nest.flatten(fetches)
+                     if hasattr(fetch, 'name')]))
+
+
+def benchmark(optimizer_class, config_args, first_order):
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.set_random_seed(0)
+        config_args = dict(config_args)
+        config_args['first_order'] = first_order
+        problem = problems.Mnist({'prefix': 'train', 'minval': 0, 'maxval': 100, 'conv': False, 'full': False})
+        optim = optimizer_class([problem], [], args=config_args)
+        optim.build()
+        fetches = [optim.ops_loss_train, optim.ops_loss_problem_train, optim.ops_updates_train]
+        fetches.append(optim.ops_meta_step_train if optim.ops_meta_step_train is not None else optim.ops_meta_step)
+        step_graph = graph_util.extract_sub_graph(graph.as_graph_def(), fetch_names(fetches))
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            optim.set_session(sess)
+            optim.run_init()
+            for _ in range(warm_up_steps):
+                optim.run({'train': True})
+            total_time = 0
+            for _ in range(meta_steps - warm_up_steps):
+                time, _, _ = optim.run({'train': True})
+                total_time += time
+            optim.run_reset()
+            eval_losses = []
+            for _ in range(eval_steps):
+                loss_prob, _ = sess.run([optim.ops_loss_problem_train, optim.ops_updates_train])
+                eval_losses.append(np.mean(loss_prob))
+    return len(step_graph.node), (meta_steps - warm_up_steps) / total_time, np.log10(np.mean(eval_losses[-eval_average:]))
+
+for name, optimizer_class, config_args in [['MlpNormHistoryRNN', meta_optimizers.MlpNormHistoryRNN, config.mlp_norm_history_rnn()],
+                                           ['AUGOptimsRNN', meta_optimizers.AUGOptimsRNN, config.aug_optim_rnn()]]:
+    for first_order in [False, True]:
+        ops_per_step, steps_per_sec, final_loss = benchmark(optimizer_class, config_args, first_order)
+        print(name, 'first_order:', first_order, 'ops per step:', ops_per_step, 'meta steps/sec:',
+              np.round(steps_per_sec, 2), 'final log10 loss:', np.round(final_loss, 3))
@@ -0,0 +1,49 @@
+from __future__ import print_function
+import tensorflow as tf
+from tensorflow.python.framework import graph_util
+from tensorflow.python.util import nest
+import numpy as np
+import problems
+import meta_optimizers
+import config
+
+# Compares the per variable optimizer loops against the packed flat_state engine.
+# ops per step counts the graph nodes a training step (loss + meta step + updates) actually executes.
+steps = 500
+warm_up_steps = 20
+
+
+def fetch_names(fetches):
+    return list(set([fetch.name.split(':')[0] for fetch in nest.flatten(fetches)
+                     if hasattr(fetch, 'name')]))
+
+
+def benchmark(optimizer_class, config_args, flat_state):
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.set_random_seed(0)
+        config_args = dict(config_args)
+        config_args['flat_state'] = flat_state
+        problem = problems.Mnist({'prefix': 'train', 'minval': 0, 'maxval': 100, 'conv': False, 'full': False})
+        optim = optimizer_class([problem], [], args=config_args)
+        optim.build()
+        fetches = [optim.ops_loss_train, optim.ops_loss_problem_train, optim.ops_updates_train]
+        fetches.append(optim.ops_meta_step_train if optim.ops_meta_step_train is not None else optim.ops_meta_step)
+        step_graph = graph_util.extract_sub_graph(graph.as_graph_def(), fetch_names(fetches))
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            optim.set_session(sess)
+            optim.run_init()
+            for _ in range(warm_up_steps):
+                optim.run({'train': True})
+            total_time = 0
+            for _ in range(steps):
+                time, _, _ = optim.run({'train': True})
+                total_time += time
+    return len(step_graph.node), steps / total_time
+
+for name, optimizer_class, config_args in [['MlpNormHistory', meta_optimizers.MlpNormHistory, config.mlp_norm_history()],
+                                           ['AUGOptims', meta_optimizers.AUGOptims, config.aug_optim()]]:
+    for flat_state in [False, True]:
+        ops_per_step, steps_per_sec = benchmark(optimizer_class, config_args, flat_state)
+        print(name, 'flat_state:', flat_state, 'ops per step:', ops_per_step, 'steps/sec:', np.round(steps_per_sec, 2))
@@ -0,0 +1,58 @@
+from __future__ import print_function
+import tensorflow as tf
+import numpy as np
+import problems
+import meta_optimizers
+import checkpoints
+import util
+import config
+
+# Compares float32 optimizer state against half precision state storage (config state_dtype) on the Mnist and
+# cifar10 eval runs of eval_optimizer.py. state MB counts the optimizer state variables (histories, moments), the
+# loss and accuracy are the means over the last eval_average steps.
+eval_steps = 5000
+eval_average = 500
+model_id = None # restores util.get_model_path(flag_optimizer='Mlp', model_id=model_id) into every run
+cifar_path = '../../../cifar/'
+
+problem_cases = [['Mnist', lambda: problems.Mnist({'minval': -100.0, 'maxval': 100.0, 'conv': False, 'full': False})],
+                 ['cifar10', lambda: problems.cifar10({'minval': -100.0, 'maxval': 100.0, 'conv': True,
+                                                       'path': cifar_path, 'full': False})]]
+
+
+def benchmark(problem_fn, optimizer_class, config_args, state_dtype):
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.set_random_seed(0)
+        config_args = dict(config_args)
+        config_args['state_dtype'] = state_dtype
+        problem = problem_fn()
+        optim = optimizer_class([problem], [], args=config_args)
+        optim.build(mode='inference')
+        checkpoint_manager = checkpoints.CheckpointManager(optim)
+        state_variables = [variable for variable in tf.global_variables() if variable not in
+                           optim.optimizer_variables + problem.variables + problem.constants]
+        state_bytes = sum([variable.get_shape().num_elements() * variable.dtype.base_dtype.size
+                           for variable in state_variables])
+        accuracy = problem.accuracy(mode='test')
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            optim.set_session(sess)
+            optim.run_init()
+            if model_id is not None:
+                checkpoint_manager.restore(util.get_model_path(flag_optimizer='Mlp', model_id=model_id))
+            losses, accuracies = [], []
+            for _ in range(eval_steps):
+                loss_prob, curr_accuracy, _ = sess.run([optim.ops_loss_problem_train, accuracy,
+                                                        optim.ops_updates_train])
+                losses.append(np.mean(loss_prob))
+                accuracies.append(curr_accuracy)
+    return state_bytes / 1024.0 / 1024.0, np.log10(np.mean(losses[-eval_average:])), np.mean(accuracies[-eval_average:])
+
+for problem_name, problem_fn in problem_cases:
+    for name, optimizer_class, config_args in [['MlpNormHistory', meta_optimizers.MlpNormHistory, config.mlp_norm_history()],
+                                               ['AUGOptims', meta_optimizers.AUGOptims, config.aug_optim()]]:
+        for state_dtype in ['float32', 'float16', 'bfloat16']:
+            state_mb, final_loss, final_accuracy = benchmark(problem_fn, optimizer_class, config_args, state_dtype)
+            print(problem_name, name, 'state_dtype:', state_dtype, 'state MB:', np.round(state_mb, 2),
+                  'final log10 loss:', np.round(final_loss, 3), 'accuracy:', np.round(final_accuracy, 4))
@@ -0,0 +1,77 @@
+from __future__ import print_function
+import tensorflow as tf
+from timeit import default_timer as timer
+import numpy as np
+import problems
+import meta_optimizers
+import config
+import trainer
+
+# Per run overhead of the driver loop before trainer.Trainer (optim.run, a problem norm run every step, the print
+# diagnostics as extra runs every print_interval) against the Trainer with the same diagnostics fetched with the step.
+# Reported is the wall time per run of the whole loop, not only the session call.
+runs = 2000
+warm_up_runs = 50
+print_interval = 50
+
+
+def build():
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.set_random_seed(0)
+        problem = problems.Rosenbrock({'prefix': 'train', 'minval': -10, 'maxval': 10})
+        optim = meta_optimizers.AUGOptimsRNN([problem], [], args=config.aug_optim_rnn())
+        optim.build()
+    return graph, optim
+
+
+def driver_loop():
+    graph, optim = build()
+    with graph.as_default():
+        optim_grad_norm = [tf.norm(grad) for grad in tf.gradients(optim.ops_loss_train, optim.optimizer_variables)]
+        optim_norm = [tf.norm(variable) for variable in optim.optimizer_variables]
+        problem_norm = tf.add_n([tf.norm(variable) for variable in optim.problems[0].variables])
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            optim.set_session(sess)
+            optim.run_init()
+            graph.finalize()
+            for run in range(warm_up_runs + runs):
+                if run == warm_up_runs:
+                    start = timer()
+                optim.run({'train': True})
+                sess.run(problem_norm)
+                if (run + 1) % print_interval == 0:
+                    sess.run(optim_norm)
+                    sess.run(optim_grad_norm)
+                    sess.run(optim.meta_learning_rate)
+    return (timer() - start) / runs
+
+
+class SilentPrintCallback(trainer.PrintCallback):
+
+    # fetches the print diagnostics like PrintCallback without printing them
+    def on_run(self, loop, run, results):
+        if results['diagnostics']:
+            self.diagnostics_run = results['diagnostics']
+
+
+def trainer_loop():
+    graph, optim = build()
+    with graph.as_default():
+        callbacks = [SilentPrintCallback(optim, print_interval, warm_up_runs + runs)]
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            optim.set_session(sess)
+            optim.run_init()
+            graph.finalize()
+            loop = trainer.Trainer(optim, sess, callbacks)
+            loop.run(warm_up_runs)
+            start = timer()
+            loop.run(warm_up_runs + runs, start=warm_up_runs)
+    return (timer() - start) / runs
+
+driver_time = driver_loop()
+trainer_time = trainer_loop()
+print('driver loop ms/run:', np.round(driver_time * 1000, 3), 'trainer ms/run:', np.round(trainer_time * 1000, 3),
+      'speedup:', np.round(driver_time / trainer_time, 2))
@@ -0,0 +1,77 @@
+from __future__ import print_function
+import resource
+import multiprocessing
+import tensorflow as tf
+import numpy as np
+import problems
+import meta_optimizers
+import config
+import benchmark as benchmark_suite
+
+# Peak memory of meta training against the unroll length, with the full unroll (checkpoint_steps None) and the
+# checkpointed unroll (config checkpoint_steps). Every case runs in its own process, peak RSS is that of the case
+# alone. On a GPU the peak bytes of its allocator are reported as well.
+meta_steps = 20
+unroll_lens = [5, 10, 20, 40]
+checkpoint_steps = [None, 5]
+cifar_path = '../../../cifar/'
+
+problem_cases = [['Mnist', lambda: problems.Mnist({'minval': -100.0, 'maxval': 100.0, 'conv': False, 'full': False})],
+                 ['cifar10_full', lambda: problems.cifar10({'minval': -100.0, 'maxval': 100.0, 'conv': True,
+                                                            'path': cifar_path, 'full': True})]]
+optimizer_cases = [['AUGOptimsRNN', meta_optimizers.AUGOptimsRNN, config.aug_optim_rnn],
+                   ['AUGOptimsGRUAll', meta_optimizers.AUGOptimsGRUAll, config.aug_optim_gru]]
+
+
+def benchmark(problem_fn, optimizer_class, config_fn, unroll_len, segment_steps):
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.set_random_seed(0)
+        config_args = config_fn()
+        config_args['unroll_len'] = unroll_len
+        config_args['checkpoint_steps'] = segment_steps
+        problem = problem_fn()
+        optim = optimizer_class([problem], [], args=config_args)
+        optim.build()
+        gpu = tf.test.is_gpu_available()
+        if gpu:
+            with tf.device('/gpu:0'):
+                max_bytes = tf.contrib.memory_stats.MaxBytesInUse()
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            optim.set_session(sess)
+            optim.run_init()
+            for _ in range(meta_steps):
+                _, loss, _ = optim.run({'train': True})
+            gpu_mb = sess.run(max_bytes) / 1024.0 / 1024.0 if gpu else None
+    # kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, gpu_mb, np.mean(loss)
+
+
+def case_process(args, results_queue):
+    try:
+        results_queue.put(benchmark(*args))
+    except Exception as error:
+        results_queue.put({'error': repr(error)})
+
+for problem_name, problem_fn in problem_cases:
+    for name, optimizer_class, config_fn in optimizer_cases:
+        for unroll_len in unroll_lens:
+            for segment_steps in checkpoint_steps:
+                results_queue = multiprocessing.Queue()
+                process = multiprocessing.Process(target=case_process, args=((problem_fn, optimizer_class, config_fn,
+                                                                              unroll_len, segment_steps),
+                                                                             results_queue))
+                process.start()
+                # out of memory is the expected failure of long full unrolls, the killed case is reported as an error
+                result = benchmark_suite.case_result(process, results_queue)
+                process.join()
+                if isinstance(result, dict):
+                    print(problem_name, name, 'unroll_len:', unroll_len, 'checkpoint_steps:', segment_steps,
+                          'ERROR', result['error'])
+                    continue
+                rss_mb, gpu_mb, loss = result
+                print(problem_name, name, 'unroll_len:', unroll_len, 'checkpoint_steps:', segment_steps,
+                      'peak RSS MB:', np.round(rss_mb, 1),
+                      'peak GPU MB:', np.round(gpu_mb, 1) if gpu_mb is not None else '-',
+                      'meta loss:', np.round(loss, 3))
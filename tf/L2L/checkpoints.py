@@ -0,0 +1,114 @@
+from __future__ import print_function
+import os
+import errno
+import threading
+import pickle
+import tensorflow as tf
+import numpy as np
+from six.moves import queue
+from timeit import default_timer as timer
+
+
+# Saves the optimizer without blocking the training loop. save() copies optimizer_variables (and the config) out of
+# the session, a background thread writes them as path.npz / path_config.p. Checkpoints saved with a validation loss
+# compete for keep_best places, the worse ones are deleted again once a better one is written. Checkpoints saved
+# without a loss (final networks) are always kept. A failed write is raised again from the next save() or wait().
+
+
+class CheckpointManager():
+
+    optimizer = None
+    keep_best = None
+    best = None
+    pending = None
+    thread = None
+    names = None
+    weight_inputs = None
+    ops_restore = None
+    error = None
+
+    def __init__(self, optimizer, keep_best=5):
+        self.optimizer = optimizer
+        self.keep_best = keep_best
+        # [(validation loss, path)] of the kept checkpoints, best first. only the writer thread replaces it, after a
+        # checkpoint is on disk
+        self.best = []
+        self.names = [variable.op.name for variable in optimizer.optimizer_variables]
+        # restore ops are built here, the drivers finalize the graph before training
+        with tf.name_scope('checkpoint_restore'):
+            self.weight_inputs = [tf.placeholder(variable.dtype.base_dtype, variable.get_shape())
+                                  for variable in optimizer.optimizer_variables]
+            self.ops_restore = [tf.assign(variable, weight_input) for variable, weight_input in
+                                zip(optimizer.optimizer_variables, self.weight_inputs)]
+        self.pending = queue.Queue()
+        self.thread = threading.Thread(target=self.write_pending)
+        self.thread.daemon = True
+        self.thread.start()
+
+    @staticmethod
+    def files(path):
+        return [path + '.npz', path + '_config.p']
+
+    def write_pending(self):
+        while True:
+            path, weights, config, loss = self.pending.get()
+            try:
+                directory = os.path.dirname(path)
+                # python 2 has no exist_ok
+                if directory and not os.path.exists(directory):
+                    try:
+                        os.makedirs(directory)
+                    except OSError as error:
+                        if error.errno != errno.EEXIST:
+                            raise
+                # written under a temporary name first, a crash mid write never leaves a broken checkpoint behind
+                with open(path + '.tmp.npz', 'wb') as weights_file:
+                    np.savez(weights_file, **weights)
+                os.rename(path + '.tmp.npz', path + '.npz')
+                if config is not None:
+                    with open(path + '.tmp_config.p', 'wb') as config_file:
+                        pickle.dump(config, config_file)
+                    os.rename(path + '.tmp_config.p', path + '_config.p')
+                if loss is None:
+                    continue
+                best = sorted(self.best + [(loss, path)], key=lambda checkpoint: checkpoint[0])
+                self.best = best[:self.keep_best]
+                for removed_path in [removed_path for _, removed_path in best[self.keep_best:]]:
+                    for removed_file in self.files(removed_path):
+                        if os.path.exists(removed_file):
+                            os.remove(removed_file)
+            except Exception as error:
+                # the thread keeps serving the queue, the error is raised in the training loop
+                self.error = error
+            finally:
+                self.pending.task_done()
+
+    def raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def save(self, path, loss=None):
+        self.raise_error()
+        best = self.best
+        if loss is not None and len(best) >= self.keep_best and loss >= best[-1][0]:
+            return False
+        start = timer()
+        weights = dict(zip(self.names, self.optimizer.session.run(self.optimizer.optimizer_variables)))
+        self.pending.put((path, weights, self.optimizer.dump_args(), loss))
+        print('Optimizer snapshot taken in ', timer() - start, ', writing ', path)
+        return True
+
+    def restore(self, path):
+        # checkpoints of tf.train.Saver (Meta_Optimizer.save) are still restored through the optimizer
+        if not os.path.exists(path + '.npz'):
+            self.optimizer.load(path)
+            return
+        weights = np.load(path + '.npz')
+        self.optimizer.session.run(self.ops_restore, feed_dict={weight_input: weights[name] for name, weight_input
+                                                                in zip(self.names, self.weight_inputs)})
+        print('Optimizer Restored')
+
+    def wait(self):
+        self.pending.join()
+        self.raise_error()
@@ -16,6 +16,12 @@ def common():
     args['unroll_len'] = 1
     args['unroll_len_val'] = 1
     args['use_guide_step'] = False
+    args['network_template'] = False # build the dense optimizer layers once as a function called by every problem
+    args['first_order'] = False # meta gradients treat the problem gradients and histories as constants
+    args['state_dtype'] = 'float32' # 'float16' / 'bfloat16' store histories and moments in half precision
+    # with 'float16' second moments and squared histories are kept in float32, they would underflow
+    args['step_guard'] = False # skip the updates of steps to a non finite point or a norm above step_guard_max_norm
+    args['step_guard_max_norm'] = 1e4
     return args
 
 def mlp_norm_history():
@@ -45,6 +51,10 @@ def mlp_norm_history():
     args['use_delta_mv_avg'] = False
     args['use_dist_mv_avg'] = False
     args['use_tanh_output'] = False
+    args['steps_per_run'] = 1 # > 1 runs K steps, each with its meta step, in a tf.while_loop per run call
+    args['flat_state'] = False # pack all variables of a problem into one [P, limit] history
+    args['ring_history'] = False # write one history column per step at a pointer instead of shifting the whole window
+    # (raw histories only, not with use_momentum, normalize_with_sq_grad or enable_noise_est)
     args['network_in_dims'] = args['limit'] if args['grad_only'] else args['limit'] * 2
     args['network_in_dims'] *= (2 if args['enable_noise_est'] else 1)
     args['network_out_dims'] = 1 if args['use_tanh_output'] else 12
@@ -92,6 +102,8 @@ def aug_optim():
     args['use_input_optim_loss'] = False
     args['use_input_optim_loss_rel'] = False
     args['use_adam_loss'] = False
+    args['flat_state'] = False
+    args['fused_input_optims'] = False # keep all Multiscale Adam timescales in one [P, N] moment tensor
 
     args['decay_learning_rate'] = False
     args['min_lr'] = 0.0
@@ -103,6 +115,12 @@ def aug_optim():
     args['learn_betas'] = False
     args['learn_lr'] = False
     args['use_rel_loss'] = False
+    # in graph episodes of the train problem: [low, high] runs per episode, None leaves the resets to run_reset
+    args['episode_horizon'] = None
+    args['episode_horizon_later'] = None # horizon range after episode_horizon_switch meta steps
+    args['episode_horizon_switch'] = 0
+    args['episode_min_loss'] = 1e-15 # also reset once the loss falls below / the problem norm exceeds these
+    args['episode_max_norm'] = 1e4
     return args
 
 def aug_optim_rnn():
@@ -110,6 +128,9 @@ def aug_optim_rnn():
     args['unroll_len'] = 20
     args['network_out_dims'] = args['num_input_optims'] + (2 if args['learn_betas'] else 0)
     args['network_out_dims'] += (len(args['lr_dist']) if args['learn_lr'] else 0)
+    # None keeps every step of the unroll for the meta gradients, S keeps the state every S steps and recomputes the
+    # steps in between during backprop (unroll_len has to be a multiple of S)
+    args['checkpoint_steps'] = None
 
     return args
 
@@ -0,0 +1,38 @@
+from __future__ import print_function
+import tensorflow as tf
+import numpy as np
+import problems
+import meta_optimizers
+import config
+
+# Checks that the in graph episode resets draw new start points: with a graph seed the copied initializers would
+# repeat the draws of the initializer, the problem would restart at its initial point every episode.
+episodes = 3
+
+graph = tf.Graph()
+with graph.as_default():
+    tf.set_random_seed(0)
+    config_args = config.aug_optim()
+    config_args['episode_horizon'] = [3, 4]
+    problem = problems.Mnist({'prefix': 'train', 'minval': 0, 'maxval': 100, 'conv': False, 'full': False})
+    optim = meta_optimizers.AUGOptims([problem], [], args=config_args)
+    optim.build()
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        optim.set_session(sess)
+        optim.run_init()
+        graph.finalize()
+        start_points = [sess.run(problem.variables)]
+        while len(start_points) <= episodes:
+            optim.run({'train': True})
+            if np.any(optim.episode_done):
+                start_points.append(sess.run(problem.variables))
+
+repeated = 0
+for episode in range(1, len(start_points)):
+    same = any([all([np.allclose(variable, earlier_variable) for variable, earlier_variable in zip(
+        start_points[episode], earlier)]) for earlier in start_points[:episode]])
+    repeated += 1 if same else 0
+    print('episode', episode, 'start point', 'REPEATED' if same else 'new')
+print('RESETS OK' if repeated == 0 else 'RESETS FAILED, ' + str(repeated) + ' of ' + str(episodes) +
+      ' start points repeated')
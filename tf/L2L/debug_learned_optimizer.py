@@ -0,0 +1,42 @@
+from __future__ import print_function
+import os
+import tempfile
+import tensorflow as tf
+import numpy as np
+import problems
+import meta_optimizers
+import learned_optimizer
+import config
+
+# Parity check of the numpy runtime: the same (randomly initialized) MlpNormHistory weights are exported to a
+# LearnedOptimizer, both optimize the same Rosenbrock start point for steps steps and every next point is compared.
+steps = 20
+export_path = os.path.join(tempfile.mkdtemp(), 'mlp_norm_history')
+
+graph = tf.Graph()
+with graph.as_default():
+    tf.set_random_seed(0)
+    problem = problems.Rosenbrock({'prefix': 'parity', 'minval': -10, 'maxval': 10})
+    optim = meta_optimizers.MlpNormHistory([problem], [], args=config.mlp_norm_history())
+    optim.build(mode='inference')
+    gradients = problem.get_gradients_raw()
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        optim.set_session(sess)
+        optim.run_init()
+        graph.finalize()
+        learned_optimizer.export(optim, export_path)
+        runtime = learned_optimizer.LearnedOptimizer(export_path)
+        runtime.reset()
+        mismatches = 0
+        for step in range(steps):
+            params, grads = sess.run([problem.variables, gradients])
+            numpy_next = runtime.step(params, grads)
+            sess.run(optim.ops_updates_train)
+            tf_next = sess.run(problem.variables)
+            same = all([np.allclose(tf_param, numpy_param, rtol=1e-5, atol=1e-6)
+                        for tf_param, numpy_param in zip(tf_next, numpy_next)])
+            mismatches += 0 if same else 1
+            print('step', step + 1, 'tensorflow:', np.ravel(tf_next), 'numpy:', np.ravel(numpy_next),
+                  'OK' if same else 'MISMATCH')
+print('PARITY OK' if mismatches == 0 else 'PARITY FAILED in ' + str(mismatches) + ' of ' + str(steps) + ' steps')
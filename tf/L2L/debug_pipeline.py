@@ -7,6 +7,8 @@ import meta_optimizers
 from preprocess import Preprocess
 import numpy as np
 import config
+import metrics
+import trainer
 
 tf.set_random_seed(0)
 preprocess = [Preprocess.log_sign, {'k': 10}]
@@ -82,6 +84,9 @@ if update_summaries:
     writer = tf.summary.FileWriter('tf_summary/')
     writer.add_graph(iis.graph)
 
+metrics_writer = metrics.get_writer()
+
+
 def write_to_file(f_name, all_variables):
     final_dump = None
     for curr_variable in all_variables:
@@ -94,65 +99,48 @@ def write_to_file(f_name, all_variables):
             log_file.write(str(variable) + ' ')
         log_file.write('\n')
 
-check_nan_prob = tf.is_nan(norm_problem_variables)
-check_nan_optim = tf.is_nan(norm_optim_variables)
 
-def itr(itr, print_interval=1000, write_interval=None, show_prob=0, reset_interval=None):
-    global all_summ
-    loss_final_optim = np.zeros(len([loss_optim]))
-    loss_final_prob = np.zeros(len([loss_problem]))
+class DumpCallback(trainer.Callback):
+
+    # every interval runs the variables are appended to variables_updates.txt and / or the merged summaries are
+    # written with summary_writer, both fetched with the step
+
+    summary_writer = None
+
+    def __init__(self, interval, variables=None, summaries=None, summary_writer=None):
+        super(DumpCallback, self).__init__(interval)
+        self.summary_writer = summary_writer
+        if variables is not None:
+            self.diagnostics['variables'] = variables
+        if summaries is not None:
+            self.diagnostics['summaries'] = summaries
+
+    def on_run(self, loop, run, results):
+        if not self.due(run):
+            return
+        if 'variables' in results['diagnostics']:
+            write_to_file('variables_updates.txt', results['diagnostics']['variables'])
+        if 'summaries' in results['diagnostics']:
+            self.summary_writer.add_summary(results['diagnostics']['summaries'], run)
+
+
+# the nan checks, the print diagnostics and the dumps are fetched with the step
+nan_callback = trainer.NanCallback(optim)
+problem_variables_flat = [tf.squeeze(variable) for problem in optim.problems for variable in problem.variables_flat]
+
+
+def itr(itr, print_interval=1000, write_interval=None, reset_interval=None):
     print('current loss optim: ', iis.run(loss_optim))
     print('current loss prob: ', np.log10(iis.run(loss_problem)))
-    total_time = 0
-    for i in range(itr):
-        problem_index = i % len(optim.problems)
-        if reset_interval is not None and (i + 1) % reset_interval == 0:
-            optim.run_reset()
-        start = timer()
-        if not update_summaries:
-            all_summ = []
-        _, _, loss_optim_run, loss_prob_run, grad_norm = iis.run([meta_step, updates,
-                                                loss_optim,
-                                                loss_problem,
-                                                optim_grad_norm])
-        if True in iis.run(check_nan_prob):
-            print('NAN found prob after, exit')
-            break
-        if True in iis.run(check_nan_optim):
-            print('NAN found optim after, exit')
-            break
-
-        end = timer()
-        total_time += (end - start)
-        loss_final_optim += np.array(loss_optim_run)
-        loss_final_prob += np.array(loss_prob_run)
-        if write_interval is not None and (i + 1) % write_interval == 0:
-            variables = iis.run(tf.squeeze(optim.problems.variables_flat))
-            write_to_file('variables_updates.txt', variables)
-        if (i + 1) % print_interval == 0:
-            summaries = iis.run(all_summ)
-            if update_summaries:
-                writer.add_summary(summaries, i)
-            print(i + 1)
-            # print('problem: ', problem_index)
-            print('-----------')
-            # print('deltas', run_step[problem_index]['deltas'])
-            # print('x_next', run_step[problem_index]['x_next'])
-            # print('history', hist[problem_index])
-            print('O Grad norm', grad_norm)
-            print('-----------')
-            print('norm_probl: ', iis.run(norm_problem_variables))
-            if meta:
-                print('norm_optim: ', iis.run(norm_optim_variables))
-                # print('norm_delta: ', iis.run(norm_deltas))
-                # print('lrate: ', iis.run(optim.learning_rate))
-            # print('norm_input_grads: ', iis.run(input_grads_norm))
-            print('loss optim: ', loss_final_optim / print_interval)
-            print('loss prob: ', np.log10(loss_final_prob / print_interval))
-            print('time:' , total_time / print_interval)
-            loss_final_optim = 0
-            loss_final_prob = 0
-            total_time = 0
+    callbacks = [nan_callback, trainer.PrintCallback(optim, print_interval, itr, metrics_writer)]
+    if reset_interval is not None:
+        callbacks.insert(0, trainer.ResetCallback(optim, [reset_interval, reset_interval], min_loss=0.0,
+                                                  max_norm=np.inf))
+    if write_interval is not None:
+        callbacks.append(DumpCallback(write_interval, variables=problem_variables_flat))
+    if update_summaries and all_summ is not None:
+        callbacks.append(DumpCallback(print_interval, summaries=all_summ, summary_writer=writer))
+    trainer.Trainer(optim, iis, callbacks).run(itr)
     # if write_interval is not None:
     #     f_data = np.load('variables_updates')
 #
@@ -1,4 +1,7 @@
+from __future__ import print_function
 import problems
+import metrics
+import sweep
 import tensorflow as tf
 import numpy as np
 import time
@@ -27,12 +30,16 @@ adam_params = [[0.99, 0.9999],
                [0.5, 0.555],
 ]
 
-def write_to_file(f_name, list_var):
-    with open(f_name, 'a') as log_file:
+# every (adam_param, learning_rate) pair runs in a worker of the sweep pool, one core each. Finished configurations
+# are rows of results_path, rerunning the script only runs the missing ones.
+search_space = {'adam_param': adam_params, 'learning_rate': learning_rate_range}
+# random_samples = None runs the grid, otherwise that many configurations of the space drawn by sweep.random_search
+# (a (low, high) tuple as learning_rate draws it log uniformly)
+random_samples = None
+num_workers = None
+results_path = 'adam_results/results.jsonl'
 
-        for variable in list_var:
-            log_file.write(str(variable) + ' ')
-        log_file.write('\n')
+metrics_writer = metrics.get_writer('tf_summary/')
 
 problem_path = '/mhome/shahidm/thesis/save_nets/mnist_save_vars_mlp/mnist_variables'
 
@@ -41,30 +48,49 @@ total_data_points = 55000
 batch_size = 128
 itr_per_epoch = int(total_data_points/batch_size)
 
-for adam_param in adam_params:
-    for learning_rate in learning_rate_range:
-        id = str(adam_param) + ' ' + str(learning_rate)
-        print('================================')
-        tf.reset_default_graph()
-        iis = tf.InteractiveSession()
+
+def series_name(config):
+    beta1, beta2 = config['adam_param']
+    return 'adam_sig_' + str(config['learning_rate']) + '_' + str(beta1) + '_' + str(beta2)
+
+
+def adam_trial(config):
+    graph = tf.Graph()
+    with graph.as_default():
         mnist = problems.Mnist({'minval': -100.0, 'maxval': 100.0, 'conv': False, 'full': False})
         loss = tf.squeeze(mnist.loss(mnist.variables))
-        mnist.restore(iis, problem_path)
-        beta1 = adam_param[0]
-        beta2 = adam_param[1]
-        adam = tf.train.AdamOptimizer(learning_rate, beta1=beta1, beta2=beta2)
+        beta1, beta2 = config['adam_param']
+        adam = tf.train.AdamOptimizer(config['learning_rate'], beta1=beta1, beta2=beta2)
         minimize = adam.minimize(loss, var_list=mnist.variables)
-        iis.run(tf.global_variables_initializer())
-        total_loss = 0
-        for i in range(epochs):
-            total_loss = 0
-            start = time.time()
-            for j in range(itr_per_epoch):
-                _, loss_run = iis.run([minimize, loss])
-                total_loss += loss_run
-            total_time = time.time() - start
-            print(str(i + 0) + '/' + str(epochs))
-            print("time: {0:.2f}s".format(total_time))
-            avg_loss = np.log10(total_loss / itr_per_epoch)
-            print(avg_loss)
-            write_to_file('tf_summary/adam_sig_' + str(learning_rate) + '_' + str(beta1) + '_' + str(beta2), [avg_loss])
+        # the next minibatch once the step and its loss read the current one
+        with tf.control_dependencies([minimize, loss]):
+            step = mnist.advance_batch()
+        with tf.Session(config=sweep.session_config()) as sess:
+            sess.run(tf.global_variables_initializer())
+            mnist.restore(sess, problem_path)
+            graph.finalize()
+            avg_losses = []
+            for i in range(epochs):
+                total_loss = 0
+                start = time.time()
+                for j in range(itr_per_epoch):
+                    _, loss_run = sess.run([step, loss])
+                    total_loss += loss_run
+                total_time = time.time() - start
+                print(series_name(config), str(i + 1) + '/' + str(epochs), "time: {0:.2f}s".format(total_time))
+                avg_losses.append(float(np.log10(total_loss / itr_per_epoch)))
+    return {'log_loss': avg_losses}
+
+
+def log_result(config, result):
+    for avg_loss in result['log_loss']:
+        metrics_writer.log(series_name(config), [avg_loss])
+
+
+if __name__ == '__main__':
+    # decoded before the pool starts, the workers only memory map the cached splits
+    problems.mnist_arrays('train')
+    configs = sweep.grid(search_space) if random_samples is None else sweep.random_search(search_space, random_samples)
+    rows = sweep.run(adam_trial, configs, results_path, num_workers=num_workers, on_result=log_result)
+    for row in sorted(rows, key=lambda row: row['result']['log_loss'][-1]):
+        print(sweep.config_key(row['config']), 'final log loss: ', row['result']['log_loss'][-1])
@@ -1,4 +1,5 @@
 from __future__ import print_function
+import os
 import tensorflow as tf
 import numpy as np
 import problems
@@ -7,14 +8,12 @@ import optimizers
 import util
 from preprocess import Preprocess
 import config
+import checkpoints
+import metrics
 import time
 
-def write_to_file(f_name, list_var):
-    with open(f_name, 'a') as log_file:
-        for variable in list_var:
-            log_file.write(str(variable) + ' ')
-        log_file.write('\n')
 results_dir = 'tf_summary/'
+metrics_writer = metrics.get_writer(results_dir)
 model_id = '50000'
 
 load_model = True
@@ -39,7 +38,14 @@ with l2l.as_default():
     enable_summaries = False
     if meta:
         optim_meta = meta_optimizers.AUGOptims([problem], [], args=args)
-        optim_meta.build()
+        # without meta steps only the update ops are built, the loaded network weights of a CheckpointManager
+        # checkpoint become constants. tf.train.Saver checkpoints (no .npz) are restored into the variables.
+        if optimize:
+            optim_meta.build()
+        else:
+            frozen = load_model and os.path.exists(io_path + '.npz')
+            optim_meta.build(mode='inference', frozen_weights=np.load(io_path + '.npz') if frozen else None)
+        checkpoint_manager = checkpoints.CheckpointManager(optim_meta)
     else:
         optim_meta = None
     if optimize and meta:
@@ -97,7 +103,7 @@ with l2l.as_default():
         l2l.finalize()
         print('---- Starting Evaluation ----')
         if meta and load_model:
-            optim_meta.load(io_path)
+            checkpoint_manager.restore(io_path)
             print('Optimizer loaded.')
         for i in range(epochs):
             total_loss = 0
@@ -118,9 +124,9 @@ with l2l.as_default():
             avg_loss = np.log10(total_loss / itr_per_epoch)
             avg_acc_train = total_acc_train / itr_per_epoch
             avg_acc_test = total_acc_test / itr_per_epoch
-            write_to_file(results_dir + 'loss', avg_loss)
-            # write_to_file(results_dir + 'acc_train', [avg_acc_train])
-            # write_to_file(results_dir + 'acc_test', [avg_acc_test])
+            metrics_writer.log('loss', avg_loss)
+            # metrics_writer.log('acc_train', [avg_acc_train])
+            # metrics_writer.log('acc_test', [avg_acc_test])
             print('loss: ', avg_loss)
             # print('acc train: ', avg_acc_train)
             # print('acc test: ', avg_acc_test)
@@ -0,0 +1,149 @@
+from __future__ import print_function
+import numpy as np
+
+# Runs a trained MlpNormHistory without tensorflow. export() writes the optimizer network weights and the config the
+# step depends on to path_numpy.npz, LearnedOptimizer loads them and reproduces MlpNormHistory.step (float32, the same
+# history init as run_init) on plain numpy arrays. All parameters share one [P, limit] history, every op of the step
+# is row wise, so this is the flat_state layout. The ring buffer layout holds the same rows in a different column
+# order and gives the same steps. debug_learned_optimizer.py compares its steps with MlpNormHistory on Rosenbrock.
+
+activations = {'relu': lambda x: np.maximum(x, 0.0),
+               'tanh': np.tanh,
+               'sigmoid': lambda x: 1.0 / (1.0 + np.exp(-x)),
+               'identity': lambda x: x}
+
+
+def unsupported_options(optimizer):
+    options = ['learn_lr', 'learn_lr_delta', 'learn_momentum_base', 'use_lr_mv_avg', 'use_delta_mv_avg',
+               'use_noise_est', 'normalize_with_sq_grad', 'decay_min_lr', 'use_guide_step']
+    unsupported = [option for option in options if getattr(optimizer, option)]
+    if optimizer.min_lr_train is None:
+        unsupported.append('min_lr=None')
+    if optimizer.ref_point not in [0, 1]:
+        unsupported.append('ref_point=' + str(optimizer.ref_point))
+    if optimizer.network_activation.__name__ not in activations:
+        unsupported.append('network_activation=' + optimizer.network_activation.__name__)
+    return unsupported
+
+
+def export(optimizer, path):
+    unsupported = unsupported_options(optimizer)
+    if unsupported:
+        raise ValueError('Numpy runtime does not support ' + ', '.join(unsupported))
+    values = optimizer.session.run(optimizer.optimizer_variables + [optimizer.step_dist, optimizer.sign_dist,
+                                                                    optimizer.momentum_alpha])
+    weights, (step_dist, sign_dist, momentum_alpha) = values[:-3], values[-3:]
+    layers = {}
+    # optimizer_variables holds w, b of the in, hidden and out layers in that order
+    for layer, (w, b) in enumerate(zip(weights[0::2], weights[1::2])):
+        layers['w_' + str(layer)] = w
+        layers['b_' + str(layer)] = b
+    np.savez(path + '_numpy.npz', layers=len(weights) // 2, activation=optimizer.network_activation.__name__,
+             limit=optimizer.limit, step_dist=step_dist, sign_dist=sign_dist, momentum_alpha=momentum_alpha,
+             use_momentum=optimizer.use_momentums, ref_point=optimizer.ref_point, min_lr=optimizer.min_lr_train,
+             grad_only=optimizer.gradients_only, grad_sign_only=optimizer.gradient_sign_only,
+             use_tanh_output=optimizer.use_tanh_output,
+             history_range=optimizer.history_range if optimizer.history_range else 0, **layers)
+    print('Numpy optimizer exported to ', path + '_numpy.npz')
+
+
+class LearnedOptimizer():
+
+    weights = None
+    activation = None
+    limit = None
+    step_dist = None
+    sign_dist = None
+    momentum_alpha = None
+    use_momentum = None
+    ref_point = None
+    min_lr = None
+    grad_only = None
+    grad_sign_only = None
+    use_tanh_output = None
+    history_range = None
+    vari_hist = None
+    grad_hist = None
+
+    def __init__(self, path):
+        exported = np.load(path + '_numpy.npz')
+        self.weights = [(exported['w_' + str(layer)], exported['b_' + str(layer)])
+                        for layer in range(int(exported['layers']))]
+        self.activation = activations[str(exported['activation'])]
+        self.limit = int(exported['limit'])
+        self.step_dist = exported['step_dist']
+        self.sign_dist = exported['sign_dist']
+        self.momentum_alpha = exported['momentum_alpha']
+        self.use_momentum = bool(exported['use_momentum'])
+        self.ref_point = int(exported['ref_point'])
+        self.min_lr = np.float32(exported['min_lr'])
+        self.grad_only = bool(exported['grad_only'])
+        self.grad_sign_only = bool(exported['grad_sign_only'])
+        self.use_tanh_output = bool(exported['use_tanh_output'])
+        self.history_range = int(exported['history_range'])
+
+    def reset(self):
+        self.vari_hist = None
+        self.grad_hist = None
+
+    def push_history(self, history, values):
+        if self.use_momentum:
+            return history * self.momentum_alpha + values * (1 - self.momentum_alpha)
+        return np.concatenate([history[:, 1:], values], axis=1)
+
+    @staticmethod
+    def normalize_values(history):
+        norm = np.max(np.abs(history), axis=1, keepdims=True)
+        return history / np.where(norm == 0.0, np.float32(1.0), norm)
+
+    @staticmethod
+    def softmax(logits):
+        exp = np.exp(logits - np.max(logits, axis=1, keepdims=True))
+        return exp / np.sum(exp, axis=1, keepdims=True)
+
+    def network(self, inputs):
+        activations = inputs
+        for layer, (w, b) in enumerate(self.weights):
+            activations = np.dot(activations, w) + b
+            if layer < len(self.weights) - 1:
+                activations = self.activation(activations)
+        if self.use_tanh_output:
+            return np.tanh(activations[:, :1])
+        step_magnitude = np.dot(self.softmax(activations[:, :10]), self.step_dist)
+        step_sign = np.dot(self.softmax(activations[:, 10:12]), self.sign_dist)
+        return step_magnitude * step_sign
+
+    def step(self, params, grads):
+        # params, grads: lists of arrays at the current point, returns the next params. The first call after a reset
+        # fills the histories like run_init, the later ones push the point like the history updates after a step.
+        shapes = [np.shape(param) for param in params]
+        variables = np.concatenate([np.reshape(param, [-1, 1]) for param in params]).astype(np.float32)
+        gradients = np.concatenate([np.reshape(grad, [-1, 1]) for grad in grads]).astype(np.float32)
+        if self.vari_hist is None or self.vari_hist.shape[0] != variables.shape[0]:
+            self.vari_hist = np.zeros([variables.shape[0], self.limit], dtype=np.float32)
+            self.grad_hist = np.zeros([variables.shape[0], self.limit], dtype=np.float32)
+            for i in range(self.limit):
+                self.vari_hist = self.push_history(self.vari_hist, variables)
+                self.grad_hist = self.push_history(self.grad_hist, gradients)
+        else:
+            self.vari_hist = self.push_history(self.vari_hist, variables)
+            self.grad_hist = self.push_history(self.grad_hist, gradients)
+
+        normalized_grad_history = self.normalize_values(self.grad_hist)
+        if self.grad_sign_only:
+            normalized_grad_history = np.sign(normalized_grad_history)
+        if self.grad_only:
+            network_input = normalized_grad_history
+        else:
+            network_input = np.concatenate([self.normalize_values(self.vari_hist), normalized_grad_history], 1)
+        deltas_x = self.network(network_input)
+
+        if self.ref_point == 0:
+            ref = variables
+        else:
+            history_range = self.vari_hist[:, :self.history_range] if self.history_range else self.vari_hist
+            ref = (np.max(history_range, axis=1, keepdims=True) + np.min(history_range, axis=1, keepdims=True)) / 2.0
+        # MlpNormHistory.step reads use_diff from an attribute that is never set, the step size is min_lr alone
+        new_points = ref + deltas_x * self.min_lr
+        splits = np.cumsum([int(np.prod(shape)) for shape in shapes])[:-1]
+        return [np.reshape(points, shape) for points, shape in zip(np.split(new_points, splits), shapes)]
@@ -2,11 +2,12 @@ from __future__ import print_function
 from abc import ABCMeta
 import tensorflow as tf
 from tensorflow.python.util import nest
+from tensorflow.python.framework import function
 import numpy as np
 import pickle
 from preprocess import Preprocess
 from timeit import default_timer as timer
-from optimizers import Adam
+from optimizers import Adam, MultiScaleAdam, read_state, store_state, square_state_dtype
 import itertools
 
 
@@ -25,6 +26,24 @@ class Meta_Optimizer():
     preprocessor_args = None
     optimizer_variables = None
     session = None
+    g_args = None
+    profiler = None
+    network_template = None
+    network_templates = None
+    inference = None
+    frozen_constants = None
+    first_order = None
+    state_dtype = None
+    sq_state_dtype = None
+    episode_horizon = None
+    episode_horizon_later = None
+    episode_horizon_switch = None
+    episode_min_loss = None
+    episode_max_norm = None
+    episode_done = None
+    step_guard = None
+    step_guard_max_norm = None
+    steps_per_run = None
 
     ops_init_train = None
     ops_reset_problem_train = None
@@ -34,6 +53,14 @@ class Meta_Optimizer():
     ops_loss_problem_train = None
     ops_meta_step_train = None
     ops_prob_acc = None
+    ops_episode_done = None
+    ops_step_applied = None
+    ops_apply_step = None
+    # steps_per_run steps (and meta steps) per run in a loop, built by the optimizers supporting steps_per_run > 1
+    ops_loss_multi_train = None
+    ops_loss_problem_multi_train = None
+    ops_updates_multi_train = None
+    ops_meta_step_multi_train = None
 
     ops_init_eval = None
     ops_reset_problem_eval = None
@@ -47,6 +74,29 @@ class Meta_Optimizer():
         #     print('Args Loaded, call load_optimizer with session to restore the optimizer graph.')
         self.problems = problems
         self.problems_eval = problems_eval
+        self.g_args = args
+        self.network_template = args['network_template'] if 'network_template' in args else False
+        self.network_templates = {}
+        self.first_order = args['first_order'] if 'first_order' in args else False
+        self.state_dtype = tf.as_dtype(args['state_dtype'] if 'state_dtype' in args else 'float32')
+        self.sq_state_dtype = square_state_dtype(self.state_dtype)
+        self.episode_horizon = args['episode_horizon'] if 'episode_horizon' in args else None
+        self.episode_horizon_later = args['episode_horizon_later'] if 'episode_horizon_later' in args else None
+        self.episode_horizon_switch = args['episode_horizon_switch'] if 'episode_horizon_switch' in args else 0
+        self.episode_min_loss = args['episode_min_loss'] if 'episode_min_loss' in args else 1e-15
+        self.episode_max_norm = args['episode_max_norm'] if 'episode_max_norm' in args else 1e4
+        self.step_guard = args['step_guard'] if 'step_guard' in args else False
+        self.step_guard_max_norm = args['step_guard_max_norm'] if 'step_guard_max_norm' in args else 1e4
+        self.steps_per_run = args['steps_per_run'] if 'steps_per_run' in args else 1
+        # {problem: bool tensor}, False in the runs the step guard skipped the updates of the problem
+        self.ops_step_applied = {}
+        # {problem: bool tensor}, the predicate of the last guarded updates built for the problem, gates its meta step
+        self.ops_apply_step = {}
+        if self.first_order:
+            # the problems then also use the losses without second derivatives (sparse mnist labels)
+            for problem in nest.flatten([problems, problems_eval]):
+                if problem is not None:
+                    problem.allow_gradients_of_gradients = False
         if self.is_availble('preprocess', args):
             self.preprocessor = args['preprocess'][0]
             self.preprocessor_args = args['preprocess'][1]
@@ -70,6 +120,9 @@ class Meta_Optimizer():
         self.optimizer_variables = []
 
     def init_saver_handle(self):
+        # a frozen inference build may not have any optimizer variables left
+        if not self.optimizer_variables:
+            return
         self.io_handle = tf.train.Saver([variable for variable in self.optimizer_variables], max_to_keep=100)
 
     def preprocess_input(self, inputs):
@@ -115,13 +168,226 @@ class Meta_Optimizer():
     def reset(self, args=None):
         pass
 
-    def minimize(self, loss):
-        return (self.meta_optimizer_optimizer.minimize(loss, var_list=self.optimizer_variables, global_step=self.meta_global_step))
+    def fc_network(self, inputs, in_dims, out_dims, input_order=None):
+        # the dense layers of the optimizer network. with network_template they are compiled once per input signature
+        # into a function, every problem then only adds a call op instead of its own copy of the layers
+        if not self.network_template:
+            activations = layer_fc(name='in', dims=[in_dims, self.layer_width], inputs=inputs,
+                                   variable_list=self.optimizer_variables, activation=self.network_activation,
+                                   row_order=input_order)
+            for layer in range(self.hidden_layers):
+                activations = layer_fc(str(layer + 1), dims=[self.layer_width, self.layer_width], inputs=activations,
+                                       variable_list=self.optimizer_variables, activation=self.network_activation)
+            return layer_fc('out', dims=[self.layer_width, out_dims], inputs=activations,
+                            variable_list=self.optimizer_variables)
+
+        dims = [in_dims] + [self.layer_width] * (self.hidden_layers + 1) + [out_dims]
+        names = ['in'] + [str(layer + 1) for layer in range(self.hidden_layers)] + ['out']
+        weights = [layer_weights(name, [layer_in, layer_out], self.optimizer_variables)
+                   for name, layer_in, layer_out in zip(names, dims[:-1], dims[1:])]
+        ordered = input_order is not None
+        key = (inputs.dtype, in_dims, out_dims, ordered)
+        if key not in self.network_templates:
+            def dense_layers(template_inputs, template_order=None):
+                template_inputs.set_shape([None, in_dims])
+                activations = template_inputs
+                for layer, (w, b) in enumerate(weights):
+                    w = tf.gather(w, template_order) if layer == 0 and ordered else w
+                    activations = tf.add(tf.matmul(activations, w), b)
+                    if layer < len(weights) - 1:
+                        activations = self.network_activation(activations)
+                return activations
+            template_name = 'optimizer_network_template_' + str(len(self.network_templates))
+            if ordered:
+                template = function.Defun(inputs.dtype, input_order.dtype, func_name=template_name)(
+                    lambda template_inputs, template_order: dense_layers(template_inputs, template_order))
+            else:
+                template = function.Defun(inputs.dtype, func_name=template_name)(
+                    lambda template_inputs: dense_layers(template_inputs))
+            self.network_templates[key] = template
+        template = self.network_templates[key]
+        activations = template(inputs, input_order) if ordered else template(inputs)
+        activations.set_shape(inputs.get_shape()[:1].concatenate([out_dims]))
+        return activations
+
+    def minimize(self, loss, problem=None):
+        if problem not in self.ops_apply_step:
+            return (self.meta_optimizer_optimizer.minimize(loss, var_list=self.optimizer_variables, global_step=self.meta_global_step))
+        # a step the guard skipped applies zero meta gradients, the non finite gradients of a diverged step would
+        # stay in the optimizer variables for good
+        apply_step = self.ops_apply_step[problem]
+        gradients = self.meta_optimizer_optimizer.compute_gradients(loss, var_list=self.optimizer_variables)
+        with tf.name_scope('step_guard'):
+            gradients = [(gradient if gradient is None else
+                          tf.cond(apply_step, lambda: gradient, lambda: tf.zeros_like(gradient)), variable)
+                         for gradient, variable in gradients]
+        return self.meta_optimizer_optimizer.apply_gradients(gradients, global_step=self.meta_global_step)
 
-    def build(self):
+    @staticmethod
+    def advance_batch(problem, updates, step_reads):
+        # the problem keeps one minibatch for the whole step, move to the next one once the updates and every
+        # loss of the step have read it. the meta gradients only reuse tensors of these losses.
+        updates = nest.flatten(updates)
+        with tf.control_dependencies(updates + nest.flatten(step_reads)):
+            return updates + [problem.advance_batch()]
+
+    def store_states(self, states, dtype=None):
+        dtype = self.state_dtype if dtype is None else dtype
+        return [store_state(state, dtype) for state in states]
+
+    @staticmethod
+    def checkpointed_unroll(body, loop_vars, steps, segment_steps, name):
+        # the unroll as a while loop over segments of segment_steps body calls, each segment is a function. the meta
+        # backward pass only keeps the loop state at the segment boundaries and recomputes the steps of a segment from
+        # it (symbolic gradient of the function), instead of keeping the tensors of every step of the unroll.
+        if steps % segment_steps != 0:
+            raise ValueError('unroll_len ' + str(steps) + ' is not a multiple of checkpoint_steps ' + str(segment_steps))
+        loop_vars = nest.map_structure(tf.convert_to_tensor, loop_vars)
+        flat_vars = nest.flatten(loop_vars)
+
+        def segment(*flat_inputs):
+            for flat_input, var in zip(flat_inputs, flat_vars):
+                flat_input.set_shape(var.get_shape())
+            segment_vars = nest.pack_sequence_as(loop_vars, list(flat_inputs))
+            for _ in range(segment_steps):
+                segment_vars = body(*segment_vars)
+            return [tf.convert_to_tensor(value) for value in nest.flatten(segment_vars)]
+        segment_function = function.Defun(*[var.dtype.base_dtype for var in flat_vars])(segment)
+
+        def run_segment(segment_t, flat_state):
+            flat_state_next = segment_function(*flat_state)
+            for value, value_next in zip(flat_state, flat_state_next):
+                value_next.set_shape(value.get_shape())
+            return segment_t + 1, list(flat_state_next)
+
+        _, flat_final = tf.while_loop(cond=lambda segment_t, _: segment_t < steps // segment_steps,
+                                      body=run_segment,
+                                      loop_vars=[0, flat_vars],
+                                      parallel_iterations=1,
+                                      swap_memory=True,
+                                      name=name)
+        return nest.pack_sequence_as(loop_vars, flat_final)
+
+    def guarded_updates(self, problem, vars_next, update_fn):
+        # with step_guard the updates of a step (update_fn builds them) only run if the next point of the problem is
+        # finite and its norm stays below step_guard_max_norm, otherwise the problem and the optimizer state keep their
+        # values. the check reads the tensors the updates assign anyway, ops_step_applied[problem] has the flag.
+        # minimize(loss, problem) gates the meta step of the problem on the same check.
+        # problems with replicas are not guarded, one diverged replica would stop all of them (see ReplicaValidation).
+        if not self.step_guard or problem.replicas > 1:
+            return update_fn()
+        with tf.name_scope('step_guard'):
+            vars_next = nest.flatten(vars_next)
+            finite = tf.reduce_all([tf.reduce_all(tf.is_finite(var_next)) for var_next in vars_next])
+            norm = tf.add_n([tf.norm(var_next) for var_next in vars_next])
+            apply_step = tf.logical_and(finite, tf.less_equal(norm, self.step_guard_max_norm))
+
+            def apply_updates():
+                # the update ops have to be created in the branch to only run with it
+                with tf.control_dependencies(nest.flatten(update_fn())):
+                    return tf.constant(True)
+            applied = tf.cond(apply_step, apply_updates, lambda: tf.constant(False))
+        self.ops_apply_step[problem] = apply_step
+        self.ops_step_applied[problem] = applied
+        return [applied]
+
+    def sample_horizon(self):
+        # episode lengths (runs) are drawn from episode_horizon for the first episode_horizon_switch meta steps and
+        # from episode_horizon_later afterwards
+        low, high = self.episode_horizon
+        if self.episode_horizon_later is not None:
+            early = tf.less(self.meta_global_step, self.episode_horizon_switch)
+            low = tf.where(early, float(low), float(self.episode_horizon_later[0]))
+            high = tf.where(early, float(high), float(self.episode_horizon_later[1]))
+        return tf.random_uniform([], low, high)
+
+    # ops an initial value is not copied through: variables (reads of other variables stay reads of them) and control
+    # flow (initialized_value), they are used as they are
+    initial_value_leaves = ['Variable', 'VariableV2', 'VarHandleOp', 'Placeholder', 'PlaceholderWithDefault',
+                            'Switch', 'Merge', 'Enter', 'Exit', 'NextIteration', 'RefSwitch', 'RefMerge']
+
+    @staticmethod
+    def copy_initial_value(tensor, copies):
+        # rebuilds the ops of an initial value (random initializers, zeros fills, ...) where it is called. created in a
+        # tf.cond branch they only run with it, the original initial_value tensors would be evaluated every run.
+        # random ops get seeds of their own, with the seeds of the initializer the first reset would draw the initial
+        # point again (same graph seed, same op seed).
+        op = tensor.op
+        if op.type in Meta_Optimizer.initial_value_leaves:
+            return tensor
+        if op not in copies:
+            inputs = [Meta_Optimizer.copy_initial_value(op_input, copies) for op_input in op.inputs]
+            attrs = {key: op.node_def.attr[key] for key in op.node_def.attr}
+            if 'seed2' in attrs:
+                seed, seed2 = tf.get_seed(None)
+                attrs['seed'] = tf.AttrValue(i=seed if seed is not None else 0)
+                attrs['seed2'] = tf.AttrValue(i=seed2 if seed2 is not None else 0)
+            copies[op] = op.graph.create_op(op.type, inputs, [output.dtype for output in op.outputs],
+                                            name=op.name.split('/')[-1], attrs=attrs, op_def=op.op_def)
+        copy = copies[op].outputs[tensor.value_index]
+        copy.set_shape(tensor.get_shape())
+        return copy
+
+    def episode_updates(self, problem, updates, loss_prob, reset_variables):
+        # in graph episodes of a meta trained problem. after the updates of a run the episode step is advanced, at the
+        # horizon, a vanishing loss, a diverged problem norm or a step the guard skipped the reset_variables get their
+        # initial values back in a tf.cond and the next horizon is drawn. the flag of the cond is appended to
+        # ops_episode_done.
+        updates = nest.flatten(updates)
+        if self.episode_horizon is None:
+            return updates
+        with tf.name_scope('episode'):
+            episode_step = tf.Variable(0.0, trainable=False, name='episode_step')
+            horizon = tf.Variable(tf.random_uniform([], float(self.episode_horizon[0]), float(self.episode_horizon[1])),
+                                  trainable=False, name='horizon')
+            with tf.control_dependencies(updates + nest.flatten(loss_prob)):
+                problem_norm = tf.add_n([tf.norm(variable) for variable in problem.variables])
+                done = tf.logical_or(tf.greater_equal(episode_step + 1.0, horizon),
+                                     tf.logical_or(tf.less(tf.reduce_mean(loss_prob), self.episode_min_loss),
+                                                   tf.greater(problem_norm, self.episode_max_norm)))
+                if problem in self.ops_step_applied:
+                    # a skipped step leaves the problem where it diverged, it would be skipped again every run
+                    done = tf.logical_or(done, tf.logical_not(self.ops_step_applied[problem]))
+
+            def reset():
+                # the assigns and the initializers have to be created in the branch, they would run every run
+                copies = {}
+                resets = [tf.assign(variable, self.copy_initial_value(variable.initial_value, copies))
+                          for variable in reset_variables]
+                resets.append(tf.assign(episode_step, 0.0))
+                resets.append(tf.assign(horizon, self.sample_horizon()))
+                with tf.control_dependencies(resets):
+                    return tf.constant(True)
+
+            def advance():
+                with tf.control_dependencies([tf.assign_add(episode_step, 1.0)]):
+                    return tf.constant(False)
+            episode_done = tf.cond(done, reset, advance)
+        self.ops_episode_done.append(episode_done)
+        return updates + [episode_done]
+
+    def build(self, mode='train', frozen_weights=None):
+        # mode='inference' only builds the init / step / update ops of the problems, no meta losses and minimize ops.
+        # frozen_weights ({variable name: value}, e.g. np.load of a CheckpointManager checkpoint) turns the weights
+        # created during the build into constants, they are left out of optimizer_variables.
+        self.inference = mode == 'inference'
+        self.frozen_constants = {}
+        if frozen_weights is not None:
+            with tf.name_scope('frozen_weights'):
+                for name in frozen_weights.keys():
+                    self.frozen_constants[name] = tf.constant(frozen_weights[name], name=name.replace('/', '_'))
+        with tf.variable_scope(tf.get_variable_scope(), custom_getter=self.frozen_getter):
+            self.build_ops()
         self.init_saver_handle()
+
+    def build_ops(self):
         pass
 
+    def frozen_getter(self, getter, name, *args, **kwargs):
+        if name in self.frozen_constants:
+            return self.frozen_constants[name]
+        return getter(name, *args, **kwargs)
+
     def reset_optimizer(self):
         return [tf.variables_initializer(self.optimizer_variables, name='reset_optimizer')]
 
@@ -141,13 +407,20 @@ class Meta_Optimizer():
     @staticmethod
     def load_args(path):
         pickled_args = pickle.load(open(path + '_config.p', 'rb'))
-        pickled_args['preprocess'][0] = getattr(Preprocess, pickled_args['preprocess'][0])
+        if 'preprocess' in pickled_args and pickled_args['preprocess'] is not None:
+            pickled_args['preprocess'][0] = getattr(Preprocess, pickled_args['preprocess'][0])
         return pickled_args
 
-    def save_args(self, path):
+    def dump_args(self):
+        # the preprocess function is stored by name, load_args looks it up on Preprocess again
         dump_args = dict(self.g_args)
-        dump_args['preprocess'][0] = dump_args['preprocess'][0].func_name
-        pickle.dump(dump_args, open(path + '_config.p', 'wb'))
+        if self.is_availble('preprocess', dump_args):
+            dump_args['preprocess'] = [dump_args['preprocess'][0].__name__, dump_args['preprocess'][1]]
+        return dump_args
+
+    def save_args(self, path):
+        with open(path + '_config.p', 'wb') as config_file:
+            pickle.dump(self.dump_args(), config_file)
 
     def load(self, path):
         self.io_handle.restore(self.session, path)
@@ -164,6 +437,15 @@ class Meta_Optimizer():
     def set_session(self, session):
         self.session = session
 
+    def set_profiler(self, profiler):
+        # profiling.StepProfiler, traces every profiler.interval-th run call
+        self.profiler = profiler
+
+    def session_run(self, fetches):
+        if self.profiler is None:
+            return self.session.run(fetches)
+        return self.profiler.run(self.session, fetches)
+
     def run_reset(self, index=None, optimizer=False):
         pass
 
@@ -179,33 +461,41 @@ class Meta_Optimizer():
         loss_array = 0
         start = timer()
         for _ in range(num_steps):
-            loss = self.session.run([ops_loss, ops_meta_step, ops_updates])[0]
+            loss = self.session_run([ops_loss, ops_meta_step, ops_updates])[0]
             loss_array += np.array(loss)
         return timer() - start, loss_array / num_steps
 
 
-def layer_fc(name, dims, inputs, variable_list, initializers=None, activation=None):
+def layer_weights(name, dims, variable_list, initializers=None):
     initializers = [tf.random_normal_initializer(mean=0.0, stddev=.01), tf.zeros_initializer] \
         if initializers is None else initializers
     # initializers = [tf.contrib.layers.variance_scaling_initializer()]
     reuse = False
+    with tf.variable_scope('optimizer_network') as scope:
+        try:
+            w = tf.get_variable('w_' + name, shape=dims, initializer=initializers[0])
+        except ValueError:
+            scope.reuse_variables()
+            reuse = True
+            w = tf.get_variable('w_' + name, shape=dims, initializer=initializers[0])
+        b = tf.get_variable('b_' + name, shape=[1, dims[-1]], initializer=initializers[1])
+    if not reuse and isinstance(w, tf.Variable):
+        variable_list.extend([w, b])
+        tf.summary.histogram('weights', w)
+        tf.summary.histogram('bias', b)
+    return w, b
+
+
+def layer_fc(name, dims, inputs, variable_list, initializers=None, activation=None, row_order=None):
     with tf.name_scope('optimizer_fc_layer_' + name):
-        with tf.variable_scope('optimizer_network') as scope:
-            try:
-                w = tf.get_variable('w_' + name, shape=dims, initializer=initializers[0])
-            except ValueError:
-                scope.reuse_variables()
-                reuse = True
-                w = tf.get_variable('w_' + name, shape=dims, initializer=initializers[0])
-            b = tf.get_variable('b_' + name, shape=[1, dims[-1]], initializer=initializers[1])
-            linear = tf.add(tf.matmul(inputs, w), b, name='activations_' + 'layer_' + str(name))
-            layer_output = linear if activation is None else activation(linear)
-
-            if not reuse:
-                variable_list.extend([w, b])
-                tf.summary.histogram('weights', w)
-                tf.summary.histogram('bias', b)
-                tf.summary.histogram('activation', layer_output)
+        new_layer = len(variable_list)
+        w, b = layer_weights(name, dims, variable_list, initializers)
+        # gathering the rows of w is equivalent to permuting the columns of inputs, but only touches [in, out]
+        w_ordered = w if row_order is None else tf.gather(w, row_order)
+        linear = tf.add(tf.matmul(inputs, w_ordered), b, name='activations_' + 'layer_' + str(name))
+        layer_output = linear if activation is None else activation(linear)
+        if len(variable_list) > new_layer:
+            tf.summary.histogram('activation', layer_output)
     return layer_output
 
 class l2l(Meta_Optimizer):
@@ -378,7 +668,7 @@ class MlpSimple(Meta_Optimizer):
         with tf.name_scope('mlp_simple_optimizer_loss'):
             problem = args['problem']
             variables = args['x_next'] if 'x_next' in args else problem.variables
-            return problem.loss(variables)
+            return problem.get_loss(variables)
 
     def build(self):
         self.ops_step = []
@@ -823,7 +1113,7 @@ class MlpNormHistoryDEP(Meta_Optimizer):
     def loss(self, args=None):
         problem = args['problem']
         variables = args['vars_next'] if 'vars_next' in args else problem.variables
-        return problem.loss(variables)
+        return problem.get_loss(variables)
 
     def reset_problem(self, args):
         problem = args['problem']
@@ -910,7 +1200,7 @@ class MlpNormHistoryDEP(Meta_Optimizer):
             ops_updates = self.ops_updates_eval
 
         start = timer()
-        op_loss, pr_loss, _, _ = self.session.run([ops_loss, ops_loss_problem, ops_meta_step, ops_updates])
+        op_loss, pr_loss, _, _ = self.session_run([ops_loss, ops_loss_problem, ops_meta_step, ops_updates])
         return timer() - start, [op_loss], [pr_loss]
 
 class MlpNormHistoryRNNDEP(MlpNormHistoryDEP):
@@ -1044,7 +1334,10 @@ class MlpNormHistory(Meta_Optimizer):
     global_step_train = None
     global_step_eval = None
 
-
+    flat_state = None
+    ring_history = None
+    hist_ptr_train = None
+    hist_ptr_eval = None
 
     def __init__(self, problems, path, args):
         super(MlpNormHistory, self).__init__(problems, path, args)
@@ -1084,7 +1377,12 @@ class MlpNormHistory(Meta_Optimizer):
         self.ref_point = args['ref_point']
         self.diff = args['use_diff']
         self.use_tanh_output = args['use_tanh_output']
-
+        self.flat_state = args['flat_state'] if 'flat_state' in args else False
+        # the ring buffer only holds raw histories, momentum / squared histories are updated over the whole window
+        self.ring_history = args['ring_history'] if 'ring_history' in args else False
+        if self.ring_history and (self.use_momentums or self.normalize_with_sq_grad or self.use_noise_est):
+            raise ValueError('ring_history is not supported with use_momentum, normalize_with_sq_grad or '
+                             'enable_noise_est')
 
         if self.decay_min_lr:
             self.min_lr_train = tf.Variable(self.decay_min_lr_max, dtype=tf.float32)
@@ -1112,6 +1410,7 @@ class MlpNormHistory(Meta_Optimizer):
             (self.guide_step_train, self.vari_hist_train, self.grad_hist_train,
              self.grad_mom, self.vari_mom, self.sq_vari_hist_train,
              self.sq_grad_hist_train, self.dist_mv_avg, self.delta_mv_avg_train, self.lr_mv_avg_train) = [], [], [], [], [], [], [], [], [], []
+            self.hist_ptr_train = []
 
             for i, problem in enumerate(self.problems):
                 with tf.variable_scope('problem_' + 'train' + '_' + str(i)):
@@ -1121,38 +1420,39 @@ class MlpNormHistory(Meta_Optimizer):
                                                                                    name='guide_step'))
                     else:
                         self.guide_step_train.append([])
-                    self.vari_hist_train.append([tf.get_variable('vari_hist' + 'train' + '_' + str(i), initializer=tf.zeros_initializer,
+                    self.vari_hist_train.append([tf.get_variable('vari_hist' + 'train' + '_' + str(i), initializer=tf.zeros_initializer, dtype=self.state_dtype,
                                                                  shape=[shape, self.limit], trainable=False)
-                                                 for i, shape in enumerate(problem.variables_flattened_shape)])
-                    self.grad_hist_train.append([tf.get_variable('grad_mom' + 'train' + '_' + str(i), initializer=tf.zeros_initializer,
+                                                 for i, shape in enumerate(self.state_shapes(problem))])
+                    self.grad_hist_train.append([tf.get_variable('grad_mom' + 'train' + '_' + str(i), initializer=tf.zeros_initializer, dtype=self.state_dtype,
                                                                  shape=[shape, self.limit], trainable=False)
-                                                 for i, shape in enumerate(problem.variables_flattened_shape)])
+                                                 for i, shape in enumerate(self.state_shapes(problem))])
+                    self.hist_ptr_train.append(tf.Variable(0, trainable=False, name='hist_ptr'))
                     if self.normalize_with_sq_grad or self.use_noise_est:
-                        self.sq_vari_hist_train.append([tf.get_variable('sq_vari_mom' + 'train' + '_' + str(i), initializer=tf.zeros_initializer,
+                        self.sq_vari_hist_train.append([tf.get_variable('sq_vari_mom' + 'train' + '_' + str(i), initializer=tf.zeros_initializer, dtype=self.sq_state_dtype,
                                                                         shape=[shape, self.limit], trainable=False)
-                                                        for i, shape in enumerate(problem.variables_flattened_shape)])
-                        self.sq_grad_hist_train.append([tf.get_variable('sq_grad_mom' + 'train' + '_' + str(i), initializer=tf.zeros_initializer,
+                                                        for i, shape in enumerate(self.state_shapes(problem))])
+                        self.sq_grad_hist_train.append([tf.get_variable('sq_grad_mom' + 'train' + '_' + str(i), initializer=tf.zeros_initializer, dtype=self.sq_state_dtype,
                                                                         shape=[shape, self.limit], trainable=False)
-                                                        for i, shape in enumerate(problem.variables_flattened_shape)])
+                                                        for i, shape in enumerate(self.state_shapes(problem))])
                     else:
-                        self.sq_vari_hist_train.append([0.0 for variable in problem.variables])
-                        self.sq_grad_hist_train.append([0.0 for variable in problem.variables])
+                        self.sq_vari_hist_train.append([0.0 for shape in self.state_shapes(problem)])
+                        self.sq_grad_hist_train.append([0.0 for shape in self.state_shapes(problem)])
 
                     if self.use_dist_mv_avg:
                         self.dist_mv_avg.append([tf.get_variable('dist_mv_avg' + 'train' + '_' + str(i), initializer=tf.zeros_initializer,
                                                                   shape=[shape, self.limit], trainable=False)
-                                                  for i, shape in enumerate(problem.variables_flattened_shape)])
+                                                  for i, shape in enumerate(self.state_shapes(problem))])
                     else:
-                        self.dist_mv_avg.append([0.0 for variable in problem.variables])
+                        self.dist_mv_avg.append([0.0 for shape in self.state_shapes(problem)])
 
                     if self.use_delta_mv_avg:
                         self.delta_mv_avg_train.append([tf.get_variable('delta_mv_avg' + 'train' + '_' + str(i),
-                                                                        initializer=tf.ones(shape=[shape, self.limit],
-                                                                                      dtype=tf.float32) * 0.5,
+                                                                        initializer=tf.cast(tf.ones(shape=[shape, self.limit],
+                                                                                      dtype=tf.float32) * 0.5, self.state_dtype),
                                                                         trainable=False)
-                                                        for i, shape in enumerate(problem.variables_flattened_shape)])
+                                                        for i, shape in enumerate(self.state_shapes(problem))])
                     else:
-                        self.delta_mv_avg_train.append([0.0 for variable in problem.variables])
+                        self.delta_mv_avg_train.append([0.0 for shape in self.state_shapes(problem)])
                     if self.use_lr_mv_avg:
                         min_val = 1e-6
                         max_val = 1e-3
@@ -1161,18 +1461,19 @@ class MlpNormHistory(Meta_Optimizer):
                             max_val = tf.log(max_val)
                         self.lr_mv_avg_train.append([tf.get_variable('min_step_mv_avg' + 'train' + '_' + str(i),
                                                                      initializer=tf.random_uniform(shape=[shape, 1], minval=min_val, maxval=max_val),
-                                                                     trainable=False) for i, shape in enumerate(problem.variables_flattened_shape)])
+                                                                     trainable=False) for i, shape in enumerate(self.state_shapes(problem))])
                     else:
-                        self.lr_mv_avg_train.append([0.0 for variable in problem.variables])
+                        self.lr_mv_avg_train.append([0.0 for shape in self.state_shapes(problem)])
                     if self.learn_momentum_base:
                         self.momentum_alpha.append([tf.get_variable('mom_alpha' + 'train' + '_' + str(i), initializer=tf.zeros_initializer,
                                                               shape=[shape, 1], trainable=False)
-                                                    for i, shape in enumerate(problem.variables_flattened_shape)])
+                                                    for i, shape in enumerate(self.state_shapes(problem))])
 
                 (self.guide_step_eval, self.vari_hist_eval, self.grad_hist_eval,
                  self.grad_mom, self.vari_mom, self.sq_vari_hist_eval,
                  self.sq_grad_hist_eval, self.dist_mv_avg, self.delta_mv_avg_eval,
                  self.lr_mv_avg_eval) = [], [], [], [], [], [], [], [], [], []
+                self.hist_ptr_eval = []
                 for i, problem in enumerate(self.problems_eval):
                     with tf.variable_scope('problem_' + 'eval' + '_' + str(i)):
                         if self.use_guide_step:
@@ -1182,46 +1483,46 @@ class MlpNormHistory(Meta_Optimizer):
                         else:
                             self.guide_step_eval.append([])
                         self.vari_hist_eval.append(
-                            [tf.get_variable('vari_hist' + 'eval' + '_' + str(i), initializer=tf.zeros_initializer,
+                            [tf.get_variable('vari_hist' + 'eval' + '_' + str(i), initializer=tf.zeros_initializer, dtype=self.state_dtype,
                                              shape=[shape, self.limit], trainable=False)
-                             for i, shape in enumerate(problem.variables_flattened_shape)])
+                             for i, shape in enumerate(self.state_shapes(problem))])
                         self.grad_hist_eval.append(
-                            [tf.get_variable('grad_mom' + 'eval' + '_' + str(i), initializer=tf.zeros_initializer,
+                            [tf.get_variable('grad_mom' + 'eval' + '_' + str(i), initializer=tf.zeros_initializer, dtype=self.state_dtype,
                                              shape=[shape, self.limit], trainable=False)
-                             for i, shape in enumerate(problem.variables_flattened_shape)])
+                             for i, shape in enumerate(self.state_shapes(problem))])
+                        self.hist_ptr_eval.append(tf.Variable(0, trainable=False, name='hist_ptr'))
                         if self.normalize_with_sq_grad or self.use_noise_est:
                             self.sq_vari_hist_eval.append([tf.get_variable('sq_vari_mom' + 'eval' + '_' + str(i),
-                                                                            initializer=tf.zeros_initializer,
+                                                                            initializer=tf.zeros_initializer, dtype=self.sq_state_dtype,
                                                                             shape=[shape, self.limit], trainable=False)
                                                             for i, shape in
-                                                            enumerate(problem.variables_flattened_shape)])
+                                                            enumerate(self.state_shapes(problem))])
                             self.sq_grad_hist_eval.append([tf.get_variable('sq_grad_mom' + 'eval' + '_' + str(i),
-                                                                            initializer=tf.zeros_initializer,
+                                                                            initializer=tf.zeros_initializer, dtype=self.sq_state_dtype,
                                                                             shape=[shape, self.limit], trainable=False)
                                                             for i, shape in
-                                                            enumerate(problem.variables_flattened_shape)])
+                                                            enumerate(self.state_shapes(problem))])
                         else:
-                            self.sq_vari_hist_eval.append([0.0 for variable in problem.variables])
-                            self.sq_grad_hist_eval.append([0.0 for variable in problem.variables])
+                            self.sq_vari_hist_eval.append([0.0 for shape in self.state_shapes(problem)])
+                            self.sq_grad_hist_eval.append([0.0 for shape in self.state_shapes(problem)])
 
                         if self.use_dist_mv_avg:
                             self.dist_mv_avg.append([tf.get_variable('dist_mv_avg' + 'eval' + '_' + str(i),
                                                                      initializer=tf.zeros_initializer,
                                                                      shape=[shape, self.limit], trainable=False)
-                                                     for i, shape in enumerate(problem.variables_flattened_shape)])
+                                                     for i, shape in enumerate(self.state_shapes(problem))])
                         else:
-                            self.dist_mv_avg.append([0.0 for variable in problem.variables])
+                            self.dist_mv_avg.append([0.0 for shape in self.state_shapes(problem)])
 
                         if self.use_delta_mv_avg:
                             self.delta_mv_avg_eval.append([tf.get_variable('delta_mv_avg' + 'eval' + '_' + str(i),
-                                                                            initializer=tf.ones(
-                                                                                shape=[shape, self.limit],
-                                                                                dtype=tf.float32) * 0.5,
+                                                                            initializer=tf.cast(tf.ones(shape=[shape, self.limit],
+                                                                                dtype=tf.float32) * 0.5, self.state_dtype),
                                                                             trainable=False)
                                                             for i, shape in
-                                                            enumerate(problem.variables_flattened_shape)])
+                                                            enumerate(self.state_shapes(problem))])
                         else:
-                            self.delta_mv_avg_eval.append([0.0 for variable in problem.variables])
+                            self.delta_mv_avg_eval.append([0.0 for shape in self.state_shapes(problem)])
                         if self.use_lr_mv_avg:
                             min_val = 1e-6
                             max_val = 1e-3
@@ -1233,19 +1534,34 @@ class MlpNormHistory(Meta_Optimizer):
                                                                                                        minval=min_val,
                                                                                                        maxval=max_val),
                                                                          trainable=False) for i, shape in
-                                                         enumerate(problem.variables_flattened_shape)])
+                                                         enumerate(self.state_shapes(problem))])
                         else:
-                            self.lr_mv_avg_eval.append([0.0 for variable in problem.variables])
+                            self.lr_mv_avg_eval.append([0.0 for shape in self.state_shapes(problem)])
                         if self.learn_momentum_base:
                             self.momentum_alpha.append(
                                 [tf.get_variable('mom_alpha' + 'eval' + '_' + str(i), initializer=tf.zeros_initializer,
                                                  shape=[shape, 1], trainable=False)
-                                 for i, shape in enumerate(problem.variables_flattened_shape)])
+                                 for i, shape in enumerate(self.state_shapes(problem))])
 
+    def state_shapes(self, problem):
+        # with flat_state all variables of a problem share one [P, limit] history, P = total parameters
+        if self.flat_state:
+            return [int(np.sum(problem.variables_flattened_shape))]
+        return problem.variables_flattened_shape
 
+    def history_order(self, hist_ptr):
+        # ring buffer slot of the k-th oldest history entry, hist_ptr always points at the oldest one
+        return tf.mod(hist_ptr + tf.range(self.limit), self.limit)
+
+    def history_input_order(self, hist_ptr):
+        # row of the (oldest to newest) input weights every ring buffer slot of the network input maps to
+        slot_age = tf.mod(tf.range(self.limit) - hist_ptr, self.limit)
+        return tf.concat([slot_age + block * self.limit for block in range(self.network_in_dims // self.limit)], 0,
+                         name='history_input_order')
 
     def normalize_values(self, history_tensor, squared_history=None, switch=0):
         epsilon = 1e-15
+        # only reduces over the history axis, so ring buffer (slot ordered) histories normalize the same way
         with tf.name_scope('Input_Normalizer'):
             if self.normalize_with_sq_grad and squared_history is not None:
                 normalized_values = tf.divide(history_tensor, tf.sqrt(squared_history) + epsilon)
@@ -1280,13 +1596,8 @@ class MlpNormHistory(Meta_Optimizer):
         with tf.name_scope('Optimizer_network'):
             delta_lr = None
             activations = args['inputs']
-            activations = layer_fc(name='in', dims=[self.network_in_dims, self.layer_width], inputs=activations,
-                                   variable_list=self.optimizer_variables, activation=self.network_activation)
-            for layer in range(self.hidden_layers):
-                activations = layer_fc(str(layer + 1), dims=[self.layer_width, self.layer_width], inputs=activations,
-                                       variable_list=self.optimizer_variables, activation=self.network_activation)
-            activations = layer_fc('out', dims=[self.layer_width, self.network_out_dims], inputs=activations,
-                              variable_list=self.optimizer_variables)
+            input_order = args['input_order'] if 'input_order' in args else None
+            activations = self.fc_network(activations, self.network_in_dims, self.network_out_dims, input_order)
 
             if self.use_tanh_output:
                 end_index = 1
@@ -1339,6 +1650,12 @@ class MlpNormHistory(Meta_Optimizer):
         with tf.name_scope('mlp_x_optimizer_step'):
 
             problem = args['problem']
+            problem_variables = args['variables'] if 'variables' in args else problem.variables
+            problem_variables_flat = [problem.flatten_input(i, variable) for i, variable
+                                      in enumerate(problem_variables)] if 'variables' in args else problem.variables_flat
+            if self.flat_state:
+                problem_variables = [problem.pack(problem_variables)]
+                problem_variables_flat = problem_variables
             problem_vari_hist = args['vari_hist']
             problem_grad_hist = args['grad_hist']
             problem_sq_vari_hist = args['sq_vari_hist']
@@ -1348,6 +1665,14 @@ class MlpNormHistory(Meta_Optimizer):
             problem_global_step = args['global_step']
             problem_delta_mv_avg = args['delta_mv_avg']
             problem_lr_mv_avg = args['lr_mv_avg']
+            hist_ptr = args['hist_ptr'] if 'hist_ptr' in args else None
+            if self.first_order:
+                # the histories of unrolled steps carry the optimizer outputs of the earlier steps
+                problem_vari_hist = [tf.stop_gradient(vari_hist) for vari_hist in problem_vari_hist]
+                problem_grad_hist = [tf.stop_gradient(grad_hist) for grad_hist in problem_grad_hist]
+            problem_vari_hist, problem_grad_hist, problem_sq_vari_hist, problem_sq_grad_hist, problem_delta_mv_avg = [
+                [read_state(state) for state in states] for states in
+                [problem_vari_hist, problem_grad_hist, problem_sq_vari_hist, problem_sq_grad_hist, problem_delta_mv_avg]]
             vars_next = list()
             deltas_list = []
             deltas_mv_avg_next = []
@@ -1356,6 +1681,13 @@ class MlpNormHistory(Meta_Optimizer):
 
             min_lr_next = problem_min_lr
             global_step_next = problem_global_step + 1
+            hist_ptr_next = hist_ptr
+            input_order = None
+            if self.ring_history:
+                history_order = self.history_order(hist_ptr)
+                input_order = self.history_input_order(hist_ptr)
+                hist_ptr_next = tf.mod(hist_ptr + 1, self.limit)
+                column_mask = tf.one_hot(hist_ptr, self.limit)
 
             if self.decay_min_lr:
                 # global_step_next = tf.minimum(problem_global_step + 1, self.decay_min_lr_steps)
@@ -1368,7 +1700,7 @@ class MlpNormHistory(Meta_Optimizer):
 
             for (variable, variable_flat, batch_vari_hist, batch_grad_hist,
                  batch_sq_vari_hist, batch_sq_grad_hist, batch_dist_mv_avg,
-                 batch_delta_mv_avg, batch_lr_mv_avg) in zip(problem.variables, problem.variables_flat,
+                 batch_delta_mv_avg, batch_lr_mv_avg) in zip(problem_variables, problem_variables_flat,
                                                                                    problem_vari_hist, problem_grad_hist,
                                                                                    problem_sq_vari_hist, problem_sq_grad_hist,
                                                                                    problem_dist_mv_avg, problem_delta_mv_avg, problem_lr_mv_avg):
@@ -1405,10 +1737,12 @@ class MlpNormHistory(Meta_Optimizer):
                 else:
                     network_input = tf.concat([normalized_variable_history, normalized_grad_history], 1, name='final_input')
 
-                deltas_x, delta_lr = self.network({'inputs': network_input})
+                deltas_x, delta_lr = self.network({'inputs': network_input, 'input_order': input_order})
                 deltas_list.append([deltas_x])
 
-                if self.history_range is not None and self.history_range:
+                if self.history_range is not None and self.history_range and self.ring_history:
+                    batch_variable_history_range = tf.gather(batch_vari_hist, history_order[:self.history_range], axis=1)
+                elif self.history_range is not None and self.history_range:
                     batch_variable_history_range = tf.slice(batch_vari_hist, [0, 0], [-1, self.history_range])
                 else:
                     batch_variable_history_range = batch_vari_hist
@@ -1461,8 +1795,13 @@ class MlpNormHistory(Meta_Optimizer):
                 new_points = problem.set_shape(new_points, like_variable=variable, op_name='reshaped_new_points')
                 vars_next.append(new_points)
 
+            if self.flat_state:
+                vars_next = problem.unpack(vars_next[0])
             flat_gradients = problem.get_gradients(vars_next)
             flat_variables = [problem.flatten_input(i, variable) for i, variable in enumerate(vars_next)]
+            if self.flat_state:
+                flat_gradients = [problem.pack(flat_gradients)]
+                flat_variables = [problem.pack(flat_variables)]
             vari_hist_next = []
             grad_hist_next = []
             sq_vari_hist_next = []
@@ -1472,6 +1811,9 @@ class MlpNormHistory(Meta_Optimizer):
                 if self.use_momentums:
                     updated_vari_hist = batch_vari_hist * self.momentum_alpha + variables * (1 - self.momentum_alpha)
                     updated_grad_hist = tf.add(batch_grad_hist * self.momentum_alpha,gradients * (1 - self.momentum_alpha), name='grad_hist_next')
+                elif self.ring_history:
+                    updated_vari_hist = batch_vari_hist * (1 - column_mask) + variables * column_mask
+                    updated_grad_hist = batch_grad_hist * (1 - column_mask) + gradients * column_mask
                 else:
                     updated_vari_hist = tf.concat([batch_vari_hist[:, 1:], variables], axis=1)
                     updated_grad_hist = tf.concat([batch_grad_hist[:, 1:], gradients], axis=1)
@@ -1484,15 +1826,104 @@ class MlpNormHistory(Meta_Optimizer):
                     sq_grad_hist_next.append(updated_sq_grad_hist)
 
             return {'x_next': vars_next, 'deltas_list': deltas_list,
+                    'vari_hist_next': self.store_states(vari_hist_next),
+                    'grad_hist_next': self.store_states(grad_hist_next),
+                    'sq_vari_hist_next': self.store_states(sq_vari_hist_next, self.sq_state_dtype),
+                    'sq_grad_hist_next': self.store_states(sq_grad_hist_next, self.sq_state_dtype),
+                    'delta_mv_avg_next': self.store_states(deltas_mv_avg_next),
+                    'min_lr_next': min_lr_next,
+                    'global_step_next': global_step_next,
+                    'lr_mv_avg_next': lr_mv_avg_next,
+                    'hist_ptr_next': hist_ptr_next,
+                    'delta_lr': delta_lr_next}
+
+    def multi_step(self, args=None):
+        # steps_per_run steps of the problem in a tf.while_loop. with args['meta_step'] every iteration also applies
+        # the meta step of its loss, the next iteration steps with the updated optimizer variables. the slots of the
+        # meta optimizer have to exist already (minimize built before), they can not be created in the loop.
+        with tf.name_scope('mlp_x_optimizer_multi_step'):
+            problem = args['problem']
+            problem_dist_mv_avg = args['dist_mv_avg']
+            steps_per_run = args['steps_per_run']
+            meta_step = args['meta_step'] if 'meta_step' in args else False
+            losses = tf.TensorArray(tf.float32, size=steps_per_run, name='optim_losses')
+            losses_problem = tf.TensorArray(tf.float32, size=steps_per_run, name='problem_losses')
+
+            def update_multi(t, losses, losses_problem, problem_variables, vari_hist, grad_hist, sq_vari_hist,
+                             sq_grad_hist, delta_mv_avg, lr_mv_avg, min_lr, global_step, hist_ptr):
+                loss_curr = tf.log(self.loss({'problem': problem, 'x_next': problem_variables}) + 1e-20)
+                step = self.step({'problem': problem,
+                                  'variables': problem_variables,
+                                  'vari_hist': vari_hist,
+                                  'grad_hist': grad_hist,
+                                  'sq_vari_hist': sq_vari_hist,
+                                  'sq_grad_hist': sq_grad_hist,
+                                  'dist_mv_avg': problem_dist_mv_avg,
+                                  'delta_mv_avg': delta_mv_avg,
+                                  'lr_mv_avg': lr_mv_avg,
+                                  'min_lr': min_lr,
+                                  'global_step': global_step,
+                                  'hist_ptr': hist_ptr})
+                vars_next = step['x_next']
+                vari_hist_next = step['vari_hist_next']
+                grad_hist_next = step['grad_hist_next']
+                if self.use_noise_est or self.normalize_with_sq_grad:
+                    sq_vari_hist_next = step['sq_vari_hist_next']
+                    sq_grad_hist_next = step['sq_grad_hist_next']
+                else:
+                    sq_vari_hist_next = sq_vari_hist
+                    sq_grad_hist_next = sq_grad_hist
+                delta_mv_avg_next = step['delta_mv_avg_next'] if self.use_delta_mv_avg else delta_mv_avg
+                lr_mv_avg_next = step['lr_mv_avg_next'] if self.use_lr_mv_avg else lr_mv_avg
+                if self.decay_min_lr:
+                    min_lr_next = step['min_lr_next']
+                    global_step_next = step['global_step_next']
+                else:
+                    min_lr_next = min_lr
+                    global_step_next = global_step
+                loss_prob_next = tf.squeeze(self.loss({'problem': problem, 'x_next': vars_next}))
+                loss_next = tf.log(loss_prob_next + 1e-20)
+                loss = step['loss'] if 'loss' in step else tf.squeeze(loss_next - loss_curr)
+                losses = losses.write(t, loss)
+                losses_problem = losses_problem.write(t, loss_prob_next)
+                loop_vars_next = [t + 1, losses, losses_problem, vars_next, vari_hist_next, grad_hist_next,
+                                  sq_vari_hist_next, sq_grad_hist_next, delta_mv_avg_next, lr_mv_avg_next, min_lr_next,
+                                  global_step_next, step['hist_ptr_next']]
+                if not meta_step:
+                    return tuple(loop_vars_next)
+                # the next iteration only starts once the meta step of this one is applied
+                with tf.control_dependencies([self.minimize(loss)]):
+                    return tuple([loop_var if isinstance(loop_var, tf.TensorArray) else nest.map_structure(tf.identity,
+                                                                                                        loop_var)
+                                  for loop_var in loop_vars_next])
+
+            (t_final, losses_final, losses_problem_final, vars_next,
+             vari_hist_next, grad_hist_next,
+             sq_vari_hist_next, sq_grad_hist_next,
+             delta_mv_avg_next, lr_mv_avg_next,
+             min_lr_next, global_step_next, hist_ptr_next) = tf.while_loop(
+                cond=lambda t, *_: t < steps_per_run,
+                body=update_multi,
+                loop_vars=([0, losses, losses_problem, problem.variables, args['vari_hist'], args['grad_hist'],
+                            args['sq_vari_hist'], args['sq_grad_hist'], args['delta_mv_avg'], args['lr_mv_avg'],
+                            args['min_lr'], args['global_step'], args['hist_ptr']]),
+                parallel_iterations=1,
+                swap_memory=True,
+                name="multi_step")
+
+            return {'x_next': vars_next,
                     'vari_hist_next': vari_hist_next,
                     'grad_hist_next': grad_hist_next,
                     'sq_vari_hist_next': sq_vari_hist_next,
                     'sq_grad_hist_next': sq_grad_hist_next,
-                    'delta_mv_avg_next': deltas_mv_avg_next,
+                    'delta_mv_avg_next': delta_mv_avg_next,
+                    'lr_mv_avg_next': lr_mv_avg_next,
                     'min_lr_next': min_lr_next,
                     'global_step_next': global_step_next,
-                    'lr_mv_avg_next': lr_mv_avg_next,
-                    'delta_lr': delta_lr_next}
+                    'hist_ptr_next': hist_ptr_next,
+                    'losses': losses_final.stack(),
+                    'losses_problem': losses_problem_final.stack(),
+                    'meta_steps': t_final if meta_step else 0}
 
     def update_history_ops(self, args):
         problem_no = args['problem_no']
@@ -1513,27 +1944,38 @@ class MlpNormHistory(Meta_Optimizer):
         batch_lr_mv_avg = args['batch_lr_mv_avg']
         batch_lr_mv_avg_next = args['batch_lr_mv_avg_next']
         init_ops = args['init_ops']
+        write_column = self.ring_history and args['single_step']
         history_ops = []
+        vari_hist_value = read_state(batch_vari_hist)
+        grad_hist_value = read_state(batch_grad_hist)
+        assign_state = lambda state, value: tf.assign(state, store_state(value, self.state_dtype))
         momentum_alpha = self.momentum_alpha[problem_no][batch_no] if self.learn_momentum_base else self.momentum_alpha
 
+        if write_column:
+            # ring buffer, overwrite the oldest column in place, hist_ptr is advanced by updates
+            hist_ptr = args['hist_ptr']
+            history_ops.append(batch_vari_hist[:, hist_ptr:hist_ptr + 1].assign(store_state(batch_variables, self.state_dtype)))
+            history_ops.append(batch_grad_hist[:, hist_ptr:hist_ptr + 1].assign(store_state(batch_gradients, self.state_dtype)))
+
         if init_ops:
             # tiled_batch_variables = tf.tile(batch_variables, [1, self.limit])
             # tiled_batch_grads = tf.tile(batch_gradients, [1, self.limit])
             if self.use_momentums:
-                tiled_batch_variables = batch_vari_hist * self.momentum_alpha + batch_variables * (1 - self.momentum_alpha)
-                tiled_batch_grads = batch_grad_hist * self.momentum_alpha + batch_gradients * (1 - self.momentum_alpha)
-            else:
-                tiled_batch_variables = tf.concat([batch_vari_hist[:, 1:], batch_variables], axis=1)
-                tiled_batch_grads = tf.concat([batch_grad_hist[:, 1:], batch_gradients], axis=1)
-            history_ops.append(tf.assign(batch_vari_hist, tiled_batch_variables))
-            history_ops.append(tf.assign(batch_grad_hist, tiled_batch_grads))
+                tiled_batch_variables = vari_hist_value * self.momentum_alpha + batch_variables * (1 - self.momentum_alpha)
+                tiled_batch_grads = grad_hist_value * self.momentum_alpha + batch_gradients * (1 - self.momentum_alpha)
+            elif not write_column:
+                tiled_batch_variables = tf.concat([vari_hist_value[:, 1:], batch_variables], axis=1)
+                tiled_batch_grads = tf.concat([grad_hist_value[:, 1:], batch_gradients], axis=1)
+            if not write_column:
+                history_ops.append(assign_state(batch_vari_hist, tiled_batch_variables))
+                history_ops.append(assign_state(batch_grad_hist, tiled_batch_grads))
             if self.normalize_with_sq_grad or self.use_noise_est:
-                history_ops.append(tf.assign(batch_sq_vari_hist, tf.square(tiled_batch_variables)))
-                history_ops.append(tf.assign(batch_sq_grad_hist, tf.square(tiled_batch_grads)))
+                history_ops.append(tf.assign(batch_sq_vari_hist, store_state(tf.square(tiled_batch_variables), self.sq_state_dtype)))
+                history_ops.append(tf.assign(batch_sq_grad_hist, store_state(tf.square(tiled_batch_grads), self.sq_state_dtype)))
             if self.use_dist_mv_avg:
                 with tf.control_dependencies(history_ops):
-                    max = tf.reduce_max(batch_vari_hist, axis=1, keep_dims=True)
-                    min = tf.reduce_min(batch_vari_hist, axis=1, keep_dims=True)
+                    max = tf.reduce_max(read_state(batch_vari_hist), axis=1, keep_dims=True)
+                    min = tf.reduce_min(read_state(batch_vari_hist), axis=1, keep_dims=True)
                     diff = max - min
                     tiled_diff = tf.tile(diff, [1, self.limit])
                     history_ops.append(tf.assign(batch_dist_mv_avg, tiled_diff))
@@ -1547,7 +1989,7 @@ class MlpNormHistory(Meta_Optimizer):
                 # updated_grad_hist = batch_grad_hist * momentum_alpha + batch_gradients * (1 - momentum_alpha)
                 history_ops.append(tf.assign(batch_vari_hist, batch_vari_hist_next))
                 history_ops.append(tf.assign(batch_grad_hist, batch_grad_hist_next))
-            else:
+            elif not write_column:
                 # updated_vari_hist = tf.concat([batch_vari_hist[:, 1:], batch_variables], axis=1)
                 # updated_grad_hist = tf.concat([batch_grad_hist[:, 1:], batch_gradients], axis=1)
                 history_ops.append(tf.assign(batch_vari_hist, batch_vari_hist_next))
@@ -1574,6 +2016,11 @@ class MlpNormHistory(Meta_Optimizer):
         return history_ops
 
     def updates(self, args=None):
+        if not args['update_problem_vars']:
+            return self.update_ops(args)
+        return self.guarded_updates(args['problem'], args['x_next'], lambda: self.update_ops(args))
+
+    def update_ops(self, args=None):
         with tf.name_scope('mlp_x_optimizer_updates'):
             x_next = args['x_next']
             problem_no = args['problem_no']
@@ -1587,13 +2034,14 @@ class MlpNormHistory(Meta_Optimizer):
             problem_lr_mv_avg = args['lr_mv_avg']
             update_problem_vars = args['update_problem_vars']
             init_ops = args['init_ops']
+            single_step = args['single_step'] if 'single_step' in args else True
 
-            problem_vari_hist_next = [None for variable in problem.variables]
-            problem_sq_vari_hist_next = [None for variable in problem.variables]
-            problem_grad_hist_next = [None for variable in problem.variables]
-            problem_sq_grad_hist_next = [None for variable in problem.variables]
-            problem_delta_mv_avg_next = [None for variable in problem.variables]
-            problem_lr_mv_avg_next = [None for variable in problem.variables]
+            problem_vari_hist_next = [None for variable in problem_vari_hist]
+            problem_sq_vari_hist_next = [None for variable in problem_vari_hist]
+            problem_grad_hist_next = [None for variable in problem_vari_hist]
+            problem_sq_grad_hist_next = [None for variable in problem_vari_hist]
+            problem_delta_mv_avg_next = [None for variable in problem_vari_hist]
+            problem_lr_mv_avg_next = [None for variable in problem_vari_hist]
 
             update_list = []
             if not init_ops:
@@ -1618,6 +2066,9 @@ class MlpNormHistory(Meta_Optimizer):
 
             flat_gradients = problem.get_gradients(x_next)
             flat_variables = [problem.flatten_input(i, variable) for i, variable in enumerate(x_next)]
+            if self.flat_state:
+                flat_gradients = [problem.pack(flat_gradients)]
+                flat_variables = [problem.pack(flat_variables)]
             for batch_no, (variable, grads, batch_vari_hist, batch_vari_hist_next, batch_grad_hist, batch_grad_hist_next,
                  batch_sq_vari_hist, batch_sq_vari_hist_next, batch_sq_grad_hist, batch_sq_grad_hist_next,
                  batch_dist_mvg_avg, batch_delta_mv_avg, batch_delta_mv_avg_next, batch_lr_mv_avg, batch_lr_mv_avg_next) in enumerate(zip(flat_variables,
@@ -1641,7 +2092,13 @@ class MlpNormHistory(Meta_Optimizer):
                                                             'batch_delta_mv_avg_next': batch_delta_mv_avg_next,
                                                             'batch_lr_mv_avg': batch_lr_mv_avg,
                                                             'batch_lr_mv_avg_next': batch_lr_mv_avg_next,
+                                                            'hist_ptr': args['hist_ptr'], 'single_step': single_step,
                                                             'init_ops': init_ops}))
+            if self.ring_history:
+                hist_ptr = args['hist_ptr']
+                hist_ptr_next = tf.mod(hist_ptr + 1, self.limit) if init_ops else args['hist_ptr_next']
+                with tf.control_dependencies(update_list):
+                    update_list.append(tf.assign(hist_ptr, hist_ptr_next))
             return update_list
 
     def reset_optimizer(self):
@@ -1669,21 +2126,30 @@ class MlpNormHistory(Meta_Optimizer):
             reset.append(tf.variables_initializer(problem_lr_mv_avg, name='reset_lr_mv_avg'))
         if self.decay_min_lr:
             reset.append(tf.variables_initializer([args['min_lr'], args['global_step']]))
+        if self.ring_history:
+            reset.append(tf.variables_initializer([args['hist_ptr']], name='reset_hist_ptr'))
         return reset
 
     def loss(self, args=None):
         with tf.name_scope('Problem_Loss'):
             problem = args['problem']
             variables = args['x_next'] if 'x_next' in args else problem.variables
-            return problem.loss(variables)
+            return problem.get_loss(variables)
 
     def run(self, args=None):
-        if args['train']:
-            ops_meta_step = self.ops_meta_step_train
+        # with steps_per_run > 1 a training call advances every problem steps_per_run steps in graph, each with its
+        # meta step, the returned losses are then of shape [problems, steps_per_run]. the loop applies the meta steps
+        # itself, calls without training (and inference builds) advance single steps.
+        if self.steps_per_run > 1 and args['train'] and self.ops_updates_multi_train:
+            ops_loss, ops_loss_problem = self.ops_loss_multi_train, self.ops_loss_problem_multi_train
+            ops_meta_step, ops_updates = self.ops_meta_step_multi_train, self.ops_updates_multi_train
         else:
+            ops_loss, ops_loss_problem = self.ops_loss_train, self.ops_loss_problem_train
+            ops_meta_step, ops_updates = self.ops_meta_step_train, self.ops_updates_train
+        if not args['train']:
             ops_meta_step = []
         start = timer()
-        op_loss, pr_loss, _, _ = self.session.run([self.ops_loss_train, self.ops_loss_problem_train, ops_meta_step, self.ops_updates_train])
+        op_loss, pr_loss, _, _ = self.session_run([ops_loss, ops_loss_problem, ops_meta_step, ops_updates])
         return timer() - start, np.array(op_loss), np.array(pr_loss)
 
     def updates_global(self):
@@ -1700,6 +2166,9 @@ class MlpNormHistory(Meta_Optimizer):
         else:
             ops_init = self.ops_init_train
             guide_step = self.guide_step_train
+        if index is not None:
+            ops_init = ops_init[index]
+            guide_step = guide_step[index]
         for i in range(self.limit):
             if self.use_guide_step:
                 self.session.run(guide_step)
@@ -1711,10 +2180,11 @@ class MlpNormHistory(Meta_Optimizer):
             ops_reset = self.ops_reset_problem_eval
         else:
             ops_reset = self.ops_reset_problem_train
-        self.session.run(ops_reset)
-        self.run_init(val)
+        reset_ops = ops_reset[index] if index is not None else ops_reset
+        self.session.run(reset_ops)
+        self.run_init(val, index)
 
-    def build(self):
+    def build_ops(self):
         self.ops_reset_optim = None
         self.ops_global_updates = []
 
@@ -1727,16 +2197,18 @@ class MlpNormHistory(Meta_Optimizer):
         self.ops_reset_problem_eval = []
 
         for problem_no, (problem, vari_hist, grad_hist, sq_vari_hist,
-                         sq_grad_hist, dist_mv_avg, delta_mv_avg, lr_mv_avg) in enumerate(zip(self.problems_eval, self.vari_hist_eval,
+                         sq_grad_hist, dist_mv_avg, delta_mv_avg, lr_mv_avg, hist_ptr) in enumerate(zip(self.problems_eval, self.vari_hist_eval,
                                                                                               self.grad_hist_eval, self.sq_vari_hist_eval,
                                                                                               self.sq_grad_hist_eval, self.dist_mv_avg,
-                                                                                              self.delta_mv_avg_eval, self.lr_mv_avg_eval)):
+                                                                                              self.delta_mv_avg_eval, self.lr_mv_avg_eval,
+                                                                                              self.hist_ptr_eval)):
             eval_args = {'problem_no': problem_no, 'problem': problem, 'vari_hist': vari_hist, 'grad_hist': grad_hist,
+                    'hist_ptr': hist_ptr,
                     'sq_vari_hist': sq_vari_hist, 'sq_grad_hist': sq_grad_hist,
                     'x_next': [variable.initialized_value() for variable in problem.variables],
                     'dist_mv_avg': dist_mv_avg, 'delta_mv_avg': delta_mv_avg, 'lr_mv_avg': lr_mv_avg,
                     'update_problem_vars': False, 'init_ops': True, 'min_lr': self.min_lr_train,  'global_step': self.global_step_eval, 'unroll_len': self.unroll_len_val}
-            init_ops = [self.updates(eval_args)]
+            init_ops = [self.advance_batch(problem, self.updates(eval_args), [])]
             eval_args['init_ops'] = False
             self.ops_init_eval.append(init_ops)
             step = self.step(eval_args)
@@ -1750,7 +2222,8 @@ class MlpNormHistory(Meta_Optimizer):
             eval_args['lr_mv_avg_next'] = step['lr_mv_avg_next']
             eval_args['min_lr_next'] = step['min_lr_next']
             eval_args['global_step_next'] = step['global_step_next']
-            updates = self.updates(eval_args)
+            eval_args['hist_ptr_next'] = step['hist_ptr_next']
+            updates = self.advance_batch(problem, self.updates(eval_args), self.ops_loss_problem_eval[problem_no])
             self.ops_step_eval.append(step)
             self.ops_updates_eval.append(updates)
             reset = self.reset_problem(eval_args)
@@ -1765,27 +2238,35 @@ class MlpNormHistory(Meta_Optimizer):
         self.ops_loss_problem_train = [tf.squeeze(self.loss({'problem': problem})) for problem in self.problems]
         self.ops_meta_step_train = []
         self.ops_reset_problem_train = []
-
+        self.ops_loss_multi_train = []
+        self.ops_loss_problem_multi_train = []
+        self.ops_updates_multi_train = []
+        self.ops_meta_step_multi_train = []
 
 
         for problem_no, (problem, vari_hist, grad_hist, sq_vari_hist,
-                         sq_grad_hist, dist_mv_avg, delta_mv_avg, lr_mv_avg) in enumerate(zip(self.problems, self.vari_hist_train,
+                         sq_grad_hist, dist_mv_avg, delta_mv_avg, lr_mv_avg, hist_ptr) in enumerate(zip(self.problems, self.vari_hist_train,
                                                                                               self.grad_hist_train, self.sq_vari_hist_train,
                                                                                               self.sq_grad_hist_train, self.dist_mv_avg,
-                                                                                              self.delta_mv_avg_train, self.lr_mv_avg_train)):
+                                                                                              self.delta_mv_avg_train, self.lr_mv_avg_train,
+                                                                                              self.hist_ptr_train)):
             args = {'problem_no': problem_no, 'problem': problem, 'vari_hist': vari_hist, 'grad_hist': grad_hist,
+                    'hist_ptr': hist_ptr,
                     'sq_vari_hist': sq_vari_hist, 'sq_grad_hist': sq_grad_hist,
                     'x_next': [variable.initialized_value() for variable in problem.variables],
                     'dist_mv_avg': dist_mv_avg, 'delta_mv_avg': delta_mv_avg, 'lr_mv_avg': lr_mv_avg,
                     'update_problem_vars': False, 'init_ops': True, 'min_lr': self.min_lr_train, 'global_step': self.global_step_train, 'unroll_len': self.unroll_len}
 
-            init_ops = [self.updates(args)]
+            init_ops = [self.advance_batch(problem, self.updates(args), [])]
             args['init_ops'] = False
             # if self.use_guide_step:
             #     init_ops.append(self.updates(args))
             self.ops_init_train.append(init_ops)
 
-            loss_curr = tf.log(self.loss(args) + 1e-20)
+            # the multi step continues from the state before the single step
+            multi_args = dict(args)
+            if not self.inference:
+                loss_curr = tf.log(self.loss(args) + 1e-20)
             step = self.step(args)
             args['x_next'] = step['x_next']
             args['vari_hist_next'] = step['vari_hist_next']
@@ -1797,19 +2278,42 @@ class MlpNormHistory(Meta_Optimizer):
             args['lr_mv_avg_next'] = step['lr_mv_avg_next']
             args['min_lr_next'] = step['min_lr_next']
             args['global_step_next'] = step['global_step_next']
+            args['hist_ptr_next'] = step['hist_ptr_next']
             updates = self.updates(args)
+            if self.inference:
+                self.ops_step_train.append(step)
+                self.ops_updates_train.append(self.advance_batch(problem, updates, self.ops_loss_problem_train[problem_no]))
+                self.ops_reset_problem_train.append(self.reset_problem(args))
+                continue
             loss_next = tf.log(self.loss(args) + 1e-20)
+            updates = self.advance_batch(problem, updates, [loss_curr, loss_next, self.ops_loss_problem_train[problem_no]])
             reset = self.reset_problem(args)
             self.ops_step_train.append(step)
             self.ops_updates_train.append(updates)
             loss = step['loss'] if 'loss' in step else tf.squeeze(loss_next - loss_curr)
             self.ops_loss_train.append(loss)
-            self.ops_meta_step_train.append(self.minimize(loss))
+            self.ops_meta_step_train.append(self.minimize(loss, problem))
             self.ops_reset_problem_train.append(reset)
+
+            if self.steps_per_run > 1:
+                # after the single step minimize, its slots are the ones the meta steps of the loop update
+                multi_args['steps_per_run'] = self.steps_per_run
+                multi_args['meta_step'] = True
+                multi_step = self.multi_step(multi_args)
+                for key in ['x_next', 'vari_hist_next', 'grad_hist_next', 'sq_vari_hist_next', 'sq_grad_hist_next',
+                            'delta_mv_avg_next', 'lr_mv_avg_next', 'min_lr_next', 'global_step_next', 'hist_ptr_next']:
+                    multi_args[key] = multi_step[key]
+                multi_args['update_problem_vars'] = True
+                # the loop already carried the whole histories, assign them instead of a single column
+                multi_args['single_step'] = False
+                self.ops_loss_multi_train.append(multi_step['losses'])
+                self.ops_loss_problem_multi_train.append(multi_step['losses_problem'])
+                self.ops_updates_multi_train.append(self.advance_batch(problem, self.updates(multi_args),
+                                                                       self.ops_loss_problem_train[problem_no]))
+                self.ops_meta_step_multi_train.append(multi_step['meta_steps'])
         self.ops_prob_acc = self.problems[0].accuracy()
         self.ops_reset_optim = self.reset_optimizer()
         self.ops_global_updates.append(self.updates_global())
-        self.init_saver_handle()
 
 
 
@@ -1823,6 +2327,8 @@ class MlpNormHistoryRNN(MlpNormHistory):
         self.use_rel_loss = args['use_rel_loss']
         self.unroll_len = args['unroll_len']
         self.unroll_len_val = args['unroll_len_val']
+        # the unroll carries whole histories through the loop, there is no single column to write
+        self.ring_history = False
 
     def step(self, args=None):
         problem = args['problem']
@@ -1936,6 +2442,8 @@ class AUGOptims(Meta_Optimizer):
     max_lr = None
     t_max = None
     decay_learning_rate = None
+    flat_state = None
+    fused_input_optims = None
 
     def __init__(self, problems, problems_eval, args):
         super(AUGOptims, self).__init__(problems, problems_eval, args)
@@ -1949,61 +2457,70 @@ class AUGOptims(Meta_Optimizer):
         self.ops_loss_problem_train = []
         self.ops_prob_acc = []
         self.ops_loss_std_adam = 0
+        self.ops_episode_done = []
 
         self.ops_updates_val = []
         self.ops_loss_problem_val = []
         self.ops_reset_problem_val = []
 
         def get_optimizers(problem):
+            if self.fused_input_optims:
+                betas_1 = [0.99, 0.9, 0.8, 0.7, 0.6, 0.5]
+                betas_2 = [0.9999, 0.999, 0.888, 0.777, 0.666, 0.555]
+                if self.num_input_optims == 11:
+                    betas_1.extend([0.95, 0.85, 0.75, 0.65, 0.55])
+                    betas_2.extend([0.9995, 0.8885, 0.7775, 0.6665, 0.5555])
+                return [MultiScaleAdam(problem, {'lr': self.lr_input_optims, 'beta_1': betas_1, 'beta_2': betas_2,
+                                                 'eps': 1e-8, 'state_dtype': self.state_dtype})]
             input_optimizers = []
             input_optimizers.append(Adam(problem, {'lr': self.lr_input_optims, 'beta_1': 0.99, 'beta_2': 0.9999,
-                                                     'eps': 1e-8, 'learn_betas': self.learn_betas,
+                                                     'eps': 1e-8, 'state_dtype': self.state_dtype, 'learn_betas': self.learn_betas,
                                                    'decay_learning_rate': args['decay_learning_rate'],
                                                    'min_lr': self.min_lr, 'max_lr': self.max_lr, 't_max': self.t_max}))
             input_optimizers.append(Adam(problem, {'lr': self.lr_input_optims, 'beta_1': 0.9, 'beta_2': 0.999,
-                                                     'eps': 1e-8, 'learn_betas': self.learn_betas,
+                                                     'eps': 1e-8, 'state_dtype': self.state_dtype, 'learn_betas': self.learn_betas,
                                                    'decay_learning_rate': args['decay_learning_rate'],
                                                    'min_lr': self.min_lr, 'max_lr': self.max_lr,
                                                    't_max': self.t_max}))
             input_optimizers.append(Adam(problem, {'lr': self.lr_input_optims, 'beta_1': 0.8, 'beta_2': 0.888,
-                                                     'eps': 1e-8, 'learn_betas': self.learn_betas,
+                                                     'eps': 1e-8, 'state_dtype': self.state_dtype, 'learn_betas': self.learn_betas,
                                                    'decay_learning_rate': args['decay_learning_rate'],
                                                    'min_lr': self.min_lr, 'max_lr': self.max_lr,
                                                    't_max': self.t_max}))
             input_optimizers.append(Adam(problem, {'lr': self.lr_input_optims, 'beta_1': 0.7, 'beta_2': 0.777,
-                                                     'eps': 1e-8, 'learn_betas': self.learn_betas,
+                                                     'eps': 1e-8, 'state_dtype': self.state_dtype, 'learn_betas': self.learn_betas,
                                                    'decay_learning_rate': args['decay_learning_rate'],
                                                    'min_lr': self.min_lr, 'max_lr': self.max_lr,
                                                    't_max': self.t_max}))
             input_optimizers.append(Adam(problem, {'lr': self.lr_input_optims, 'beta_1': 0.6, 'beta_2': 0.666,
-                                                     'eps': 1e-8, 'learn_betas': self.learn_betas,
+                                                     'eps': 1e-8, 'state_dtype': self.state_dtype, 'learn_betas': self.learn_betas,
                                                    'decay_learning_rate': args['decay_learning_rate'],
                                                    'min_lr': self.min_lr, 'max_lr': self.max_lr,
                                                    't_max': self.t_max}))
             input_optimizers.append(Adam(problem, {'lr': self.lr_input_optims, 'beta_1': 0.5, 'beta_2': 0.555,
-                                                   'eps': 1e-8, 'learn_betas': self.learn_betas,
+                                                   'eps': 1e-8, 'state_dtype': self.state_dtype, 'learn_betas': self.learn_betas,
                                                    'decay_learning_rate': args['decay_learning_rate'],
                                                    'min_lr': self.min_lr, 'max_lr': self.max_lr,
                                                    't_max': self.t_max}))
             if self.num_input_optims == 11:
                 input_optimizers.append(Adam(problem, {'lr': self.lr_input_optims, 'beta_1': 0.95, 'beta_2': 0.9995,
-                                                       'eps': 1e-8, 'learn_betas': self.learn_betas, 'decay_learning_rate': args['decay_learning_rate'],
+                                                       'eps': 1e-8, 'state_dtype': self.state_dtype, 'learn_betas': self.learn_betas, 'decay_learning_rate': args['decay_learning_rate'],
                                                        'min_lr': self.min_lr, 'max_lr': self.max_lr,
                                                        't_max': self.t_max}))
                 input_optimizers.append(Adam(problem, {'lr': self.lr_input_optims, 'beta_1': 0.85, 'beta_2': 0.8885,
-                                                       'eps': 1e-8, 'learn_betas': self.learn_betas, 'decay_learning_rate': args['decay_learning_rate'],
+                                                       'eps': 1e-8, 'state_dtype': self.state_dtype, 'learn_betas': self.learn_betas, 'decay_learning_rate': args['decay_learning_rate'],
                                                        'min_lr': self.min_lr, 'max_lr': self.max_lr,
                                                        't_max': self.t_max}))
                 input_optimizers.append(Adam(problem, {'lr': self.lr_input_optims, 'beta_1': 0.75, 'beta_2': 0.7775,
-                                                       'eps': 1e-8, 'learn_betas': self.learn_betas, 'decay_learning_rate': args['decay_learning_rate'],
+                                                       'eps': 1e-8, 'state_dtype': self.state_dtype, 'learn_betas': self.learn_betas, 'decay_learning_rate': args['decay_learning_rate'],
                                                        'min_lr': self.min_lr, 'max_lr': self.max_lr,
                                                        't_max': self.t_max}))
                 input_optimizers.append(Adam(problem, {'lr': self.lr_input_optims, 'beta_1': 0.65, 'beta_2': 0.6665,
-                                                       'eps': 1e-8, 'learn_betas': self.learn_betas, 'decay_learning_rate': args['decay_learning_rate'],
+                                                       'eps': 1e-8, 'state_dtype': self.state_dtype, 'learn_betas': self.learn_betas, 'decay_learning_rate': args['decay_learning_rate'],
                                                        'min_lr': self.min_lr, 'max_lr': self.max_lr,
                                                        't_max': self.t_max}))
                 input_optimizers.append(Adam(problem, {'lr': self.lr_input_optims, 'beta_1': 0.55, 'beta_2': 0.5555,
-                                                       'eps': 1e-8, 'learn_betas': self.learn_betas, 'decay_learning_rate': args['decay_learning_rate'],
+                                                       'eps': 1e-8, 'state_dtype': self.state_dtype, 'learn_betas': self.learn_betas, 'decay_learning_rate': args['decay_learning_rate'],
                                                        'min_lr': self.min_lr, 'max_lr': self.max_lr,
                                                        't_max': self.t_max}))
             return input_optimizers
@@ -2025,6 +2542,9 @@ class AUGOptims(Meta_Optimizer):
         self.use_adam_loss = args['use_adam_loss']
         self.use_input_optim_loss = args['use_input_optim_loss']
         self.use_input_optim_loss_rel = args['use_input_optim_loss_rel']
+        self.flat_state = args['flat_state'] if 'flat_state' in args else False
+        # learned betas are per timescale variables, they need the separate Adams
+        self.fused_input_optims = (args['fused_input_optims'] if 'fused_input_optims' in args else False) and not args['learn_betas']
         self.std_adam = Adam(self.problems[0], {'lr': self.lr_input_optims, 'beta_1': 0.9,
                                                 'beta_2': 0.999, 'eps': 1e-8}) if self.use_adam_loss else None
 
@@ -2047,7 +2567,7 @@ class AUGOptims(Meta_Optimizer):
                 self.input_optimizers_train.append(Adam(self.problems[0], {'lr': self.lr_input_optims,
                                                                      'beta_1': beta_1_base_curr,
                                                                      'beta_2': beta_2_base_curr,
-                                                                     'eps': 1e-8,
+                                                                     'eps': 1e-8, 'state_dtype': self.state_dtype,
                                                                      'learn_betas': self.learn_betas}))
         else:
             self.input_optimizers_train = get_optimizers(self.problems[0])
@@ -2110,13 +2630,7 @@ class AUGOptims(Meta_Optimizer):
                     lr_output = tf.nn.softmax(lr_output, 1)
                     lr_output = tf.matmul(lr_output, self.lr_dist)
             else:
-                activations = layer_fc(name='in', dims=[len(self.input_optimizers_train), self.layer_width], inputs=inputs,
-                                       variable_list=self.optimizer_variables, activation=self.network_activation)
-                for layer in range(self.hidden_layers):
-                    activations = layer_fc(str(layer + 1), dims=[self.layer_width, self.layer_width], inputs=activations,
-                                           variable_list=self.optimizer_variables, activation=self.network_activation)
-                activations = layer_fc('out', dims=[self.layer_width, self.network_out_dims], inputs=activations,
-                                       variable_list=self.optimizer_variables)
+                activations = self.fc_network(inputs, self.num_input_optims, self.network_out_dims)
                 last_index = 0
                 step_activations = tf.slice(activations, [0, last_index], [-1, self.num_input_optims])
                 softmax_activations = tf.nn.softmax(step_activations, 1)
@@ -2139,6 +2653,9 @@ class AUGOptims(Meta_Optimizer):
 
 
     def stack_inputs(self, optim_steps):
+        if len(optim_steps) == 1:
+            # MultiScaleAdam, the steps already are [P, N] per variable
+            return optim_steps[0]
         num_steps = len(optim_steps[0])
         stacked_steps = []
         for step in range(num_steps):
@@ -2175,6 +2692,8 @@ class AUGOptims(Meta_Optimizer):
                                  zip(args['input_optimizers'], input_optims_params)]
         input_optims_vars_next = [input_optims_step_op['vars_next'] for input_optims_step_op in
                                         input_optims_step_ops]
+        if self.fused_input_optims:
+            input_optims_vars_next = input_optims_vars_next[0]
         input_optims_vars_steps_next = [input_optims_step_op['vars_steps'] for input_optims_step_op in
                                         input_optims_step_ops]
         input_optims_params_next = [input_optims_step_op['optim_params_next'] for input_optims_step_op in
@@ -2186,8 +2705,16 @@ class AUGOptims(Meta_Optimizer):
                                            'gradients': gradients, 'optim_params': std_adam_params})
 
         stacked_steps = self.stack_inputs(input_optims_vars_steps_next)
-        for var, var_flat, stacked_step  in zip(problem_variables, problem_variables_flat, stacked_steps):
-            output, beta_1_output, beta_2_output, lr_output = self.network({'inputs': stacked_step})
+        if self.flat_state:
+            # run the network once over the rows of all variables and split the outputs back per variable
+            split_shapes = [int(shape) for shape in problem.variables_flattened_shape]
+            split_rows = lambda tensor: [None for shape in split_shapes] if tensor is None else tf.split(tensor, split_shapes, 0)
+            network_outputs = self.network({'inputs': tf.concat(stacked_steps, 0, name='packed_inputs')})
+            network_outputs = list(zip(*[split_rows(network_output) for network_output in network_outputs]))
+        else:
+            network_outputs = [self.network({'inputs': stacked_step}) for stacked_step in stacked_steps]
+        for var, var_flat, network_output in zip(problem_variables, problem_variables_flat, network_outputs):
+            output, beta_1_output, beta_2_output, lr_output = network_output
             if self.learn_lr:
                 applied_lr = lr_output
                 lr_next.append(applied_lr)
@@ -2218,6 +2745,9 @@ class AUGOptims(Meta_Optimizer):
                 'lr_next': lr_next, 'std_adam_step': std_adam_step}
 
     def updates(self, args=None):
+        return self.guarded_updates(args['problem'], args['vars_next'], lambda: self.update_ops(args))
+
+    def update_ops(self, args=None):
         problem = args['problem']
         problem_variables = args['variables']
         vars_next = args['vars_next']
@@ -2250,30 +2780,32 @@ class AUGOptims(Meta_Optimizer):
                 updates_list.extend(std_adam.updates({'optim_params_next': std_adam_step['optim_params_next']}))
         return updates_list
 
-    def reset(self, args=None):
+    def reset_variables(self, args=None):
         problems = args['problems']
         input_optimizers = args['input_optimizers']
-        reset_ops = [self.reset_problems(problems)]
+        reset_variables = [variable for problem in problems for variable in problem.variables + problem.constants]
         if self.learn_lr:
-            reset_ops.append(tf.variables_initializer(self.lr))
+            reset_variables.extend(self.lr)
         if self.decay_learning_rate:
-            reset_ops.append(tf.variables_initializer([args['lr'],
-                                                       args['t_curr']]))
+            reset_variables.extend([args['lr'], args['t_curr']])
         if self.use_adam_loss and 'std_adam' in args:
             std_adam = args['std_adam']
-            reset_ops.append(tf.variables_initializer([std_adam.t]))
-            reset_ops.append(tf.variables_initializer(std_adam.ms))
-            reset_ops.append(tf.variables_initializer(std_adam.vs))
+            reset_variables.append(std_adam.t)
+            reset_variables.extend(std_adam.ms)
+            reset_variables.extend(std_adam.vs)
         for optimizer in input_optimizers:
-            reset_ops.append(tf.variables_initializer([optimizer.t]))
-            reset_ops.append(tf.variables_initializer(optimizer.ms))
-            reset_ops.append(tf.variables_initializer(optimizer.vs))
+            reset_variables.append(optimizer.t)
+            reset_variables.extend(optimizer.ms)
+            reset_variables.extend(optimizer.vs)
             # if self.decay_learning_rate:
-            #     reset_ops.append(tf.variables_initializer([optimizer.t_curr, optimizer.lr]))
+            #     reset_variables.extend([optimizer.t_curr, optimizer.lr])
             if self.learn_betas:
-                reset_ops.append(tf.variables_initializer(optimizer.beta_1))
-                reset_ops.append(tf.variables_initializer(optimizer.beta_2))
-        return reset_ops
+                reset_variables.extend(optimizer.beta_1)
+                reset_variables.extend(optimizer.beta_2)
+        return reset_variables
+
+    def reset(self, args=None):
+        return [tf.variables_initializer(self.reset_variables(args), name='reset')]
 
     def run_reset(self, val=False, index=None, optimizer=False):
         if val:
@@ -2287,9 +2819,9 @@ class AUGOptims(Meta_Optimizer):
         with tf.name_scope('Problem_Loss'):
             problem = args['problem']
             variables = args['vars_next'] if 'vars_next' in args else problem.variables
-            return problem.loss(variables)
+            return problem.get_loss(variables)
 
-    def build(self):
+    def build_ops(self):
         # validation
         for i, (problem_eval, input_optimizers_eval) in enumerate(zip(self.problems_eval, self.input_optimizers_eval)):
             problem_eval_variables = problem_eval.variables
@@ -2308,8 +2840,8 @@ class AUGOptims(Meta_Optimizer):
             val_args['input_optims_params_next'] = val_step['input_optims_params_next']
             if self.decay_learning_rate:
                 val_args['lr_next'] = val_step['lr_next']
-            updates_val = self.updates(val_args)
             loss_prob_val = self.loss(val_args)
+            updates_val = self.advance_batch(problem_eval, self.updates(val_args), loss_prob_val)
             self.ops_loss_problem_val.append(loss_prob_val)
             self.ops_updates_val.append(updates_val)
             self.ops_reset_problem_val.append(self.reset(reset_args_val))
@@ -2325,11 +2857,17 @@ class AUGOptims(Meta_Optimizer):
         if self.decay_learning_rate:
             args['t_curr'] = self.t_curr
             reset_args['t_curr'] = self.t_curr
+        if self.inference:
+            # the reference Adam only feeds the meta loss
+            args.pop('std_adam')
         step = self.step(args)
         args['vars_next'] = step['vars_next']
         args['input_optims_params_next'] = step['input_optims_params_next']
         if self.decay_learning_rate:
             args['lr_next'] = step['lr_next']
+        if self.inference:
+            self.build_inference_ops(problem, step, self.updates(args), loss_prob, reset_args)
+            return
         loss_next = self.loss(args)
         optim_log_loss = tf.log(loss_next + 1e-15)
         if self.use_input_optim_loss:
@@ -2352,8 +2890,9 @@ class AUGOptims(Meta_Optimizer):
             #                          lambda: 2 * optim_log_loss - log_std_adam_loss,
             #                          lambda: optim_log_loss)
             optim_log_loss = 2 * optim_log_loss - log_std_adam_loss
-        updates = self.updates(args)
-        meta_step = self.minimize(optim_log_loss)
+        updates = self.advance_batch(problem, self.updates(args), [loss_prob, optim_log_loss])
+        updates = self.episode_updates(problem, updates, loss_prob, self.reset_variables(reset_args))
+        meta_step = self.minimize(optim_log_loss, problem)
 
         reset = self.reset(reset_args)
         self.ops_step.append(step)
@@ -2364,7 +2903,14 @@ class AUGOptims(Meta_Optimizer):
         self.ops_reset_problem_train.append(reset)
         self.ops_prob_acc = problem.accuracy()
         self.ops_reset.append(self.ops_reset_problem_train)
-        self.init_saver_handle()
+
+    def build_inference_ops(self, problem, step, updates, loss_prob, reset_args):
+        self.ops_step.append(step)
+        self.ops_updates_train.append(self.advance_batch(problem, updates, loss_prob))
+        self.ops_loss_problem_train.append(loss_prob)
+        self.ops_reset_problem_train.append(self.reset(reset_args))
+        self.ops_prob_acc = problem.accuracy()
+        self.ops_reset.append(self.ops_reset_problem_train)
 
     def run(self, args=None):
         if args['train']:
@@ -2378,8 +2924,10 @@ class AUGOptims(Meta_Optimizer):
             ops_loss_problem = self.ops_loss_problem_val
             ops_updates = self.ops_updates_val
 
+        ops_episode_done = self.ops_episode_done if args['train'] else []
         start = timer()
-        op_loss, pr_loss, _, _ = self.session.run([ops_loss, ops_loss_problem, ops_meta_step, ops_updates])
+        op_loss, pr_loss, _, _, self.episode_done = self.session_run([ops_loss, ops_loss_problem, ops_meta_step,
+                                                                      ops_updates, ops_episode_done])
         return timer() - start, np.array(op_loss), np.array(pr_loss)
 
 
@@ -2387,10 +2935,12 @@ class AUGOptimsRNN(AUGOptims):
 
     unroll_len = None
     unroll_len_val = None
+    checkpoint_steps = None
     def __init__(self, problems, problems_eval, args):
         super(AUGOptimsRNN, self).__init__(problems, problems_eval, args)
         self.unroll_len = args['unroll_len']
         self.unroll_len_val = args['unroll_len_val']
+        self.checkpoint_steps = args['checkpoint_steps'] if 'checkpoint_steps' in args else None
 
     def step(self, args=None):
         problem = args['problem']
@@ -2399,6 +2949,8 @@ class AUGOptimsRNN(AUGOptims):
         lr = args['lr']
         t_curr = args['t_curr'] if self.decay_learning_rate else 0
         unroll_len = args['unroll_len']
+        # only the meta trained unroll is checkpointed
+        checkpoint_steps = args['checkpoint_steps'] if 'checkpoint_steps' in args else None
         input_optimizers = args['input_optimizers']
         input_optims_params = [optimizer.optim_params for optimizer in input_optimizers]
         loss = 0.0
@@ -2412,6 +2964,8 @@ class AUGOptimsRNN(AUGOptims):
             vars_next = step_op['vars_next']
             lr_next = step_op['lr_next']
             input_optims_params_next = step_op['input_optims_params_next']
+            if self.inference:
+                return t + 1, loss, vars_next, input_optims_params_next, lr_next, t_curr + 1
 
             loss_curr = tf.squeeze(tf.log(self.loss({'problem': problem, 'vars_next': vars_next}) + 1e-15))
             if self.use_rel_loss:
@@ -2430,20 +2984,25 @@ class AUGOptimsRNN(AUGOptims):
                 loss_next = loss + loss_curr
             return t + 1, loss_next, vars_next, input_optims_params_next, lr_next, t_curr + 1
 
-        t_final, loss_final, problem_variables_next, input_optims_params_next, lr_next, t_curr_final = tf.while_loop(
-        cond=lambda t, *_: t < unroll_len,
-        body=update_rnn,
-        loop_vars=([0, loss, problem_variables, input_optims_params, lr, t_curr]),
-        parallel_iterations=1,
-        swap_memory=True,
-        name="unroll")
+        unroll_vars = [0, loss, problem_variables, input_optims_params, lr, t_curr]
+        if checkpoint_steps and not self.inference:
+            t_final, loss_final, problem_variables_next, input_optims_params_next, lr_next, t_curr_final = \
+                self.checkpointed_unroll(update_rnn, unroll_vars, unroll_len, checkpoint_steps, name="unroll")
+        else:
+            t_final, loss_final, problem_variables_next, input_optims_params_next, lr_next, t_curr_final = tf.while_loop(
+            cond=lambda t, *_: t < unroll_len,
+            body=update_rnn,
+            loop_vars=(unroll_vars),
+            parallel_iterations=1,
+            swap_memory=True,
+            name="unroll")
         # _, loss_final, problem_variables_next, input_optims_params_next, lr_next = update_rnn(0, loss, problem_variables, input_optims_params, lr)
         avg_loss = loss_final / unroll_len
         return {'vars_next': problem_variables_next, 'input_optims_params_next': input_optims_params_next,
                 'loss': avg_loss, 'lr_next': lr_next, 't_curr_next': t_curr_final}
 
 
-    def build(self):
+    def build_ops(self):
         # validation
         for i, (problem_eval, input_optimizers_eval) in enumerate(zip(self.problems_eval, self.input_optimizers_eval)):
             problem_eval_variables = problem_eval.variables
@@ -2462,8 +3021,8 @@ class AUGOptimsRNN(AUGOptims):
             val_args['input_optims_params_next'] = val_step['input_optims_params_next']
             val_args['lr_next'] = val_step['lr_next']
             val_args['t_curr_next'] = val_step['t_curr_next']
-            updates_val = self.updates(val_args)
             loss_prob_val = self.loss(val_args)
+            updates_val = self.advance_batch(problem_eval, self.updates(val_args), loss_prob_val)
             self.ops_loss_problem_val.append(loss_prob_val)
             self.ops_updates_val.append(updates_val)
             self.ops_reset_problem_val.append(self.reset(reset_args_val))
@@ -2476,7 +3035,7 @@ class AUGOptimsRNN(AUGOptims):
 
         args = {'problem': problem, 'variables': problem_variables,
                 'variables_flat': problem_variables_flat, 'gradients': gradients, 'unroll_len': self.unroll_len,
-                'lr': self.lr, 'loss_prob_0': loss_prob, 'input_optimizers': self.input_optimizers_train}
+                'checkpoint_steps': self.checkpoint_steps, 'lr': self.lr, 'loss_prob_0': loss_prob, 'input_optimizers': self.input_optimizers_train}
         reset_args = {'problems': [problem], 'input_optimizers': self.input_optimizers_train, 'lr': self.lr,
                       'std_adam': self.std_adam}
         if self.decay_learning_rate:
@@ -2487,9 +3046,13 @@ class AUGOptimsRNN(AUGOptims):
         args['lr_next'] = step['lr_next']
         args['input_optims_params_next'] = step['input_optims_params_next']
         args['t_curr_next'] = step['t_curr_next']
-        updates = self.updates(args)
+        if self.inference:
+            self.build_inference_ops(problem, step, self.updates(args), loss_prob, reset_args)
+            return
         step_loss = step['loss']
-        meta_step = self.minimize(step_loss)
+        updates = self.advance_batch(problem, self.updates(args), [loss_prob, step_loss])
+        updates = self.episode_updates(problem, updates, loss_prob, self.reset_variables(reset_args))
+        meta_step = self.minimize(step_loss, problem)
         reset = self.reset(reset_args)
         self.ops_step.append(step)
         self.ops_prob_acc = problem.accuracy()
@@ -2499,7 +3062,6 @@ class AUGOptimsRNN(AUGOptims):
         self.ops_meta_step.append(meta_step)
         self.ops_reset_problem_train.append(reset)
         self.ops_reset.append(self.ops_reset_problem_train)
-        self.init_saver_handle()
 
 
 class AUGOptimsGRU(Meta_Optimizer):
@@ -2754,7 +3316,7 @@ class AUGOptimsGRU(Meta_Optimizer):
         with tf.name_scope('Problem_Loss'):
             problem = args['problem']
             variables = args['vars_next'] if 'vars_next' in args else problem.variables
-            return tf.squeeze(problem.loss(variables))
+            return tf.squeeze(problem.get_loss(variables))
 
     def run_reset(self, val=False, index=None, optimizer=False):
         if val:
@@ -2788,8 +3350,8 @@ class AUGOptimsGRU(Meta_Optimizer):
             val_args['vars_next'] = val_step['vars_next']
             val_args['hidden_states_next'] = val_step['hidden_states_next']
             val_args['input_optims_params_next'] = val_step['input_optims_params_next']
-            updates_val = self.updates(val_args)
             loss_prob_val = self.loss(val_args)
+            updates_val = self.advance_batch(problem_eval, self.updates(val_args), loss_prob_val)
             self.ops_loss_problem_val.append(loss_prob_val)
             self.ops_updates_val.append(updates_val)
             self.ops_reset_problem_val.append(self.reset({'problems': [problem_eval],
@@ -2807,8 +3369,8 @@ class AUGOptimsGRU(Meta_Optimizer):
         args['vars_next'] = step['vars_next']
         args['input_optims_params_next'] = step['input_optims_params_next']
         args['hidden_states_next'] = step['hidden_states_next']
-        updates = self.updates(args)
         loss_next = step['loss']
+        updates = self.advance_batch(problem, self.updates(args), [loss_prob, loss_next])
         meta_step = self.minimize(loss_next)
         reset = self.reset({'problems': [problem],
                                        'input_optimizers': self.input_optimizers_train,
@@ -2834,7 +3396,7 @@ class AUGOptimsGRU(Meta_Optimizer):
             ops_loss_problem = self.ops_loss_problem_val
             ops_updates = self.ops_updates_val
         start = timer()
-        op_loss, pr_loss, _, _ = self.session.run([ops_loss, ops_loss_problem, ops_meta_step, ops_updates])
+        op_loss, pr_loss, _, _ = self.session_run([ops_loss, ops_loss_problem, ops_meta_step, ops_updates])
         return timer() - start, np.array(op_loss), np.array(pr_loss)
 
 class AUGOptimsGRUAll(Meta_Optimizer):
@@ -2851,6 +3413,7 @@ class AUGOptimsGRUAll(Meta_Optimizer):
     std_adam = None
     use_input_optim_loss = None
     use_input_optim_loss_rel = None
+    checkpoint_steps = None
 
     def __init__(self, problems, problems_eval, args):
         def get_optimizers(problem):
@@ -2920,6 +3483,7 @@ class AUGOptimsGRUAll(Meta_Optimizer):
         self.num_input_optims = args['num_input_optims']
         self.unroll_len = args['unroll_len']
         self.unroll_len_val = args['unroll_len_val']
+        self.checkpoint_steps = args['checkpoint_steps'] if 'checkpoint_steps' in args else None
         self.learn_betas = args['learn_betas']
         self.learn_lr = args['learn_lr']
         self.beta_max = args['beta_max']
@@ -3042,6 +3606,8 @@ class AUGOptimsGRUAll(Meta_Optimizer):
         problem_variables = args['variables']
         hidden_states = args['hidden_states']
         unroll_len = args['unroll_len']
+        # only the meta trained unroll is checkpointed
+        checkpoint_steps = args['checkpoint_steps'] if 'checkpoint_steps' in args else None
         input_optimizers = args['input_optimizers']
         if self.use_adam_loss and 'std_adam' in args:
             std_adam = args['std_adam']
@@ -3128,13 +3694,18 @@ class AUGOptimsGRUAll(Meta_Optimizer):
                     loss_next = loss + loss_curr
             return t + 1, loss_next, vars_next, input_optims_params_next, hidden_states_next, lr_next, std_adam_params_next
 
-        t_final, loss_final, problem_variables_next, input_optims_params_next, hidden_states_next, lr_next, std_adam_params_next = tf.while_loop(
-        cond=lambda t, *_: t < unroll_len,
-        body=update_rnn,
-        loop_vars=([0, loss, problem_variables, input_optims_params, hidden_states, lr, std_adam_params]),
-        parallel_iterations=1,
-        swap_memory=True,
-        name="unroll")
+        unroll_vars = [0, loss, problem_variables, input_optims_params, hidden_states, lr, std_adam_params]
+        if checkpoint_steps:
+            t_final, loss_final, problem_variables_next, input_optims_params_next, hidden_states_next, lr_next, std_adam_params_next = \
+                self.checkpointed_unroll(update_rnn, unroll_vars, unroll_len, checkpoint_steps, name="unroll")
+        else:
+            t_final, loss_final, problem_variables_next, input_optims_params_next, hidden_states_next, lr_next, std_adam_params_next = tf.while_loop(
+            cond=lambda t, *_: t < unroll_len,
+            body=update_rnn,
+            loop_vars=(unroll_vars),
+            parallel_iterations=1,
+            swap_memory=True,
+            name="unroll")
         # _, loss_final, problem_variables_next, input_optims_params_next, hidden_states_next, lr_next = \
         #     update_rnn(0, loss, problem_variables, input_optims_params, hidden_states, lr)
         avg_loss = loss_final / unroll_len
@@ -3202,7 +3773,7 @@ class AUGOptimsGRUAll(Meta_Optimizer):
         with tf.name_scope('Problem_Loss'):
             problem = args['problem']
             variables = args['vars_next'] if 'vars_next' in args else problem.variables
-            return tf.squeeze(problem.loss(variables))
+            return tf.squeeze(problem.get_loss(variables))
 
     def build(self):
         self.ops_step = []
@@ -3229,8 +3800,8 @@ class AUGOptimsGRUAll(Meta_Optimizer):
             val_args['hidden_states_next'] = val_step['hidden_states_next']
             val_args['lr_next'] = val_step['lr_next']
             val_args['input_optims_params_next'] = val_step['input_optims_params_next']
-            updates_val = self.updates(val_args)
             loss_prob_val = self.loss(val_args)
+            updates_val = self.advance_batch(problem_eval, self.updates(val_args), loss_prob_val)
             self.ops_loss_problem_val.append(loss_prob_val)
             self.ops_updates_val.append(updates_val)
             self.ops_reset_problem_val.append(self.reset({'problems': [problem_eval],
@@ -3243,7 +3814,7 @@ class AUGOptimsGRUAll(Meta_Optimizer):
 
         args = {'problem': problem, 'variables': problem_variables, 'input_optimizers': self.input_optimizers_train,
                 'hidden_states': self.hidden_states[0], 'unroll_len': self.unroll_len,
-                'lr': self.lr, 'loss_prob_0': loss_prob, 'std_adam': self.std_adam}
+                'checkpoint_steps': self.checkpoint_steps, 'lr': self.lr, 'loss_prob_0': loss_prob, 'std_adam': self.std_adam}
         step = self.step(args)
         args['vars_next'] = step['vars_next']
         args['input_optims_params_next'] = step['input_optims_params_next']
@@ -3251,8 +3822,8 @@ class AUGOptimsGRUAll(Meta_Optimizer):
         args['lr_next'] = step['lr_next']
         if self.use_adam_loss:
             args['std_adam_params_next'] = step['std_adam_params_next']
-        updates = self.updates(args)
         loss_next = step['loss']
+        updates = self.advance_batch(problem, self.updates(args), [loss_prob, loss_next])
         meta_step = self.minimize(loss_next)
         reset = self.reset({'problems': [problem],
                                        'input_optimizers': self.input_optimizers_train,
@@ -3278,7 +3849,7 @@ class AUGOptimsGRUAll(Meta_Optimizer):
             ops_loss_problem = self.ops_loss_problem_val
             ops_updates = self.ops_updates_val
         start = timer()
-        op_loss, pr_loss, _, _ = self.session.run([ops_loss, ops_loss_problem, ops_meta_step, ops_updates])
+        op_loss, pr_loss, _, _ = self.session_run([ops_loss, ops_loss_problem, ops_meta_step, ops_updates])
         return timer() - start, np.array(op_loss), np.array(pr_loss)
 
 class GRUNormHistory(MlpNormHistory):
@@ -3600,7 +4171,7 @@ class GRUNormHistory(MlpNormHistory):
                     'grad_history': grad_sign_history, 'history_ptr': history_ptr,
                     'x_next': [variable.initialized_value() for variable in problem.variables],
                     'init_ops': True, 'vari_mom': vari_mom, 'grad_mom': grad_mom, 'hidden_states': hidden_states}
-            self.ops_init.append(self.updates(args))
+            self.ops_init.append(self.advance_batch(problem, self.updates(args), []))
             loss_curr = tf.log(self.loss(args) + 1e-20)
             step = self.step(args)
             args['x_next'] = step['x_next']
@@ -3612,6 +4183,7 @@ class GRUNormHistory(MlpNormHistory):
             args['init_ops'] = False
             updates = self.updates(args)
             loss_next = tf.log(self.loss(args) + 1e-20)
+            updates = self.advance_batch(problem, updates, [loss_curr, loss_next, self.ops_loss_problem[problem_no]])
             reset = self.reset_problem(args)
             self.ops_step.append(step)
             self.ops_updates.append(updates)
@@ -3689,12 +4261,12 @@ class L2L2(Meta_Optimizer):
                 variables_tiled = tf.tile(variable_gradient, [1, self.num_time_scales])
                 variables_tiled_sq = tf.square(variables_tiled)
                 variables_normalized = tf.divide(variables_tiled, tf.sqrt(variables_tiled_sq))
-                grad_moving_avg.append(tf.get_variable(name='norm_grad_avg_' + str(i) + '_' + str(j), initializer=variables_tiled))
-                avg_sq_grad_moving_avg.append(tf.get_variable(name='avg_sq_grad_moving_avg_' + str(i) + '_' + str(j), initializer=variables_tiled_sq))
-                norm_grad_moving_avg.append(tf.get_variable(name='norm_grad_moving_avg_' + str(i) + '_' + str(j), initializer=variables_normalized))
-                relative_log_grad_mag.append(tf.get_variable(name='relative_log_grad_mag_' + str(i) + '_' + str(j), initializer=tf.zeros_initializer, shape=[variable_gradient.get_shape()[0], self.num_time_scales]))
-                relative_learning_rate.append(tf.get_variable(name='realtive_learning_rate' + str(i) + '_' + str(j), initializer=tf.zeros_initializer, shape=[variable_gradient.get_shape()[0], 1]))
-                learning_rate_moving_avg.append(tf.get_variable(name='variable_learning_rate' + str(i) + '_' + str(j), initializer=tf.ones([variable_gradient.get_shape()[0], 1]) * tf.log(1e-6)))
+                grad_moving_avg.append(tf.get_variable(name='norm_grad_avg_' + str(i) + '_' + str(j), initializer=store_state(variables_tiled, self.state_dtype)))
+                avg_sq_grad_moving_avg.append(tf.get_variable(name='avg_sq_grad_moving_avg_' + str(i) + '_' + str(j), initializer=store_state(variables_tiled_sq, self.sq_state_dtype)))
+                norm_grad_moving_avg.append(tf.get_variable(name='norm_grad_moving_avg_' + str(i) + '_' + str(j), initializer=store_state(variables_normalized, self.state_dtype)))
+                relative_log_grad_mag.append(tf.get_variable(name='relative_log_grad_mag_' + str(i) + '_' + str(j), initializer=tf.zeros_initializer, shape=[variable_gradient.get_shape()[0], self.num_time_scales], dtype=self.state_dtype))
+                relative_learning_rate.append(tf.get_variable(name='realtive_learning_rate' + str(i) + '_' + str(j), initializer=tf.zeros_initializer, shape=[variable_gradient.get_shape()[0], 1], dtype=self.state_dtype))
+                learning_rate_moving_avg.append(tf.get_variable(name='variable_learning_rate' + str(i) + '_' + str(j), initializer=store_state(tf.ones([variable_gradient.get_shape()[0], 1]) * tf.log(1e-6), self.state_dtype)))
             self.grad_moving_avg.append(grad_moving_avg)
             self.avg_sq_grad_moving_avg.append(avg_sq_grad_moving_avg)
             self.norm_grad_moving_avg.append(norm_grad_moving_avg)
@@ -3738,6 +4310,12 @@ class L2L2(Meta_Optimizer):
             problem_relative_learning_rate = args['relative_learning_rate']
             problem_learning_rate_moving_avg = args['learning_rate_moving_avg']
             problem_hidden_states = args['hidden_states']
+            # the unroll runs on float32 copies of the (state_dtype) moving averages
+            (problem_grad_moving_avg, problem_avg_sq_grad_moving_avg, problem_norm_grad_moving_avg,
+             problem_relative_log_grad_mag, problem_relative_learning_rate, problem_learning_rate_moving_avg) = [
+                [read_state(state) for state in states] for states in
+                [problem_grad_moving_avg, problem_avg_sq_grad_moving_avg, problem_norm_grad_moving_avg,
+                 problem_relative_log_grad_mag, problem_relative_learning_rate, problem_learning_rate_moving_avg]]
             total_varialbes = 0
             for variable in problem.variables_flat:
                 total_varialbes += variable.get_shape().as_list()[0]
@@ -3834,12 +4412,12 @@ class L2L2(Meta_Optimizer):
                 new_points = problem.set_shape(variable_next_flat, like_variable=variable_orig, op_name='reshaped_new_points')
                 x_next.append(new_points)
             return {'x_next': x_next,
-                    'grad_moving_avg_next': problem_grad_moving_avg_next,
-                    'avg_sq_grad_moving_avg_next': problem_avg_sq_grad_moving_avg_next,
-                    'norm_grad_moving_avg_next': problem_norm_grad_moving_avg_next,
-                    'relative_log_grad_mag_next': problem_relative_log_grad_mag_next,
-                    'relative_learning_rate_next': problem_relative_learning_rate_next,
-                    'learning_rate_moving_avg_next': problem_learning_rate_moving_avg_next,
+                    'grad_moving_avg_next': self.store_states(problem_grad_moving_avg_next),
+                    'avg_sq_grad_moving_avg_next': self.store_states(problem_avg_sq_grad_moving_avg_next, self.sq_state_dtype),
+                    'norm_grad_moving_avg_next': self.store_states(problem_norm_grad_moving_avg_next),
+                    'relative_log_grad_mag_next': self.store_states(problem_relative_log_grad_mag_next),
+                    'relative_learning_rate_next': self.store_states(problem_relative_learning_rate_next),
+                    'learning_rate_moving_avg_next': self.store_states(problem_learning_rate_moving_avg_next),
                     'hidden_states_next': problem_hidden_states_next}
 
     def run_reset(self, index=None, optimizer=False):
@@ -3922,14 +4500,14 @@ class L2L2(Meta_Optimizer):
         else:
             ops_meta_step = []
         start = timer()
-        op_loss, pr_loss, _, _ = self.session.run([self.ops_loss, self.ops_loss_problem, ops_meta_step, self.ops_updates])
+        op_loss, pr_loss, _, _ = self.session_run([self.ops_loss, self.ops_loss_problem, ops_meta_step, self.ops_updates])
         return timer() - start, np.array(op_loss), np.array(pr_loss)
 
     def loss(self, args=None):
         with tf.name_scope('Problem_Loss'):
             problem = args['problem']
             variables = args['x_next'] if 'x_next' in args else problem.variables
-            return problem.loss(variables)
+            return problem.get_loss(variables)
 
     def build(self):
         self.ops_step = []
@@ -3971,6 +4549,7 @@ class L2L2(Meta_Optimizer):
             args['hidden_states_next'] = step['hidden_states_next']
             updates = self.updates(args)
             loss_next = tf.log(self.loss(args) + 1e-20)
+            updates = self.advance_batch(problem, updates, [loss_curr, loss_next, self.ops_loss_problem[problem_no]])
             reset = self.reset_problem(args)
             self.ops_step.append(step)
             self.ops_updates.append(updates)
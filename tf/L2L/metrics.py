@@ -0,0 +1,138 @@
+from __future__ import print_function
+import os
+import errno
+import glob
+import atexit
+import threading
+import numpy as np
+from six.moves import queue
+from timeit import default_timer as timer
+
+
+# Every series (loss, meta_lr, ...) is a file <directory>/<series>.f64: an int64 column count followed by the
+# float64 rows appended so far. Rows are collected in a fixed size buffer per series, full buffers (and every
+# flush_interval seconds all buffers, low rate series like the validation loss are not held back for the whole run)
+# are handed to a background thread that appends them, so logging every step never waits for the disk. Rows are only
+# appended to a
+# file with the same column count, a failed write is raised again from the next log() or close().
+
+
+def series_path(directory, series):
+    return os.path.join(directory, series + '.f64')
+
+
+def read_series(path):
+    # plain text logs of older runs are still read with np.loadtxt
+    if not path.endswith('.f64'):
+        return np.loadtxt(path)
+    with open(path, 'rb') as series_file:
+        width = int(np.frombuffer(series_file.read(8), dtype=np.int64)[0])
+        rows = np.frombuffer(series_file.read(), dtype=np.float64)
+    # a partial last row of an interrupted write is dropped
+    rows = rows[:rows.size - rows.size % width].reshape([-1, width])
+    return rows[:, 0] if width == 1 else rows
+
+
+def list_series(directory):
+    return sorted([os.path.basename(path)[:-len('.f64')] for path in glob.glob(series_path(directory, '*'))])
+
+
+class MetricsWriter():
+
+    directory = None
+    capacity = None
+    buffers = None
+    counts = None
+    pending = None
+    thread = None
+    error = None
+    flush_interval = None
+    last_flush = None
+
+    def __init__(self, directory, capacity=1000, flush_interval=30.0):
+        self.directory = directory
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.last_flush = timer()
+        self.buffers = dict()
+        self.counts = dict()
+        self.pending = queue.Queue()
+        self.thread = threading.Thread(target=self.write_pending)
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.close)
+
+    def write_pending(self):
+        while True:
+            series, rows = self.pending.get()
+            try:
+                self.write_rows(series_path(self.directory, series), rows)
+            except Exception as error:
+                self.error = error
+            finally:
+                self.pending.task_done()
+
+    @staticmethod
+    def write_rows(path, rows):
+        # python 2 has no exist_ok
+        if not os.path.exists(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+        header = np.array([rows.shape[1]], dtype=np.int64).tobytes()
+        # a file without a complete header is started over
+        if os.path.exists(path) and os.path.getsize(path) >= len(header):
+            with open(path, 'rb') as series_file:
+                width = int(np.frombuffer(series_file.read(8), dtype=np.int64)[0])
+            if width != rows.shape[1]:
+                # an earlier run (or another process) wrote the series with another column count
+                raise ValueError('Series ' + path + ' has ' + str(width) + ' columns, got ' + str(rows.shape[1]))
+            header = b''
+        with open(path, 'ab' if not header else 'wb') as series_file:
+            series_file.write(header + rows.tobytes())
+
+    def raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def log(self, series, values):
+        self.raise_error()
+        row = np.asarray(values, dtype=np.float64).ravel()
+        if series not in self.buffers:
+            self.buffers[series] = np.zeros([self.capacity, row.size])
+            self.counts[series] = 0
+        buffer = self.buffers[series]
+        if row.size != buffer.shape[1]:
+            raise ValueError('Series ' + series + ' has ' + str(buffer.shape[1]) + ' columns, got ' + str(row.size))
+        buffer[self.counts[series]] = row
+        self.counts[series] += 1
+        if self.counts[series] == self.capacity:
+            self.flush(series)
+        elif timer() - self.last_flush > self.flush_interval:
+            self.flush()
+
+    def flush(self, series=None):
+        if series is None:
+            self.last_flush = timer()
+        for name in ([series] if series is not None else list(self.buffers)):
+            if self.counts[name] > 0:
+                self.pending.put((name, self.buffers[name][:self.counts[name]].copy()))
+                self.counts[name] = 0
+
+    def close(self):
+        self.flush()
+        self.pending.join()
+        self.raise_error()
+
+
+writers = {}
+
+
+def get_writer(directory='metrics'):
+    # one writer per directory and process, shared by util.write_update and the drivers
+    if directory not in writers:
+        writers[directory] = MetricsWriter(directory)
+    return writers[directory]
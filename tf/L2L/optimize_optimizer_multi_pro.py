@@ -1,174 +1,40 @@
 from __future__ import print_function
-import tensorflow as tf
-import numpy as np
-import problems
+import multiprocessing
 import meta_optimizers
+import parallel_trainer
 import util
 import config
-from preprocess import Preprocess
 
-l2l = tf.Graph()
-with l2l.as_default():
-    tf.set_random_seed(0)
-    preprocess = [Preprocess.log_sign, {'k': 10}]
+# Meta trains on the problems of problems.create_batches_all, split over worker processes. Every worker computes
+# the meta gradients of its problems, the coordinator averages them and broadcasts the updated optimizer weights.
+# The optimizer is saved every save_interval epochs instead of after the validation runs of optimize_optimizer.py, the
+# workers build no validation problems.
 
-    second_derivatives = False
+if __name__ == '__main__':
     restore_network = False
-    io_path = None
     save_network = True
-    
-    num_optim_steps_per_epoch = None
-    unroll_len = None
-
-    test_epochs = None
-    learning_rate = None
-    layer_width = None
-    momentum = None
-
     flag_optimizer = 'Mlp'
     model_id = '10'
+    num_workers = multiprocessing.cpu_count()
 
-    # problem = problems.Quadratic(args={'batch_size': batch_size, 'dims': dim, 'stddev': .01, 'dtype': tf.float32})
-    # problem = problems.TwoVars(args={'dims': dim, 'dtype':tf.float32})
-    # problem = problems.ElementwiseSquare(args={'dims': dim, 'dtype':tf.float32})
-    # problem = problems.FitX(args={'dims': 20, 'dtype': tf.float32})
-
-    problem = problems.ElementwiseSquare(args={'minval':-100, 'maxval':100, 'dims':2, 'gog': False, 'path': 'cifar', 'conv': True})
-    eval_loss = problem.loss(problem.variables, 'validation')
-    test_loss = problem.loss(problem.variables, 'test')
-    problem_batches, reset_limits = problems.create_batches_all()
     config_args = config.mlp_norm_history()
-    reset_epoch_ext = 20000 / config_args['unroll_len']
     #########################
-    epochs = int(1000000 / config_args['unroll_len'])
+    epochs = int(1000000 / config_args['unroll_len'] / num_workers)
     epoch_interval = int(500 / config_args['unroll_len'])
-    eval_interval = int( 50000 / config_args['unroll_len'])
-    validation_epochs = int(10000 / config_args['unroll_len'])
+    reset_epoch_ext = int(20000 / config_args['unroll_len'])
+    save_interval = int(50000 / config_args['unroll_len'] / num_workers)
     #########################
 
-    num_unrolls_per_epoch = 1
-    if restore_network:
-        io_path = util.get_model_path(flag_optimizer=flag_optimizer, model_id=model_id) if restore_network else None
-    optim = meta_optimizers.AUGOptims(problem_batches, [], path=io_path, args=config.aug_optim())
-    optim.build()
-
-    optim_grad = tf.gradients(optim.ops_loss, optim.optimizer_variables)
-    optim_grad_norm = [tf.norm(grad) for grad in optim_grad]
-    optim_norm = [tf.norm(variable) for variable in optim.optimizer_variables]
-    # norm_grads = [tf.norm(gradients) for gradients in optim.problems.get_gradients()]
-    problem_norms = []
-    for problem in optim.problems:
-        norm = 0
-        for variable in problem.variables:
-            norm += tf.norm(variable)
-        problem_norms.append(norm)
-    reset_upper_limit = np.array([np.random.uniform(reset_limit[0][0], reset_limit[0][1]) for reset_limit in reset_limits])
-    reset_counter = np.zeros(len(optim.problems))
-    optim_loss_record = np.ones(len(optim.problems)) * np.inf
-    prob_loss_record =  np.ones(len(optim.problems)) * np.inf
-    with tf.Session() as sess:
-        sess.run(tf.global_variables_initializer())
-        tf.train.start_queue_runners(sess)
-        optim.set_session(sess)
-        optim.run_init()
-        l2l.finalize()
-        print('---- Starting Training ----')
-        if restore_network:
-            optim.load(io_path)
-        # print('Init Prob Grad Norm: ', sess.run(norm_grads))
-        print('Optim Norm: ', sess.run(optim_norm))
-        print('Init Optim Grad Norm: ', sess.run(optim_grad_norm))
-        # print 'Init Optim Vars: ', sess.run(mean_optim_variables)
-        total_loss_optim = 0
-        total_loss_prob = 0
-        total_time = 0
-        time = 0
-
-        best_evaluation = float("inf")
-        mean_mats_values_list = list()
-
-        print('---------------------------------\n')
-        for epoch in range(epochs):
-            time, loss_optim, loss_prob = optim.run({'train': True})
-            problem_norms_run = sess.run(problem_norms)
-            total_loss_optim += loss_optim
-            total_loss_prob += loss_prob
-            total_time += time
-            for i, (ops_reset, curr_loss_prob, norm) in enumerate(zip(optim.ops_reset_problem, loss_prob, problem_norms_run)):
-                curr_loss_flatten = np.squeeze(curr_loss_prob)
-                if curr_loss_flatten < 1e-15 or reset_counter[i] >= reset_upper_limit[i] or norm > 1e4:
-                    optim.run_reset(index=i)
-                    if epoch < reset_epoch_ext:
-                        reset_index = 0
-                    else:
-                        reset_index = 1
-                    optim_loss_record[i] = total_loss_optim[i] / reset_counter[i]
-                    prob_loss_record[i] = total_loss_prob[i] / reset_counter[i]
-                    reset_upper_limit[i] = np.random.uniform(reset_limits[i][reset_index][0], reset_limits[i][reset_index][1])
-                    reset_counter[i] = 0
-                else:
-                    reset_counter[i] += 1
-
-            if (epoch + 1) % epoch_interval == 0:
-                indices = np.where(optim_loss_record == np.inf)
-                optim_loss_record[indices] = total_loss_optim[indices] / epoch_interval
-                prob_loss_record[indices] = total_loss_prob[indices] / epoch_interval
-                # print 'Optim Vars: ', sess.run(mean_optim_variables)
-                util.print_update(epoch, epochs, optim_loss_record, np.log10(prob_loss_record), total_time, sess.run(optim_norm), sess.run(optim_grad_norm))
-                print('PROBLEM NORM: ', problem_norms_run)
-                total_loss_optim = 0
-                total_loss_prob = 0
-                total_time = 0
-                mean_mats_values_list = list()
-
-            if (epoch + 1) % eval_interval == 0:
-                potential_nan = False
-                print('--- VALIDATION ---')
-                total_eval_loss = 0
-                total_eval_time = 0
-                for eval_epoch in range(validation_epochs):
-                    time_eval, _, loss_eval = optim.run({'train': False})
-                    total_eval_loss += loss_eval
-                    total_eval_time += time_eval
-                    eval_norms = np.array(sess.run(problem_norms))
-                    check = np.sum(np.where(eval_norms > 1e4))
-                    if check > 0:
-                        potential_nan = True
-                        print('Potential Nan')
-                        break
-                if not potential_nan:
-                    avg_eval_loss = np.log10(total_eval_loss / validation_epochs)
-                    avg_eval_time = total_eval_time / validation_epochs
-                    util.write_update(avg_eval_loss, avg_eval_time)
-                    print('VALIDATION LOSS: ', avg_eval_loss)
-                    print('SAVING NETWORK')
-                    save_path = util.get_model_path(flag_optimizer=flag_optimizer, model_id=str(epoch + 1))
-                    optim.save(save_path)
-                # print('TEST')
-                # loss_test_total = 0
-                # for eval_epoch in range(test_epochs):
-                #     time_test, loss_test = util.run_epoch(sess, test_loss, None, None, num_unrolls_per_epoch)
-                #     loss_test_total += loss_test
-                # loss_test_total = np.log10(loss_test_total / test_epochs)
-                # print('TEST LOSS: ', loss_eval_total)
-
-                # if save_network:# and avg_eval_loss < best_evaluation:
-                #     print('Better Loss Found')
-                #     save_path = util.get_model_path(flag_optimizer=flag_optimizer, model_id=str(epoch + 1))
-                #                                     # preprocess_args=preprocess,
-                #                                     # learning_rate=learning_rate, layer_width=layer_width,
-                #                                     # momentum=momentum, second_derivative=second_derivatives)
-                #     print(save_path)
-                #     optim.save(save_path)
-                #     print('Network Saved')
-                #     best_evaluation = avg_eval_loss
-                # print('---------------------------------------')
-        if save_network:
-            save_path = util.get_model_path(flag_optimizer=flag_optimizer, model_id=str(epochs) + '_FINAL')
-                                            # preprocess_args=preprocess,
-                                            # learning_rate=learning_rate, layer_width=layer_width,
-                                            # momentum=momentum, second_derivative=second_derivatives)
-            print(save_path)
-            optim.save(save_path)
-            print('Final Network Saved')
-        print(flag_optimizer + ' optimized.')
+    io_path = util.get_model_path(flag_optimizer=flag_optimizer, model_id=model_id) if restore_network else None
+    save_path = util.get_model_path(flag_optimizer=flag_optimizer, model_id='multi_pro') if save_network else None
+    print('---- Starting Training on ', num_workers, ' workers ----')
+    server = parallel_trainer.train(config_args, num_workers=num_workers, epochs=epochs, print_interval=epoch_interval,
+                                    save_interval=save_interval if save_network else None, save_path=save_path,
+                                    optimizer_class=meta_optimizers.MlpNormHistory, reset_epoch_ext=reset_epoch_ext,
+                                    restore_path=io_path)
+    if save_network:
+        final_path = util.get_model_path(flag_optimizer=flag_optimizer, model_id=str(epochs) + '_FINAL')
+        print(final_path)
+        server.save(final_path)
+        print('Final Network Saved')
+    print(flag_optimizer + ' optimized.')
@@ -7,6 +7,24 @@ from preprocess import Preprocess
 from timeit import default_timer as timer
 import numpy as np
 
+
+def read_state(state):
+    # optimizer state may be stored in float16 / bfloat16 (state_dtype), it is always computed in float32
+    if not hasattr(state, 'dtype') or state.dtype.base_dtype == tf.float32:
+        return state
+    return tf.cast(state, tf.float32)
+
+
+def store_state(state, dtype):
+    return state if dtype == tf.float32 else tf.cast(state, dtype)
+
+
+def square_state_dtype(dtype):
+    # second moments and squared histories underflow in float16 (below ~6e-8, (1 - beta_2) * g^2 at mnist gradient
+    # scale) and would be reset to 0 every step, they stay float32. bfloat16 has the exponent range of float32.
+    return tf.float32 if dtype == tf.float16 else dtype
+
+
 class Optimizer():
 
     __metaclass__ = ABCMeta
@@ -31,7 +49,7 @@ class Optimizer():
 
     def loss(self, variables=None):
         variables = self.problem.variables if variables is None else variables
-        return self.problem.loss(variables)
+        return self.problem.get_loss(variables)
 
     def step(self, args=None):
         pass
@@ -57,8 +75,12 @@ class Adam(Optimizer):
     optim_params = None
     learn_betas = None
     decay_learning_rate = None
+    state_dtype = None
+    sq_state_dtype = None
     def __init__(self, problem, args=None):
         super(Adam, self).__init__(problem, args)
+        self.state_dtype = tf.as_dtype(args['state_dtype'] if 'state_dtype' in args else 'float32')
+        self.sq_state_dtype = square_state_dtype(self.state_dtype)
         self.learn_betas = args['learn_betas'] if 'learn_betas' in args else False
         self.decay_learning_rate = False#args['decay_learning_rate']
         if self.decay_learning_rate:
@@ -78,8 +100,8 @@ class Adam(Optimizer):
         self.eps = args['eps']
         self.eps_squared = tf.square(self.eps)
         self.t = tf.Variable(1.0)
-        self.ms = [tf.Variable(tf.zeros([shape, 1])) for shape in self.problem.variables_flattened_shape]
-        self.vs = [tf.Variable(tf.zeros([shape, 1])) for shape in self.problem.variables_flattened_shape]
+        self.ms = [tf.Variable(tf.zeros([shape, 1], dtype=self.state_dtype)) for shape in self.problem.variables_flattened_shape]
+        self.vs = [tf.Variable(tf.zeros([shape, 1], dtype=self.sq_state_dtype)) for shape in self.problem.variables_flattened_shape]
         self.optim_params = [self.ms, self.vs]
         if self.decay_learning_rate:
             self.optim_params.append(self.lr)
@@ -119,11 +141,11 @@ class Adam(Optimizer):
 
         for var, var_flat, gradient, var_m, var_v, beta_1, beta_2 in zip(problem_variables, problem_variables_flat, problem_gradients,
                                                                           problem_ms, problem_vs, betas_1, betas_2):
-            m = beta_1 * var_m + (1.0 - beta_1) * gradient
-            v = beta_2 * var_v + (1.0 - beta_2) * tf.square(gradient)
+            m = beta_1 * read_state(var_m) + (1.0 - beta_1) * gradient
+            v = beta_2 * read_state(var_v) + (1.0 - beta_2) * tf.square(gradient)
             # v = tf.maximum(beta_2 * var_v, tf.abs(gradient))
-            ms_next.append(m)
-            vs_next.append(v)
+            ms_next.append(store_state(m, self.state_dtype))
+            vs_next.append(store_state(v, self.sq_state_dtype))
             m_hat = m / (1 - tf.pow(beta_1, self.t))
             v_hat = v / (1 - tf.pow(beta_2, self.t))
             var_step = -lr * m_hat / (tf.sqrt(v_hat + self.eps_squared))
@@ -167,9 +189,85 @@ class Adam(Optimizer):
 
     def build(self, args=None):
         self.ops_step = self.step(args)
-        self.ops_loss = self.problem.loss(self.ops_step['vars_next'])
+        self.ops_loss = self.problem.get_loss(self.ops_step['vars_next'])
         self.ops_updates = self.updates(self.ops_step)
 
+class MultiScaleAdam(Optimizer):
+
+    # N Adams with different betas in one optimizer, the moments of all timescales live in one [P, N] tensor
+    # per variable and are updated with broadcast betas, steps come out as the [P, N] matrix directly
+    ms = None
+    vs = None
+    beta_1 = None
+    beta_2 = None
+    num_scales = None
+    t = None
+    lr = None
+    eps = None
+    optim_params = None
+    state_dtype = None
+    sq_state_dtype = None
+
+    def __init__(self, problem, args=None):
+        super(MultiScaleAdam, self).__init__(problem, args)
+        self.state_dtype = tf.as_dtype(args['state_dtype'] if 'state_dtype' in args else 'float32')
+        self.sq_state_dtype = square_state_dtype(self.state_dtype)
+        self.num_scales = len(args['beta_1'])
+        self.beta_1 = tf.constant(args['beta_1'], shape=[1, self.num_scales], dtype=tf.float32)
+        self.beta_2 = tf.constant(args['beta_2'], shape=[1, self.num_scales], dtype=tf.float32)
+        self.lr = tf.Variable(args['lr'], dtype=tf.float32)
+        self.eps = args['eps']
+        self.eps_squared = tf.square(self.eps)
+        self.t = tf.Variable(1.0)
+        self.ms = [tf.Variable(tf.zeros([shape, self.num_scales], dtype=self.state_dtype))
+                   for shape in self.problem.variables_flattened_shape]
+        self.vs = [tf.Variable(tf.zeros([shape, self.num_scales], dtype=self.sq_state_dtype))
+                   for shape in self.problem.variables_flattened_shape]
+        self.optim_params = [self.ms, self.vs]
+
+    def set_variable(self, variable_key, args, default):
+        if args is not None and variable_key in args and args[variable_key] is not None:
+            return args[variable_key]
+        else:
+            return default
+
+    def step(self, args=None):
+        vars_steps = []
+        ms_next = []
+        vs_next = []
+        problem_variables = self.set_variable('variables', args, self.problem.variables)
+        problem_variables_flat = self.set_variable('variables_flat', args, self.problem.variables_flat)
+        if args is not None and 'gradients' in args:
+            problem_gradients = args['gradients']
+        else:
+            problem_gradients = self.get_gradients(self.problem.variables)
+        optim_params = self.set_variable('optim_params', args, self.optim_params)
+        bias_correction_1 = 1 - tf.pow(self.beta_1, self.t)
+        bias_correction_2 = 1 - tf.pow(self.beta_2, self.t)
+
+        for gradient, var_m, var_v in zip(problem_gradients, optim_params[0], optim_params[1]):
+            m = self.beta_1 * read_state(var_m) + (1.0 - self.beta_1) * gradient
+            v = self.beta_2 * read_state(var_v) + (1.0 - self.beta_2) * tf.square(gradient)
+            ms_next.append(store_state(m, self.state_dtype))
+            vs_next.append(store_state(v, self.sq_state_dtype))
+            var_step = -self.lr * (m / bias_correction_1) / tf.sqrt(v / bias_correction_2 + self.eps_squared)
+            vars_steps.append(var_step)
+
+        # the point every single timescale would move to, only evaluated if some loss asks for it
+        vars_next = [[self.problem.set_shape(var_flat + tf.slice(var_step, [0, scale], [-1, 1]), like_variable=var,
+                                             op_name='reshape_variable')
+                      for var, var_flat, var_step in zip(problem_variables, problem_variables_flat, vars_steps)]
+                     for scale in range(self.num_scales)]
+        return {'vars_next': vars_next, 'vars_steps': vars_steps, 'optim_params_next': [ms_next, vs_next]}
+
+    def updates(self, args=None):
+        ms_next = args['optim_params_next'][0]
+        vs_next = args['optim_params_next'][1]
+        updates_list = [tf.assign(m, m_next) for m, m_next in zip(self.ms, ms_next)]
+        updates_list.extend([tf.assign(v, v_next) for v, v_next in zip(self.vs, vs_next)])
+        updates_list.append(tf.assign_add(self.t, 1.0))
+        return updates_list
+
 class XHistoryGradNorm(Optimizer):
 
 
@@ -0,0 +1,198 @@
+from __future__ import print_function
+import multiprocessing
+from six.moves import queue
+import tensorflow as tf
+import numpy as np
+from timeit import default_timer as timer
+import problems
+import meta_optimizers
+
+
+# Local data parallel meta training. Every worker process builds its own graph with a subset of the problems of
+# create_batches_all, runs the problem steps and computes the meta gradients of the shared optimizer variables.
+# The coordinator (an in process parameter server) averages the gradients, applies the meta optimizer
+# and broadcasts the new weights back before the next step. A worker that dies (OOM kill, segfault, exception) stops
+# the training with an error instead of leaving the coordinator waiting for its results.
+
+
+def worker_problems(worker_id, num_workers):
+    problem_batches, reset_limits = problems.create_batches_all()
+    # with fewer problems than workers, workers train on their own copies of the problems
+    indices = [index % len(problem_batches) for index in
+               range(worker_id, max(num_workers, len(problem_batches)), num_workers)]
+    return [problem_batches[index] for index in indices], [reset_limits[index] for index in indices]
+
+
+def worker(worker_id, num_workers, optimizer_class, config_args, reset_epoch_ext, weights_queue, results_queue):
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.set_random_seed(worker_id)
+        np.random.seed(worker_id)
+        problem_batches, reset_limits = worker_problems(worker_id, num_workers)
+        optim = optimizer_class(problem_batches, [], args=config_args)
+        optim.build()
+        meta_loss = tf.reduce_mean(tf.stack([tf.reshape(loss, []) for loss in optim.ops_loss_train]))
+        meta_gradients = [tf.zeros_like(variable) if gradient is None else tf.convert_to_tensor(gradient)
+                          for variable, gradient in zip(optim.optimizer_variables,
+                                                        tf.gradients(meta_loss, optim.optimizer_variables))]
+        weight_inputs = [tf.placeholder(variable.dtype, variable.get_shape()) for variable in optim.optimizer_variables]
+        set_weights = [tf.assign(variable, weight_input) for variable, weight_input in
+                       zip(optim.optimizer_variables, weight_inputs)]
+        problem_norms = [tf.add_n([tf.norm(variable) for variable in problem.variables]) for problem in problem_batches]
+
+        reset_upper_limit = np.array([np.random.uniform(reset_limit[0][0], reset_limit[0][1]) for reset_limit in reset_limits])
+        reset_counter = np.zeros(len(problem_batches))
+        session_config = tf.ConfigProto(intra_op_parallelism_threads=1, inter_op_parallelism_threads=1)
+        with tf.Session(config=session_config) as sess:
+            sess.run(tf.global_variables_initializer())
+            tf.train.start_queue_runners(sess)
+            optim.set_session(sess)
+            optim.run_init()
+            graph.finalize()
+            results_queue.put((worker_id, len(problem_batches), sess.run(optim.optimizer_variables),
+                               [variable.op.name for variable in optim.optimizer_variables], None))
+            weights = weights_queue.get()
+            epoch = 0
+            while weights is not None:
+                sess.run(set_weights, feed_dict=dict(zip(weight_inputs, weights)))
+                start = timer()
+                gradients, loss_optim, loss_prob, norms, _ = sess.run([meta_gradients, optim.ops_loss_train,
+                                                                       optim.ops_loss_problem_train, problem_norms,
+                                                                       optim.ops_updates_train])
+                time = timer() - start
+                for i, (curr_loss_prob, norm) in enumerate(zip(loss_prob, norms)):
+                    if np.squeeze(curr_loss_prob) < 1e-15 or reset_counter[i] >= reset_upper_limit[i] or norm > 1e4:
+                        # only problem i restarts, the others continue their episodes
+                        optim.run_reset(index=i)
+                        reset_index = 0 if epoch < reset_epoch_ext else 1
+                        reset_upper_limit[i] = np.random.uniform(reset_limits[i][reset_index][0],
+                                                                 reset_limits[i][reset_index][1])
+                        reset_counter[i] = 0
+                    else:
+                        reset_counter[i] += 1
+                results_queue.put((worker_id, len(problem_batches), gradients,
+                                   [np.mean(loss_optim), np.mean(loss_prob)], time))
+                epoch += 1
+                weights = weights_queue.get()
+
+
+class ParameterServer():
+
+    session = None
+    weights = None
+    gradient_inputs = None
+    ops_apply = None
+    io_handle = None
+
+    def __init__(self, initial_weights, names, config_args):
+        graph = tf.Graph()
+        with graph.as_default():
+            self.weights = [tf.Variable(weight, name='optimizer_weight_' + str(i)) for i, weight in enumerate(initial_weights)]
+            self.gradient_inputs = [tf.placeholder(weight.dtype, weight.get_shape()) for weight in self.weights]
+            global_step = tf.Variable(0, trainable=False)
+            if config_args['decay_meta_learning_rate']:
+                learning_rate = tf.train.polynomial_decay(learning_rate=config_args['starter_learning_rate'],
+                                                          global_step=global_step,
+                                                          decay_steps=config_args['decay_steps'],
+                                                          end_learning_rate=config_args['end_learning_rate'],
+                                                          power=config_args['power'])
+            else:
+                learning_rate = config_args['meta_learning_rate']
+            optimizer = tf.train.AdamOptimizer if config_args['Adam'] else tf.train.RMSPropOptimizer
+            self.ops_apply = optimizer(learning_rate, name='meta_optimizer_optimizer').apply_gradients(
+                zip(self.gradient_inputs, self.weights), global_step=global_step)
+            # checkpoints use the names of the worker graphs, Meta_Optimizer.load restores them directly
+            self.io_handle = tf.train.Saver(dict(zip(names, self.weights)), max_to_keep=100)
+            self.session = tf.Session()
+            self.session.run(tf.global_variables_initializer())
+            graph.finalize()
+
+    def apply(self, gradients):
+        self.session.run(self.ops_apply, feed_dict=dict(zip(self.gradient_inputs, gradients)))
+        return self.session.run(self.weights)
+
+    def load(self, path):
+        self.io_handle.restore(self.session, path)
+        print('Optimizer Restored')
+
+    def save(self, path):
+        print('Saving optimizer')
+        self.io_handle.save(self.session, path)
+
+
+def worker_results(workers, results_queue, poll_interval=5.0):
+    # one result of every worker, raises if a worker exits before it put its result
+    results = []
+    while len(results) < len(workers):
+        try:
+            results.append(results_queue.get(timeout=poll_interval))
+            continue
+        except queue.Empty:
+            pass
+        dead = [worker_id for worker_id, process in enumerate(workers) if not process.is_alive()]
+        if dead:
+            # the results may have been put right before the workers exited
+            try:
+                while len(results) < len(workers):
+                    results.append(results_queue.get(timeout=poll_interval))
+            except queue.Empty:
+                for process in workers:
+                    process.terminate()
+                raise RuntimeError('worker(s) ' + str(dead) + ' exited with code(s) ' +
+                                   str([workers[worker_id].exitcode for worker_id in dead]))
+    return results
+
+
+def train(config_args, num_workers=None, epochs=1000, print_interval=100, save_interval=None, save_path=None,
+          optimizer_class=meta_optimizers.MlpNormHistory, reset_epoch_ext=0, restore_path=None):
+    # reset_epoch_ext: the problems restart after episodes drawn from the first reset limits of create_batches_all
+    # before this epoch, from the second ones afterwards. restore_path: checkpoint of ParameterServer.save or
+    # Meta_Optimizer.save the training continues from.
+    num_workers = multiprocessing.cpu_count() if num_workers is None else num_workers
+    results_queue = multiprocessing.Queue()
+    weights_queues = [multiprocessing.Queue() for worker_id in range(num_workers)]
+    workers = [multiprocessing.Process(target=worker, args=(worker_id, num_workers, optimizer_class, config_args,
+                                                            reset_epoch_ext, weights_queues[worker_id], results_queue))
+               for worker_id in range(num_workers)]
+    for process in workers:
+        process.daemon = True
+        process.start()
+
+    initial = worker_results(workers, results_queue)
+    first_worker = min(initial, key=lambda result: result[0])
+    server = ParameterServer(first_worker[2], first_worker[3], config_args)
+    if restore_path is not None:
+        server.load(restore_path)
+    weights = server.session.run(server.weights)
+    total_loss_optim, total_loss_prob, total_time = 0, 0, 0
+    start = timer()
+    for epoch in range(epochs):
+        for weights_queue in weights_queues:
+            weights_queue.put(weights)
+        results = worker_results(workers, results_queue)
+        # every worker averaged the meta loss over its problems, weight the workers by their problem count
+        problem_counts = np.array([result[1] for result in results], dtype=np.float32)
+        mean_gradients = [np.sum([result[2][i] * count for result, count in zip(results, problem_counts)], axis=0) /
+                          np.sum(problem_counts) for i in range(len(weights))]
+        weights = server.apply(mean_gradients)
+        total_loss_optim += np.mean([result[3][0] for result in results])
+        total_loss_prob += np.mean([result[3][1] for result in results])
+        total_time += np.max([result[4] for result in results])
+
+        if (epoch + 1) % print_interval == 0:
+            print('Epoch/Total Epocs: ', epoch + 1, '/', epochs)
+            print('Mean O Log Loss: ', total_loss_optim / print_interval)
+            print('Mean P Log Loss', np.log10(total_loss_prob / print_interval))
+            print('Mean Worker Step Time: ', total_time / print_interval)
+            print('Steps / Sec: ', print_interval / (timer() - start))
+            print('--------------------------------------------------------------------\n')
+            total_loss_optim, total_loss_prob, total_time = 0, 0, 0
+            start = timer()
+        if save_interval is not None and (epoch + 1) % save_interval == 0:
+            server.save(save_path + '_' + str(epoch + 1))
+
+    for weights_queue in weights_queues:
+        weights_queue.put(None)
+    for process in workers:
+        process.join()
+    return server
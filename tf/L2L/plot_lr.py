@@ -1,5 +1,7 @@
 import matplotlib.pyplot as plt
 import numpy as np
+import os
+import metrics
 
 decay_steps = 50000
 learning_rate = 0.0003
@@ -14,6 +16,11 @@ for global_step in range(decay_steps):
 
 learrning_rates = np.array(learrning_rates)
 plt.plot(range(decay_steps), learrning_rates)
+# the meta learning rate logged by optimize_optimizer.py, [epoch, lr] rows
+logged_path = metrics.series_path('metrics', 'meta_lr')
+if os.path.exists(logged_path):
+    logged_learning_rates = metrics.read_series(logged_path)
+    plt.plot(logged_learning_rates[:, 0], logged_learning_rates[:, 1])
 plt.show()
 
 # -decay_steps = 50000
@@ -4,11 +4,124 @@ from __future__ import print_function
 
 from abc import ABCMeta
 import tensorflow as tf
+from tensorflow.python.framework import function
 import numpy as np
-from tensorflow.contrib.learn.python.learn.datasets import mnist as mnist_dataset
-import os, tarfile
+import os, errno, threading, tempfile
 import six.moves
-from six.moves import urllib, xrange
+from six.moves import xrange, queue
+
+mnist_cache_path = os.path.join('MNIST-data', 'cache')
+mnist_cache = {}
+
+
+def make_dirs(path):
+    # python 2 has no exist_ok, another process may create the directory between the check and makedirs
+    if not os.path.exists(path):
+        try:
+            os.makedirs(path)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+
+
+def save_array(path, array):
+    # several processes may build the same cache at once (parallel_trainer workers), every array is written to a
+    # temporary file next to it and renamed into place, a reader never maps a partially written file
+    handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.npy')
+    with os.fdopen(handle, 'wb') as temp_file:
+        np.save(temp_file, array)
+    os.rename(temp_path, path)
+
+
+# Mnist is decoded to .npy once, every problem instance (and worker process) shares the splits as read only memory maps
+def mnist_arrays(mode):
+    if not mnist_cache:
+        modes = ['train', 'test', 'validation']
+        file_name = lambda split, key: os.path.join(mnist_cache_path, split + '_' + key + '.npy')
+        if not all([os.path.exists(file_name(split, 'labels')) for split in modes]):
+            # contrib.learn is slow to import, only needed the first time the dataset is decoded
+            from tensorflow.contrib.learn.python.learn.datasets import mnist as mnist_dataset
+            data = mnist_dataset.load_mnist()
+            make_dirs(mnist_cache_path)
+            # the labels are the existence check, they are written last
+            for split in modes:
+                save_array(file_name(split, 'images'), getattr(data, split).images.astype(np.float32))
+            for split in modes:
+                save_array(file_name(split, 'labels'), getattr(data, split).labels.astype(np.int64))
+        for split in modes:
+            mnist_cache[split] = {'images': np.load(file_name(split, 'images'), mmap_mode='r'),
+                                  'labels': np.load(file_name(split, 'labels'), mmap_mode='r')}
+    return mnist_cache[mode]
+
+
+cifar10_cache = {}
+
+
+# the binary records are decoded once into uint8 .npy files, [N, 32, 32, 3] images and their labels,
+# every cifar10 instance then memory maps them instead of reading records through queue runners
+def cifar10_arrays(path, mode):
+    if path not in cifar10_cache:
+        cache_path = os.path.join(path, 'cache')
+        files = {'train': ['data_batch_{}.bin'.format(i) for i in xrange(1, 6)], 'test': ['test_batch.bin']}
+        file_name = lambda split, key: os.path.join(cache_path, split + '_' + key + '.npy')
+        if not all([os.path.exists(file_name(split, 'labels')) for split in files]):
+            make_dirs(cache_path)
+            for split, split_files in files.items():
+                split_files = [os.path.join(path, f) for f in split_files]
+                for f in split_files:
+                    if not os.path.exists(f):
+                        raise ValueError('Failed to find file: ' + f)
+                # every record is the label byte followed by the depth major image
+                records = np.concatenate([np.fromfile(f, dtype=np.uint8).reshape([-1, 1 + 32 * 32 * 3])
+                                          for f in split_files])
+                images = records[:, 1:].reshape([-1, 3, 32, 32]).transpose([0, 2, 3, 1])
+                # the labels are the existence check, they are written after the images
+                save_array(file_name(split, 'images'), np.ascontiguousarray(images))
+                save_array(file_name(split, 'labels'), records[:, 0].astype(np.int32))
+        cifar10_cache[path] = {split: {'images': np.load(file_name(split, 'images'), mmap_mode='r'),
+                                       'labels': np.load(file_name(split, 'labels'), mmap_mode='r')}
+                               for split in files}
+    return cifar10_cache[path][mode]
+
+
+class BatchPrefetcher():
+
+    # Produces processed minibatches of a memory mapped dataset on a background thread, the graph pulls them
+    # through a stateful py_func. process maps the gathered uint8 images to the float32 network input.
+
+    data = None
+    batch_size = None
+    shuffle = None
+    process = None
+    position = None
+    batches = None
+    thread = None
+
+    def __init__(self, data, batch_size, process, shuffle=True, prefetch=8):
+        self.data = data
+        self.batch_size = batch_size
+        self.process = process
+        self.shuffle = shuffle
+        self.position = 0
+        self.batches = queue.Queue(maxsize=prefetch)
+        self.thread = threading.Thread(target=self.produce)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def produce(self):
+        examples = self.data['labels'].shape[0]
+        while True:
+            if self.shuffle:
+                # sorted indices read the memory map front to back
+                indices = np.sort(np.random.randint(0, examples, self.batch_size))
+            else:
+                indices = np.arange(self.position, self.position + self.batch_size) % examples
+                self.position = (self.position + self.batch_size) % examples
+            self.batches.put((self.process(self.data['images'][indices]), self.data['labels'][indices]))
+
+    def next_batch(self):
+        return self.batches.get()
+
 
 def create_batches(problem, batches=5, dims=5, args={}):
     batch_list = []
@@ -56,7 +169,7 @@ def create_batches_all(train=True):
         # batches.append(FitX({'prefix': FitX.__name__ + '_0_', 'dims': 10, 'minval': -100.0, 'maxval': 100.0}))
         # reset_limit.append([[50, 200], [100, 500]])
 
-         batches.append(Mnist({'minval': -100.0, 'maxval': 100.0}))
+         batches.append(Mnist({'minval': -100.0, 'maxval': 100.0, 'full': False}))
          reset_limit.append([[50, 200], [200, 10000]])
     else:
         batches.append(
@@ -96,16 +209,21 @@ class Problem():
     var_count = None
     init = None
     io_handle = None
+    evaluation_cache = None
+    replicas = None
 
     def __init__(self, args={}):
         self.allow_gradients_of_gradients = args['gog'] if 'gog' in args else True
         self.dims = args['dims'] if 'dims' in args else 1
         self.dtype = args['dtype'] if 'dtype' in args else tf.float32
         self.meta = args['meta'] if 'meta' in args else True
+        # independent copies of the problem stacked along the leading axis of every variable, see replica_losses
+        self.replicas = args['replicas'] if 'replicas' in args else 1
         self.variables = []
         self.variables_flat = []
         self.constants = []
         self.variables_flattened_shape = []
+        self.evaluation_cache = {}
         self.var_count = args['var_count']
         self.problem_prefix = '' if 'prefix' not in args else args['prefix']
         self.init = args['init'] if 'init' in args else [tf.random_uniform_initializer(minval=args['minval'], maxval=args['maxval'])
@@ -151,12 +269,39 @@ class Problem():
         shape = self.variables[i].get_shape() if i is not None else like_variable.get_shape()
         return tf.reshape(input, shape=shape, name=op_name)
 
+    def pack(self, variables):
+        return tf.concat([tf.reshape(variable, [-1, 1]) for variable in variables], 0, name='packed_variables')
+
+    def unpack(self, packed):
+        flat_variables = tf.split(packed, [int(shape) for shape in self.variables_flattened_shape], 0)
+        return [self.set_shape(flat_variable, i=i, op_name='unpacked_variable') for i, flat_variable in enumerate(flat_variables)]
+
+    def evaluation(self, variables=None, mode='train'):
+        # one forward pass (and data batch) per variable tensors, shared by every loss / gradient request.
+        # keyed by the control flow context as well, tensors of a while loop body can not be used outside of it.
+        variables = self.variables if variables is None else variables
+        context = tf.get_default_graph()._get_control_flow_context()
+        key = (tuple(variables), mode, context)
+        if key not in self.evaluation_cache:
+            self.evaluation_cache[key] = {'loss': self.loss(variables, mode)}
+        return self.evaluation_cache[key]
+
+    def get_loss(self, variables=None, mode='train'):
+        return self.evaluation(variables, mode)['loss']
+
     def get_gradients_raw(self, variables=None):
         variables = self.variables if variables is None else variables
-        gradients = tf.gradients(self.loss(variables), variables)
-        # if not self.allow_gradients_of_gradients:
-        #     gradients = [tf.stop_gradient(gradient) for gradient in gradients]
-        return gradients
+        evaluation = self.evaluation(variables)
+        if 'gradients' not in evaluation:
+            # own scope, profiling.StepProfiler tells them from the meta gradients by it
+            with tf.name_scope('Problem_Gradients'):
+                evaluation['gradients'] = tf.gradients(evaluation['loss'], variables)
+        if not self.allow_gradients_of_gradients:
+            # first order meta gradients, the problem gradients are constants of the meta backward pass
+            if 'gradients_stopped' not in evaluation:
+                evaluation['gradients_stopped'] = [tf.stop_gradient(gradient) for gradient in evaluation['gradients']]
+            return evaluation['gradients_stopped']
+        return evaluation['gradients']
 
     def get_gradients(self, variables=None):
         variables = variables if variables is not None else self.variables
@@ -174,6 +319,17 @@ class Problem():
     def accuracy(self, mode='train'):
         return []
 
+    def replica_losses(self, variables, mode='train'):
+        # [replicas] losses, loss() is their sum so the gradients of each replica stay independent
+        return tf.reshape(self.loss(variables, mode), [1])
+
+    def replica_norms(self, variables):
+        return tf.reshape(tf.add_n([tf.norm(variable) for variable in variables]), [1])
+
+    def advance_batch(self, mode='train'):
+        # problems without data have no minibatch to move on from
+        return tf.no_op(name='advance_batch_' + mode)
+
 
 class ElementwiseSquare(Problem):
 
@@ -207,11 +363,17 @@ class Rosenbrock(Problem):
         args['var_count'] = 2
         super(Rosenbrock, self).__init__(args=args)
         with tf.variable_scope(self.variable_scope):
-            self.x = self.create_variable('x', initializer=self.init[0], dims=[1, 1])
-            self.y = self.create_variable('y', initializer=self.init[1], dims=[1, 1])
+            self.x = self.create_variable('x', initializer=self.init[0], dims=[self.replicas, 1])
+            self.y = self.create_variable('y', initializer=self.init[1], dims=[self.replicas, 1])
 
     def loss(self, variables, mode='train'):
-        return tf.squeeze(tf.square(1.0 - variables[0]) + 100 * tf.square(variables[1] - tf.square(variables[0])))
+        return tf.reduce_sum(self.replica_losses(variables, mode))
+
+    def replica_losses(self, variables, mode='train'):
+        return tf.reshape(tf.square(1.0 - variables[0]) + 100 * tf.square(variables[1] - tf.square(variables[0])), [self.replicas])
+
+    def replica_norms(self, variables):
+        return tf.reshape(tf.abs(variables[0]) + tf.abs(variables[1]), [self.replicas])
 
 
 class RosenbrockMulti(Problem):
@@ -308,6 +470,8 @@ class Quadratic(Problem):
 class Mnist(Problem):
 
     training_data, test_data, validation_data = None, None, None
+    batch_indices = None
+    batch_cache = None
     conv = False
     enable_l2_norm = False
     weight_norm_loss = None
@@ -335,23 +499,21 @@ class Mnist(Problem):
         self.full = args['full']
         super(Mnist, self).__init__(args=args)
         self.conv = False if 'conv' not in args else args['conv']
-
-        def get_data(data, mode='train'):
-            mode_data = getattr(data, mode)
-            images = tf.constant(mode_data.images, dtype=tf.float32, name="MNIST_images_" + mode)
-            if self.conv:
-                images = tf.reshape(images, [-1, 28, 28, 1])
-            if self.allow_gradients_of_gradients:
-                labels = tf.one_hot(mode_data.labels, 10, name="MNIST_labels_" + mode)
-            else:
-                labels = tf.constant(mode_data.labels, dtype=tf.int64, name="MNIST_labels_" + mode)
-            return images, labels
-
-        data = mnist_dataset.load_mnist()
-        self.training_data, self.test_data, self.validation_data = dict(), dict(), dict()
-        self.training_data['images'], self.training_data['labels'] = get_data(data, 'train')
-        self.test_data['images'], self.test_data['labels'] = get_data(data, 'test')
-        self.validation_data['images'], self.validation_data['labels'] = get_data(data, 'validation')
+        if self.conv and self.replicas > 1:
+            raise ValueError('Replicas are only supported by the fully connected Mnist network')
+
+        # shared with every other Mnist instance of the process, nothing of the dataset is baked into the graph
+        self.training_data = mnist_arrays('train')
+        self.test_data = mnist_arrays('test')
+        self.validation_data = mnist_arrays('validation')
+        # the examples of the current step, every loss, gradient and accuracy of a step reads the same minibatch
+        # until advance_batch moves it on
+        self.batch_cache = dict()
+        self.batch_indices = dict()
+        with tf.variable_scope(self.constant_scope):
+            for mode in ['train', 'validation', 'test']:
+                self.batch_indices[mode] = tf.Variable(self.sample_indices(mode), trainable=False,
+                                                       name='batch_indices_' + mode)
         with tf.variable_scope(self.variable_scope):
             with tf.variable_scope('network_variables'):
                 if self.conv:
@@ -377,8 +539,11 @@ class Mnist(Problem):
                         f1 = 40
                     else:
                         f1 = 20
-                    self.create_variable('w_1', dims=[self.training_data['images'].get_shape()[1].value, f1])
-                    self.create_variable('b_1', dims=[1, f1])
+                    # with replicas every layer becomes a batch of [replicas, in, out] weights, tf.matmul then
+                    # multiplies the [replicas, batch, in] inputs of each replica with its own weights
+                    replica_dims = [] if self.replicas == 1 else [self.replicas]
+                    self.create_variable('w_1', dims=replica_dims + [self.training_data['images'].shape[1], f1])
+                    self.create_variable('b_1', dims=replica_dims + [1, f1])
 
                     # self.create_variable('w_2', dims=[20, 20])
                     # self.create_variable('b_2', dims=[20])
@@ -386,8 +551,8 @@ class Mnist(Problem):
                     # self.create_variable('w_3', dims=[20, 20])
                     # self.create_variable('b_3', dims=[20])
 
-                    self.create_variable('w_out', dims=[f1, 10])
-                    self.create_variable('b_out', dims=[1, 10])
+                    self.create_variable('w_out', dims=replica_dims + [f1, 10])
+                    self.create_variable('b_out', dims=replica_dims + [1, 10])
                 self.weight_norm_loss = 0
                 for variable in self.variables:
                     self.weight_norm_loss += tf.nn.l2_loss(variable)
@@ -397,7 +562,7 @@ class Mnist(Problem):
     def accuracy(self, mode='train'):
         batch_images, batch_labels = self.get_batch(mode)
         output = self.network(batch_images, self.variables)
-        correct_prediction = tf.equal(tf.argmax(output, 1), tf.argmax(batch_labels, 1))
+        correct_prediction = tf.equal(tf.argmax(output, -1), tf.argmax(batch_labels, -1))
         correct_prediction = tf.cast(correct_prediction, tf.float32)
         return tf.reduce_mean(correct_prediction)
 
@@ -406,7 +571,7 @@ class Mnist(Problem):
             loss = tf.nn.softmax_cross_entropy_with_logits(logits=output, labels=labels)
         else:
             loss = tf.nn.sparse_softmax_cross_entropy_with_logits(logits=output, labels=labels)
-        return tf.reduce_mean(loss)
+        return tf.reduce_mean(loss, axis=-1)
 
     def network(self, batch, variables):
         if self.conv:
@@ -425,7 +590,7 @@ class Mnist(Problem):
             layer_out = tf.add(tf.matmul(layer_1, variables[2]), variables[3])
             return layer_out
 
-    def get_batch(self, mode='train'):
+    def get_data_holder(self, mode='train'):
         data_holder = None
         if mode == 'train':
             data_holder = self.training_data
@@ -433,15 +598,55 @@ class Mnist(Problem):
             data_holder = self.validation_data
         elif mode == 'test':
             data_holder = self.test_data
-        indices = tf.random_uniform([128], 0, data_holder['images'].get_shape()[0].value, tf.int64)
-        batch_images = tf.gather(data_holder['images'], indices)
-        batch_labels = tf.gather(data_holder['labels'], indices)
-        return batch_images, batch_labels
+        return data_holder
+
+    def sample_indices(self, mode='train'):
+        # every replica draws its own batch
+        return tf.random_uniform([128] if self.replicas == 1 else [self.replicas, 128], 0,
+                                 self.get_data_holder(mode)['images'].shape[0], tf.int64)
+
+    def advance_batch(self, mode='train'):
+        return tf.assign(self.batch_indices[mode], self.sample_indices(mode), name='advance_batch_' + mode)
+
+    def get_batch(self, mode='train'):
+        # one gather per step and control flow context, inside while loops (multi step unrolls) every iteration
+        # is a step of its own and draws its own indices
+        graph = tf.get_default_graph()
+        if isinstance(graph, function._FuncGraph):
+            # checkpointed unroll segment, the batch is drawn where the segment is called and passed in. the steps of
+            # a segment share it and its recomputation during backprop sees the same batch.
+            with graph._outer_graph.as_default():
+                return self.get_batch(mode)
+        context = graph._get_control_flow_context()
+        key = (mode, context)
+        if key in self.batch_cache:
+            return self.batch_cache[key]
+        in_loop = context is not None and context.GetWhileContext() is not None
+        indices = self.sample_indices(mode) if in_loop else self.batch_indices[mode]
+        images, labels = self.get_data_holder(mode)['images'], self.get_data_holder(mode)['labels']
+        batch_images, batch_labels = tf.py_func(lambda batch_indices: [images[batch_indices], labels[batch_indices]],
+                                                [indices], [tf.float32, tf.int64], stateful=False,
+                                                name='MNIST_batch_' + mode)
+        batch_images.set_shape(indices.get_shape().concatenate([images.shape[1]]))
+        batch_labels.set_shape(indices.get_shape())
+        if self.conv:
+            batch_images = tf.reshape(batch_images, [-1, 28, 28, 1])
+        if self.allow_gradients_of_gradients:
+            batch_labels = tf.one_hot(batch_labels, 10)
+        self.batch_cache[key] = (batch_images, batch_labels)
+        return self.batch_cache[key]
     
     def loss(self, variables, mode='train'):
+        return tf.reduce_sum(self.replica_losses(variables, mode)) + (.01 * self.weight_norm_loss if self.enable_l2_norm else 0.0)
+
+    def replica_losses(self, variables, mode='train'):
         batch_images, batch_labels = self.get_batch(mode)
         output = self.network(batch_images, variables)
-        return self.__xent_loss(output, batch_labels) + (.01 * self.weight_norm_loss if self.enable_l2_norm else 0.0)
+        return tf.reshape(self.__xent_loss(output, batch_labels), [self.replicas])
+
+    def replica_norms(self, variables):
+        return tf.add_n([tf.sqrt(tf.reduce_sum(tf.square(tf.reshape(variable, [self.replicas, -1])), axis=1))
+                         for variable in variables])
 
 
 class cifar10_old(Problem):
@@ -456,6 +661,8 @@ class cifar10_old(Problem):
                 os.makedirs(path)
             filepath = os.path.join(path, CIFAR10_FILE)
             if not os.path.exists(filepath):
+                import tarfile
+                from six.moves import urllib
                 print("Downloading CIFAR10 dataset to {}".format(filepath))
                 url = os.path.join(CIFAR10_URL, CIFAR10_FILE)
                 filepath, _ = urllib.request.urlretrieve(url, filepath)
@@ -562,162 +769,42 @@ class cifar10(Problem):
     NUM_EXAMPLES_PER_EPOCH_FOR_TRAIN = 50000
     NUM_EXAMPLES_PER_EPOCH_FOR_EVAL = 10000
 
-    def read_cifar10(self, filename_queue):
-        """Reads and parses examples from CIFAR10 data files.
-        Recommendation: if you want N-way read parallelism, call this function
-        N times.  This will give you N independent Readers reading different
-        files & positions within those files, which will give better mixing of
-        examples.
-        Args:
-          filename_queue: A queue of strings with the filenames to read from.
-        Returns:
-          An object representing a single example, with the following fields:
-            height: number of rows in the result (32)
-            width: number of columns in the result (32)
-            depth: number of color channels in the result (3)
-            key: a scalar string Tensor describing the filename & record number
-              for this example.
-            label: an int32 Tensor with the label in the range 0..9.
-            uint8image: a [height, width, depth] uint8 Tensor with the image data
-        """
-
-        class CIFAR10Record(object):
-            pass
-
-        result = CIFAR10Record()
-
-        # Dimensions of the images in the CIFAR-10 dataset.
-        # See http://www.cs.toronto.edu/~kriz/cifar.html for a description of the
-        # input format.
-        label_bytes = 1  # 2 for CIFAR-100
-        result.height = 32
-        result.width = 32
-        result.depth = 3
-        image_bytes = result.height * result.width * result.depth
-        # Every record consists of a label followed by the image, with a
-        # fixed number of bytes for each.
-        record_bytes = label_bytes + image_bytes
+    train_batches = None
+    eval_batches = None
 
-        # Read a record, getting filenames from the filename_queue.  No
-        # header or footer in the CIFAR-10 format, so we leave header_bytes
-        # and footer_bytes at their default of 0.
-        reader = tf.FixedLengthRecordReader(record_bytes=record_bytes)
-        result.key, value = reader.read(filename_queue)
-
-        # Convert from a string to a vector of uint8 that is record_bytes long.
-        record_bytes = tf.decode_raw(value, tf.uint8)
-
-        # The first bytes represent the label, which we convert from uint8->int32.
-        result.label = tf.cast(
-            tf.strided_slice(record_bytes, [0], [label_bytes]), tf.int32)
-
-        # The remaining bytes after the label represent the image, which we reshape
-        # from [depth * height * width] to [depth, height, width].
-        depth_major = tf.reshape(
-            tf.strided_slice(record_bytes, [label_bytes],
-                             [label_bytes + image_bytes]),
-            [result.depth, result.height, result.width])
-        # Convert from [depth, height, width] to [height, width, depth].
-        result.uint8image = tf.transpose(depth_major, [1, 2, 0])
-
-        return result
-
-    def _generate_image_and_label_batch(self, image, label, min_queue_examples,
-                                        batch_size, shuffle):
-        """Construct a queued batch of images and labels.
-        Args:
-          image: 3-D Tensor of [height, width, 3] of type.float32.
-          label: 1-D Tensor of type.int32
-          min_queue_examples: int32, minimum number of samples to retain
-            in the queue that provides of batches of examples.
-          batch_size: Number of images per batch.
-          shuffle: boolean indicating whether to use a shuffling queue.
-        Returns:
-          images: Images. 4D tensor of [batch_size, height, width, 3] size.
-          labels: Labels. 1D tensor of [batch_size] size.
-        """
-        # Create a queue that shuffles the examples, and then
-        # read 'batch_size' images + labels from the example queue.
-        num_preprocess_threads = 16
-        if shuffle:
-            images, label_batch = tf.train.shuffle_batch(
-                [image, label],
-                batch_size=batch_size,
-                num_threads=num_preprocess_threads,
-                capacity=min_queue_examples + 3 * batch_size,
-                min_after_dequeue=min_queue_examples)
-        else:
-            images, label_batch = tf.train.batch(
-                [image, label],
-                batch_size=batch_size,
-                num_threads=num_preprocess_threads,
-                capacity=min_queue_examples + 3 * batch_size)
-
-        # Display the training images in the visualizer.
-        tf.summary.image('images', images)
-        return images, tf.reshape(label_batch, [batch_size])
-
-    def distorted_inputs(self, data_dir, batch_size):
-        """Construct distorted input for CIFAR training using the Reader ops.
-        Args:
-          data_dir: Path to the CIFAR-10 data directory.
-          batch_size: Number of images per batch.
-        Returns:
-          images: Images. 4D tensor of [batch_size, IMAGE_SIZE, IMAGE_SIZE, 3] size.
-          labels: Labels. 1D tensor of [batch_size] size.
-        """
-        filenames = [os.path.join(data_dir, 'data_batch_%d.bin' % i)
-                     for i in xrange(1, 6)]
-        for f in filenames:
-            if not tf.gfile.Exists(f):
-                raise ValueError('Failed to find file: ' + f)
-
-        # Create a queue that produces the filenames to read.
-        filename_queue = tf.train.string_input_producer(filenames)
-
-        # Read examples from files in the filename queue.
-        read_input = self.read_cifar10(filename_queue)
-        reshaped_image = tf.cast(read_input.uint8image, tf.float32)
-
-        height = self.IMAGE_SIZE
-        width = self.IMAGE_SIZE
-
-        # Image processing for training the network. Note the many random
-        # distortions applied to the image.
-
-        # Randomly crop a [height, width] section of the image.
-        distorted_image = tf.random_crop(reshaped_image, [height, width, 3])
-
-        # Randomly flip the image horizontally.
-        distorted_image = tf.image.random_flip_left_right(distorted_image)
-
-        # Because these operations are not commutative, consider randomizing
-        # the order their operation.
-        # NOTE: since per_image_standardization zeros the mean and makes
-        # the stddev unit, this likely has no effect see tensorflow#1458.
-        distorted_image = tf.image.random_brightness(distorted_image,
-                                                     max_delta=63)
-        distorted_image = tf.image.random_contrast(distorted_image,
-                                                   lower=0.2, upper=1.8)
-
-        # Subtract off the mean and divide by the variance of the pixels.
-        float_image = tf.image.per_image_standardization(distorted_image)
-
-        # Set the shapes of tensors.
-        float_image.set_shape([height, width, 3])
-        read_input.label.set_shape([1])
-
-        # Ensure that the random shuffling has good mixing properties.
-        min_fraction_of_examples_in_queue = 0.4
-        min_queue_examples = int(self.NUM_EXAMPLES_PER_EPOCH_FOR_TRAIN *
-                                 min_fraction_of_examples_in_queue)
-        print('Filling queue with %d CIFAR images before starting to train. '
-              'This will take a few minutes.' % min_queue_examples)
-
-        # Generate a batch of images and labels by building up a queue of examples.
-        return self._generate_image_and_label_batch(float_image, read_input.label,
-                                               min_queue_examples, batch_size,
-                                               shuffle=True)
+    @staticmethod
+    def standardize(images):
+        # per image standardization, the stddev is bounded from below like tf.image.per_image_standardization
+        pixels = np.prod(images.shape[1:])
+        means = np.mean(images, axis=(1, 2, 3), keepdims=True)
+        stds = np.maximum(np.std(images, axis=(1, 2, 3), keepdims=True), 1.0 / np.sqrt(pixels))
+        return (images - means) / stds
+
+    def distort(self, images):
+        # random crop, horizontal flip, brightness and contrast, vectorized over the batch
+        batch_size = images.shape[0]
+        size = self.IMAGE_SIZE
+        rows = np.random.randint(0, 32 - size + 1, [batch_size, 1]) + np.arange(size)
+        cols = np.random.randint(0, 32 - size + 1, [batch_size, 1]) + np.arange(size)
+        flip = np.random.uniform(size=[batch_size, 1]) < 0.5
+        cols = np.where(flip, cols[:, ::-1], cols)
+        distorted = images[np.arange(batch_size)[:, None, None], rows[:, :, None], cols[:, None, :]].astype(np.float32)
+        distorted += np.random.uniform(-63, 63, [batch_size, 1, 1, 1])
+        channel_means = np.mean(distorted, axis=(1, 2), keepdims=True)
+        distorted = (distorted - channel_means) * np.random.uniform(0.2, 1.8, [batch_size, 1, 1, 1]) + channel_means
+        return self.standardize(distorted).astype(np.float32)
+
+    def crop(self, images):
+        # central crop for evaluation
+        offset = (32 - self.IMAGE_SIZE) // 2
+        cropped = images[:, offset:offset + self.IMAGE_SIZE, offset:offset + self.IMAGE_SIZE].astype(np.float32)
+        return self.standardize(cropped).astype(np.float32)
+
+    def inputs(self, prefetcher, name):
+        images, labels = tf.py_func(prefetcher.next_batch, [], [tf.float32, tf.int32], stateful=True, name=name)
+        images.set_shape([prefetcher.batch_size, self.IMAGE_SIZE, self.IMAGE_SIZE, 3])
+        labels.set_shape([prefetcher.batch_size])
+        return images, labels
 
     def _variable_on_cpu(self, name, shape, initializer):
         """Helper to create a Variable stored on CPU memory.
@@ -757,60 +844,6 @@ class cifar10(Problem):
 
         return var
 
-    def inputs(self, eval_data, data_dir, batch_size):
-        """Construct input for CIFAR evaluation using the Reader ops.
-        Args:
-          eval_data: bool, indicating if one should use the train or eval data set.
-          data_dir: Path to the CIFAR-10 data directory.
-          batch_size: Number of images per batch.
-        Returns:
-          images: Images. 4D tensor of [batch_size, IMAGE_SIZE, IMAGE_SIZE, 3] size.
-          labels: Labels. 1D tensor of [batch_size] size.
-        """
-        if not eval_data:
-            filenames = [os.path.join(data_dir, 'data_batch_%d.bin' % i)
-                         for i in xrange(1, 6)]
-            num_examples_per_epoch = self.NUM_EXAMPLES_PER_EPOCH_FOR_TRAIN
-        else:
-            filenames = [os.path.join(data_dir, 'test_batch.bin')]
-            num_examples_per_epoch = self.NUM_EXAMPLES_PER_EPOCH_FOR_EVAL
-
-        for f in filenames:
-            if not tf.gfile.Exists(f):
-                raise ValueError('Failed to find file: ' + f)
-
-        # Create a queue that produces the filenames to read.
-        filename_queue = tf.train.string_input_producer(filenames)
-
-        # Read examples from files in the filename queue.
-        read_input = self.read_cifar10(filename_queue)
-        reshaped_image = tf.cast(read_input.uint8image, tf.float32)
-
-        height = self.IMAGE_SIZE
-        width = self.IMAGE_SIZE
-
-        # Image processing for evaluation.
-        # Crop the central [height, width] of the image.
-        resized_image = tf.image.resize_image_with_crop_or_pad(reshaped_image,
-                                                               height, width)
-
-        # Subtract off the mean and divide by the variance of the pixels.
-        float_image = tf.image.per_image_standardization(resized_image)
-
-        # Set the shapes of tensors.
-        float_image.set_shape([height, width, 3])
-        read_input.label.set_shape([1])
-
-        # Ensure that the random shuffling has good mixing properties.
-        min_fraction_of_examples_in_queue = 0.4
-        min_queue_examples = int(num_examples_per_epoch *
-                                 min_fraction_of_examples_in_queue)
-
-        # Generate a batch of images and labels by building up a queue of examples.
-        return self._generate_image_and_label_batch(float_image, read_input.label,
-                                               min_queue_examples, batch_size,
-                                               shuffle=False)
-
     def _add_to_list(self, variable, shape):
         flat_shape = np.multiply.reduce(shape)
         # tf.summary.histogram(name, variable)
@@ -830,6 +863,8 @@ class cifar10(Problem):
                 os.makedirs(path)
             filepath = os.path.join(path, CIFAR10_FILE)
             if not os.path.exists(filepath):
+                import tarfile
+                from six.moves import urllib
                 print("Downloading CIFAR10 dataset to {}".format(filepath))
                 url = os.path.join(CIFAR10_URL, CIFAR10_FILE)
                 filepath, _ = urllib.request.urlretrieve(url, filepath)
@@ -886,9 +921,11 @@ class cifar10(Problem):
         self._add_to_list(f3_weights, [f2_out, self.NUM_CLASSES])
         self._add_to_list(f3_biases, [self.NUM_CLASSES])
 
+        self.train_batches = BatchPrefetcher(cifar10_arrays(path, 'train'), 128, self.distort)
+        self.eval_batches = BatchPrefetcher(cifar10_arrays(path, 'test'), 128, self.crop, shuffle=False)
         with tf.device('/cpu:0'):
-            self.train_images_batch, self.train_labels_batch = self.distorted_inputs(path, batch_size=128)
-            self.eval_images_batch, self.eval_labels_batch = self.inputs(True, path, batch_size=128)
+            self.train_images_batch, self.train_labels_batch = self.inputs(self.train_batches, 'cifar10_train_batch')
+            self.eval_images_batch, self.eval_labels_batch = self.inputs(self.eval_batches, 'cifar10_eval_batch')
 
     def network(self, batch, variables):
         conv1 = tf.nn.relu(tf.nn.bias_add(tf.nn.conv2d(batch, variables[0], [1, 1, 1, 1], padding='SAME'), variables[1]))
@@ -959,3 +996,19 @@ class cifar10(Problem):
         # decay terms (L2 loss).
 
         return loss#tf.add_n(tf.get_collection('losses'), name='total_loss')
+
+
+# problems by class name. create_problem instantiates them on demand, the datasets (and their loaders) of problems
+# that are not used are never touched
+problem_registry = dict([(problem_class.__name__, problem_class) for problem_class in
+                         [ElementwiseSquare, Booth, Rosenbrock, RosenbrockMulti, DifferentPowers, FitX, TwoVars,
+                          Quadratic, Mnist, cifar10_old, cifar10]])
+
+
+def create_problem(name, args):
+    return problem_registry[name](dict(args))
+
+
+def problem_factory(name, args):
+    # defers the construction, e.g. until the graph of a benchmark case or worker process exists
+    return lambda: create_problem(name, args)
@@ -0,0 +1,96 @@
+from __future__ import print_function
+import os
+import re
+import collections
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+
+# Traces every interval-th session run of a meta optimizer (see Meta_Optimizer.set_profiler) and sums the kernel
+# time of the traced steps by name scope and by op type. An op counts towards the outermost of the tracked scopes
+# in its name, ops outside of them towards their top level scope. The problem gradients of the steps are built under
+# Problem_Gradients (Problem.get_gradients_raw), every other tf.gradients scope is a meta backward pass (minimize,
+# diagnostics), including the second order ops it adds for the problem gradients.
+
+tracked_scopes = ['gradients', 'Problem_Gradients', 'meta_optimizer_optimizer', 'Input_Normalizer',
+                  'Optimizer_network', 'Optimizer_Network', 'Problem_Loss']
+
+
+class StepProfiler():
+
+    interval = None
+    output_dir = None
+    calls = None
+    traced_steps = None
+    scope_micros = None
+    op_type_micros = None
+
+    def __init__(self, interval=100, output_dir='profile'):
+        self.interval = interval
+        self.output_dir = output_dir
+        self.calls = 0
+        self.traced_steps = 0
+        self.scope_micros = collections.defaultdict(int)
+        self.op_type_micros = collections.defaultdict(int)
+
+    @staticmethod
+    def scope(node_name):
+        components = [re.sub('_[0-9]+$', '', component) for component in node_name.split(':')[0].split('/')]
+        for component in components[:-1]:
+            if component in tracked_scopes:
+                if component == 'gradients':
+                    return 'meta_gradients'
+                if component == 'Problem_Gradients':
+                    return 'problem_gradients'
+                return component
+        return components[0] if len(components) > 1 else 'top_level'
+
+    def run(self, session, fetches):
+        self.calls += 1
+        if self.calls % self.interval != 0:
+            return session.run(fetches)
+        run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+        run_metadata = tf.RunMetadata()
+        results = session.run(fetches, options=run_options, run_metadata=run_metadata)
+        self.collect(session.graph, run_metadata)
+        return results
+
+    def collect(self, graph, run_metadata):
+        self.traced_steps += 1
+        for device_stats in run_metadata.step_stats.dev_stats:
+            # gpu streams trace the same kernels again under their own device names
+            if '/stream:' in device_stats.device:
+                continue
+            for node_stats in device_stats.node_stats:
+                micros = node_stats.all_end_rel_micros
+                node_name = node_stats.node_name.split(':')[0]
+                self.scope_micros[self.scope(node_name)] += micros
+                try:
+                    op_type = graph.get_operation_by_name(node_name).type
+                except KeyError:
+                    op_type = node_name
+                self.op_type_micros[op_type] += micros
+        if not os.path.exists(self.output_dir):
+            os.makedirs(self.output_dir)
+        with open(os.path.join(self.output_dir, 'timeline_' + str(self.calls) + '.json'), 'w') as trace_file:
+            trace_file.write(timeline.Timeline(run_metadata.step_stats).generate_chrome_trace_format())
+
+    def table(self, micros, title, top=20):
+        total = max(sum(micros.values()), 1)
+        lines = [title.ljust(48) + 'ms / step'.rjust(12) + '%'.rjust(8)]
+        for name, name_micros in sorted(micros.items(), key=lambda item: item[1], reverse=True)[:top]:
+            lines.append(name[:47].ljust(48) + '{:12.3f}'.format(name_micros / 1000.0 / self.traced_steps) +
+                         '{:8.1f}'.format(100.0 * name_micros / total))
+        return lines
+
+    def summary(self, top=20):
+        if self.traced_steps == 0:
+            return ''
+        lines = ['Traced steps: ' + str(self.traced_steps) + ' of ' + str(self.calls)]
+        lines += self.table(self.scope_micros, 'SCOPE', top) + [''] + self.table(self.op_type_micros, 'OP TYPE', top)
+        summary = '\n'.join(lines)
+        if not os.path.exists(self.output_dir):
+            os.makedirs(self.output_dir)
+        with open(os.path.join(self.output_dir, 'summary.txt'), 'w') as summary_file:
+            summary_file.write(summary + '\n')
+        return summary
@@ -0,0 +1,121 @@
+from __future__ import print_function
+import os
+import json
+import itertools
+import multiprocessing
+from timeit import default_timer as timer
+import numpy as np
+
+
+# Hyperparameter sweeps on a process pool. Every configuration is a dict of json values, trial_fn(config) builds its
+# own graph and session in a pool worker and returns a dict of json results. Workers are pinned to one core each and
+# should run their session with session_config(), the datasets (problems.mnist_arrays, cifar10_arrays) are decoded
+# once before the pool starts and every worker memory maps the same files. The parent appends a row per finished
+# configuration to one results table (json lines), configurations that already have a row are skipped, so an
+# interrupted sweep continues where it stopped.
+
+
+def grid(space):
+    # space: {name: [values]}, every combination of the values
+    names = sorted(space)
+    return [dict(zip(names, values)) for values in itertools.product(*[space[name] for name in names])]
+
+
+def random_search(space, samples, seed=0):
+    # space: {name: [values]} draws one of the values, {name: (low, high)} draws log uniformly from [low, high].
+    # the draws are seeded, a resumed sweep samples the same configurations again.
+    random = np.random.RandomState(seed)
+    names = sorted(space)
+    configs = []
+    for _ in range(samples):
+        config = dict()
+        for name in names:
+            if isinstance(space[name], tuple):
+                low, high = space[name]
+                config[name] = float(10 ** random.uniform(np.log10(low), np.log10(high)))
+            else:
+                config[name] = space[name][random.randint(len(space[name]))]
+        configs.append(config)
+    return configs
+
+
+def config_key(config):
+    return json.dumps(config, sort_keys=True)
+
+
+def session_config():
+    import tensorflow as tf
+    return tf.ConfigProto(intra_op_parallelism_threads=1, inter_op_parallelism_threads=1)
+
+
+def read_results(path):
+    rows = []
+    if os.path.exists(path):
+        with open(path) as results_file:
+            for line in results_file:
+                # a partial last line of an interrupted write is dropped, its configuration runs again
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    pass
+    return rows
+
+
+def worker_init(worker_count):
+    with worker_count.get_lock():
+        worker_id = worker_count.value
+        worker_count.value += 1
+    if hasattr(os, 'sched_setaffinity'):
+        cores = sorted(os.sched_getaffinity(0))
+        os.sched_setaffinity(0, [cores[worker_id % len(cores)]])
+
+
+def run_trial(args):
+    trial_fn, config = args
+    start = timer()
+    try:
+        result = trial_fn(config)
+    except Exception as error:
+        return config, None, repr(error), timer() - start
+    return config, result, None, timer() - start
+
+
+def run(trial_fn, configs, results_path, num_workers=None, on_result=None):
+    # trial_fn has to be a module level function (it is pickled to the workers). on_result(config, result) is called
+    # in the parent for every finished configuration. Failed configurations are printed and get no row.
+    done = set([config_key(row['config']) for row in read_results(results_path)])
+    pending = [config for config in configs if config_key(config) not in done]
+    print('Sweep: ', len(configs), ' configurations, ', len(configs) - len(pending), ' with results, ', len(pending),
+          ' to run')
+    if not pending:
+        return read_results(results_path)
+    num_workers = multiprocessing.cpu_count() if num_workers is None else num_workers
+    results_dir = os.path.dirname(results_path)
+    if results_dir and not os.path.exists(results_dir):
+        os.makedirs(results_dir)
+    worker_count = multiprocessing.Value('i', 0)
+    # the workers live for the whole sweep, each stays on its core and keeps its memory maps of the dataset
+    pool = multiprocessing.Pool(min(num_workers, len(pending)), initializer=worker_init, initargs=(worker_count,))
+    try:
+        with open(results_path, 'a') as results_file:
+            # rows start on a line of their own after a partial last line
+            if results_file.tell() > 0:
+                with open(results_path, 'rb') as last_file:
+                    last_file.seek(-1, os.SEEK_END)
+                    if last_file.read(1) != b'\n':
+                        results_file.write('\n')
+            for i, (config, result, error, time) in enumerate(pool.imap_unordered(
+                    run_trial, [(trial_fn, config) for config in pending])):
+                if error is not None:
+                    print('FAILED ', config_key(config), ': ', error)
+                    continue
+                results_file.write(json.dumps({'config': config, 'result': result, 'time': time}) + '\n')
+                results_file.flush()
+                print(i + 1, '/', len(pending), ' ', config_key(config), ' time: {0:.2f}s'.format(time))
+                if on_result is not None:
+                    on_result(config, result)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    return read_results(results_path)
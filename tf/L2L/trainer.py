@@ -0,0 +1,302 @@
+from __future__ import print_function
+import tensorflow as tf
+from timeit import default_timer as timer
+import numpy as np
+import util
+
+
+# The meta training loop of the drivers. Every run is a single session.run: the step fetches of the optimizer (meta
+# loss, problem loss, meta step, updates, in graph episode flags) together with the diagnostics of the callbacks that
+# want them in this run. Diagnostics (optimizer norms, meta gradient norms, problem norms, ...) are tensors built
+# before the graph is finalized, a callback only pays for them in the runs it asks for them.
+
+
+class Callback():
+
+    # diagnostics: {name: tensor}, fetched into results['diagnostics'] in the runs wants() returns True for
+    diagnostics = None
+    interval = None
+
+    def __init__(self, interval=None):
+        self.interval = interval
+        self.diagnostics = {}
+
+    def due(self, run):
+        return self.interval is not None and (run + 1) % self.interval == 0
+
+    def wants(self, run):
+        return bool(self.diagnostics) and self.due(run)
+
+    def on_run(self, trainer, run, results):
+        pass
+
+    def on_end(self, trainer, runs):
+        pass
+
+
+class PrintCallback(Callback):
+
+    # prints the running averages every interval runs and at the end of every episode (in graph or by a
+    # ResetCallback), the averages start over with every episode. meta_lr and train_loss are logged to metrics_writer.
+
+    runs = None
+    metrics_writer = None
+    episode_runs = None
+    total_loss_optim = None
+    total_loss_prob = None
+    total_time = None
+    diagnostics_run = None
+
+    def __init__(self, optimizer, interval, runs, metrics_writer=None):
+        super(PrintCallback, self).__init__(interval)
+        self.runs = runs
+        self.metrics_writer = metrics_writer
+        with tf.name_scope('print_diagnostics'):
+            optim_grad = tf.gradients(optimizer.ops_loss_train, optimizer.optimizer_variables)
+            self.diagnostics['optim_norm'] = [tf.norm(variable) for variable in optimizer.optimizer_variables]
+            self.diagnostics['optim_grad_norm'] = [tf.norm(grad) for grad in optim_grad if grad is not None]
+            self.diagnostics['meta_learning_rate'] = optimizer.meta_learning_rate
+            self.diagnostics['problem_norm'] = [tf.add_n([tf.norm(variable) for variable in problem.variables])
+                                                for problem in optimizer.problems]
+        self.reset_averages()
+
+    def reset_averages(self):
+        self.episode_runs = 0
+        self.total_loss_optim = 0
+        self.total_loss_prob = 0
+        self.total_time = 0
+
+    def wants(self, run):
+        # the episode end is only known after the run, its print shows the diagnostics of the last interval print
+        return self.due(run) or self.diagnostics_run is None
+
+    def on_run(self, trainer, run, results):
+        loss_optim = np.mean(results['loss'])
+        loss_prob = np.mean(results['loss_problem'])
+        if self.metrics_writer is not None:
+            self.metrics_writer.log('train_loss', [loss_optim, loss_prob])
+        self.episode_runs += 1
+        self.total_loss_optim += loss_optim
+        self.total_loss_prob += loss_prob
+        self.total_time += results['time']
+        diagnostics = results['diagnostics']
+        if 'optim_norm' in diagnostics:
+            self.diagnostics_run = dict(diagnostics)
+        episode_done = np.any(results['episode_done'])
+        if not self.due(run) and not episode_done:
+            return
+        shown = self.diagnostics_run
+        util.print_update(run, self.runs, self.total_loss_optim / self.episode_runs,
+                          np.log10(self.total_loss_prob / self.episode_runs), self.total_time / self.episode_runs,
+                          shown['optim_norm'], shown['optim_grad_norm'])
+        print('LR: ', shown['meta_learning_rate'])
+        print('PROBLEM NORM: ', shown['problem_norm'])
+        if self.metrics_writer is not None and 'optim_norm' in diagnostics:
+            self.metrics_writer.log('meta_lr', [run + 1, shown['meta_learning_rate']])
+        if episode_done:
+            self.reset_averages()
+
+
+class ResetCallback(Callback):
+
+    # episode resets in python for optimizers without in graph episodes (config episode_horizon): a random horizon of
+    # runs, a vanishing problem loss, a diverged problem norm or a step the guard skipped (config step_guard). the norms
+    # are fetched with the step of every run.
+
+    horizon = None
+    horizon_later = None
+    horizon_switch = None
+    min_loss = None
+    max_norm = None
+    upper_limit = None
+    counter = None
+
+    def __init__(self, optimizer, horizon, horizon_later=None, horizon_switch=0, min_loss=1e-15, max_norm=1e4):
+        super(ResetCallback, self).__init__()
+        self.horizon = horizon
+        self.horizon_later = horizon if horizon_later is None else horizon_later
+        self.horizon_switch = horizon_switch
+        self.min_loss = min_loss
+        self.max_norm = max_norm
+        self.upper_limit = np.random.uniform(horizon[0], horizon[1])
+        self.counter = 1
+        with tf.name_scope('reset_diagnostics'):
+            self.diagnostics['reset_problem_norm'] = [tf.add_n([tf.norm(variable) for variable in problem.variables])
+                                                      for problem in optimizer.problems]
+
+    def wants(self, run):
+        return True
+
+    def on_run(self, trainer, run, results):
+        problem_norm = np.max(results['diagnostics']['reset_problem_norm'])
+        if np.min(results['loss_problem']) < self.min_loss or self.counter >= self.upper_limit or \
+                not problem_norm <= self.max_norm or not np.all(results['step_applied']):
+            horizon = self.horizon if run < self.horizon_switch else self.horizon_later
+            self.upper_limit = np.random.uniform(horizon[0], horizon[1])
+            self.counter = 0
+            trainer.optimizer.run_reset()
+            results['episode_done'] = [True]
+        self.counter += 1
+
+
+class EvaluationCallback(Callback):
+
+    # validates with a validation.ReplicaValidation every interval runs, the mean log loss over the replicas and the
+    # run is handed on as results['evaluation'] (None if every replica diverged)
+
+    validation = None
+    epochs = None
+    print_interval = None
+
+    def __init__(self, validation, interval, epochs, print_interval=None):
+        super(EvaluationCallback, self).__init__(interval)
+        self.validation = validation
+        self.epochs = epochs
+        self.print_interval = print_interval
+
+    def on_run(self, trainer, run, results):
+        if not self.due(run):
+            return
+        trainer.optimizer.run_reset(val=True)
+        print('--- VALIDATION ---')
+        eval_results = self.validation.run(trainer.session, self.epochs, self.print_interval)
+        if eval_results['mean'] is None:
+            results['evaluation'] = None
+            return
+        # mean and quantiles (over the replicas) of the log loss averaged over the validation run
+        avg_eval_loss = np.mean(eval_results['mean'])
+        avg_eval_quantiles = np.mean(eval_results['quantiles'], axis=1)
+        util.write_update([avg_eval_loss] + list(avg_eval_quantiles), eval_results['time'])
+        print('------------------------------------')
+        print('FINAL VALIDATION LOSS: ', avg_eval_loss)
+        print('FINAL VALIDATION LOSS QUANTILES ', self.validation.quantiles, ': ', avg_eval_quantiles)
+        print('DIVERGED REPLICAS: ', eval_results['diverged'])
+        results['evaluation'] = avg_eval_loss
+
+
+class CheckpointCallback(Callback):
+
+    # saves the optimizer through a checkpoints.CheckpointManager after every evaluation (competing for its keep_best
+    # places) and the final network at the end. path_fn(model_id) gives the checkpoint path.
+
+    checkpoint_manager = None
+    path_fn = None
+
+    def __init__(self, checkpoint_manager, path_fn):
+        super(CheckpointCallback, self).__init__()
+        self.checkpoint_manager = checkpoint_manager
+        self.path_fn = path_fn
+
+    def on_run(self, trainer, run, results):
+        if 'evaluation' in results and results['evaluation'] is not None:
+            print('SAVING NETWORK')
+            print('------------------------------------')
+            self.checkpoint_manager.save(self.path_fn(str(run + 1)), results['evaluation'])
+
+    def on_end(self, trainer, runs):
+        save_path = self.path_fn(str(runs) + '_FINAL')
+        print(save_path)
+        self.checkpoint_manager.save(save_path)
+        self.checkpoint_manager.wait()
+        print('Final Network Saved')
+
+
+class NanCallback(Callback):
+
+    # stops the training once a problem or optimizer variable is not finite, checked with the step of every run
+
+    def __init__(self, optimizer):
+        super(NanCallback, self).__init__()
+        with tf.name_scope('nan_diagnostics'):
+            self.diagnostics['nan_problem'] = tf.reduce_any([tf.reduce_any(tf.is_nan(variable))
+                                                             for problem in optimizer.problems
+                                                             for variable in problem.variables])
+            self.diagnostics['nan_optim'] = tf.reduce_any([tf.reduce_any(tf.is_nan(variable))
+                                                           for variable in optimizer.optimizer_variables])
+
+    def wants(self, run):
+        return True
+
+    def on_run(self, trainer, run, results):
+        if results['diagnostics']['nan_problem']:
+            print('NAN found prob after, exit')
+            trainer.stop = True
+        if results['diagnostics']['nan_optim']:
+            print('NAN found optim after, exit')
+            trainer.stop = True
+
+
+class GuardCallback(Callback):
+
+    # stops the training after max_skipped runs in a row the step guard (config step_guard) skipped the updates of a
+    # problem in, the flags come with the step fetches. a skipped step ends the episode (in graph or by a
+    # ResetCallback), only a problem that diverges again right after its reset counts up to max_skipped.
+
+    max_skipped = None
+    skipped = None
+
+    def __init__(self, max_skipped=1):
+        super(GuardCallback, self).__init__()
+        self.max_skipped = max_skipped
+        self.skipped = 0
+
+    def on_run(self, trainer, run, results):
+        if np.all(results['step_applied']):
+            self.skipped = 0
+            return
+        self.skipped += 1
+        print('Step skipped by the guard, non finite or diverged problem')
+        if self.skipped >= self.max_skipped:
+            print('Guard skipped ', self.skipped, ' runs in a row, exit')
+            trainer.stop = True
+
+
+class Trainer():
+
+    optimizer = None
+    session = None
+    callbacks = None
+    fetches = None
+    stop = None
+
+    def __init__(self, optimizer, session, callbacks=None, train=True):
+        self.optimizer = optimizer
+        self.session = session
+        self.callbacks = [] if callbacks is None else callbacks
+        meta_step = optimizer.ops_meta_step_train if optimizer.ops_meta_step_train is not None else \
+            optimizer.ops_meta_step
+        loss, loss_problem, updates = optimizer.ops_loss_train, optimizer.ops_loss_problem_train, \
+            optimizer.ops_updates_train
+        if train and optimizer.steps_per_run > 1 and optimizer.ops_updates_multi_train:
+            # a run advances the problems steps_per_run steps with a meta step each, the losses are of shape
+            # [problems, steps_per_run]
+            loss, loss_problem, updates = optimizer.ops_loss_multi_train, optimizer.ops_loss_problem_multi_train, \
+                optimizer.ops_updates_multi_train
+            meta_step = optimizer.ops_meta_step_multi_train
+        self.fetches = {'loss': loss, 'loss_problem': loss_problem,
+                        'meta_step': meta_step if train else [], 'updates': updates,
+                        'episode_done': optimizer.ops_episode_done if optimizer.ops_episode_done is not None else [],
+                        'step_applied': [optimizer.ops_step_applied[problem] for problem in optimizer.problems
+                                         if problem in optimizer.ops_step_applied]}
+
+    def run_step(self, run):
+        fetches = dict(self.fetches)
+        fetches['diagnostics'] = {}
+        for callback in self.callbacks:
+            if callback.wants(run):
+                fetches['diagnostics'].update(callback.diagnostics)
+        start = timer()
+        results = self.optimizer.session_run(fetches)
+        results['time'] = timer() - start
+        return results
+
+    def run(self, runs, start=0):
+        self.stop = False
+        for run in range(start, runs):
+            results = self.run_step(run)
+            for callback in self.callbacks:
+                callback.on_run(self, run, results)
+            if self.stop:
+                break
+        for callback in self.callbacks:
+            callback.on_end(self, runs)
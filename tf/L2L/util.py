@@ -1,6 +1,7 @@
 from __future__ import print_function
 from timeit import default_timer as timer
 import numpy as np
+import metrics
 
 
 def run_epoch(sess, loss, ops, reset, num_unrolls):
@@ -30,17 +31,11 @@ def print_update(epoch, epochs, optim_loss, prob_loss, time, optim_norm=None, op
 
 
 def write_update(loss, time, problem_norm=None, deltas_norm=None, grads_norm=None):
-    def write_to_file(f_name, list_var):
-        with open(f_name, 'a') as log_file:
-            for variable in list_var:
-                log_file.write(str(variable) + ' ')
-            log_file.write('\n')
-    # with open('loss_file_upd', 'a') as log_file:
-    #     log_file.write("{:.5f}".format(loss) + " " + "{:.2f}".format(time) + "\n")
-    write_to_file('loss', loss)
-    # write_to_file('norm_prob', problem_norm)
-    # write_to_file('norm_delta', deltas_norm)
-    # write_to_file('norm_grads', grads_norm)
+    writer = metrics.get_writer()
+    writer.log('loss', loss)
+    # writer.log('norm_prob', problem_norm)
+    # writer.log('norm_delta', deltas_norm)
+    # writer.log('norm_grads', grads_norm)
 
 
 def get_model_path(flag_optimizer, model_id):
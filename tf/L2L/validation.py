@@ -0,0 +1,65 @@
+from __future__ import print_function
+import tensorflow as tf
+from tensorflow.python.util import nest
+from timeit import default_timer as timer
+import numpy as np
+
+
+class ReplicaValidation():
+
+    # Validates an optimizer on an eval problem holding R replicas (problems created with args['replicas'] = R).
+    # The optimizer advances all replicas with its usual eval update ops, the per replica losses and norms are
+    # read after the updates in the same session call, so one run per step covers every replica.
+
+    problem = None
+    replicas = None
+    quantiles = None
+    max_norm = None
+    abort_fraction = None
+    ops_replica_losses = None
+    ops_replica_norms = None
+    ops_advance_batch = None
+
+    def __init__(self, problem, ops_updates, quantiles=None, max_norm=1e4, abort_fraction=1.0):
+        self.problem = problem
+        self.replicas = problem.replicas
+        self.quantiles = [10, 50, 90] if quantiles is None else quantiles
+        self.max_norm = max_norm
+        # the run stops in the step the diverged (non finite or max_norm) replicas reach this fraction
+        self.abort_fraction = abort_fraction
+        with tf.name_scope('replica_validation'):
+            with tf.control_dependencies(nest.flatten(ops_updates)):
+                self.ops_replica_losses = problem.replica_losses(problem.variables, 'validation')
+                self.ops_replica_norms = problem.replica_norms(problem.variables)
+            with tf.control_dependencies([self.ops_replica_losses]):
+                self.ops_advance_batch = problem.advance_batch('validation')
+
+    def curves(self, losses, diverged):
+        log_losses = np.log10(losses[:, np.logical_not(diverged)] + 1e-20)
+        if log_losses.shape[1] == 0:
+            return None, None
+        return np.mean(log_losses, axis=1), np.percentile(log_losses, self.quantiles, axis=1)
+
+    def run(self, session, epochs, print_interval=None):
+        losses = np.zeros([epochs, self.replicas])
+        diverged = np.zeros([self.replicas], dtype=bool)
+        start = timer()
+        for epoch in range(epochs):
+            losses[epoch], norms, _ = session.run([self.ops_replica_losses, self.ops_replica_norms,
+                                                   self.ops_advance_batch])
+            diverged = np.logical_or(diverged, np.logical_or(norms > self.max_norm, np.isnan(norms)))
+            if np.mean(diverged) >= self.abort_fraction:
+                losses = losses[:epoch + 1]
+                print('Replicas diverged: ', np.sum(diverged), ', validation aborted')
+                break
+            if print_interval is not None and (epoch + 1) % print_interval == 0:
+                mean_curve, quantile_curves = self.curves(losses[:epoch + 1], diverged)
+                print('------------------------------------')
+                print('EVAL EPOCH: ', epoch)
+                print('VALIDATION LOSS MEAN: ', mean_curve[-1])
+                print('VALIDATION LOSS QUANTILES ', self.quantiles, ': ', quantile_curves[:, -1])
+                print('DIVERGED REPLICAS: ', np.sum(diverged))
+        total_time = timer() - start
+        mean_curve, quantile_curves = self.curves(losses, diverged)
+        return {'mean': mean_curve, 'quantiles': quantile_curves, 'diverged': int(np.sum(diverged)),
+                'time': total_time / len(losses)}